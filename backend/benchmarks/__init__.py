@@ -0,0 +1 @@
+"""Offline benchmarks (run as modules, e.g. `python -m backend.benchmarks.extraction`)."""
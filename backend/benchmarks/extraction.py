@@ -0,0 +1,279 @@
+"""Offline benchmark for the BOM extraction pipeline.
+
+Runs `perform_bom_extraction` over a corpus (default: `test_boms/`) with a
+record/replay LM stand-in and reports per-stage timings, cache hit ratio and
+row-level accuracy against golden BOMs as JSON, so runs can be diffed across
+commits.
+
+Usage:
+    # 1. Record real model responses once (needs Vertex credentials)
+    python -m backend.benchmarks.extraction --lm record
+    # 2. Review the extracted BOMs, then store them as golden BOMs
+    python -m backend.benchmarks.extraction --write-golden
+    # 3. Benchmark offline
+    python -m backend.benchmarks.extraction --output bench.json
+
+Each run uses fresh cache directories: pass 1 is cold, later passes measure
+warm-cache behaviour. Golden BOMs are never generated implicitly; files without
+one are reported without accuracy.
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(os.path.dirname(BENCH_DIR))
+DEFAULT_CORPUS = os.path.join(REPO_ROOT, "test_boms")
+DEFAULT_GOLDEN_DIR = os.path.join(BENCH_DIR, "golden")
+DEFAULT_RECORDINGS = os.path.join(BENCH_DIR, "recordings", "extraction_lm.json")
+SUPPORTED_SUFFIXES = (".pdf", ".png", ".jpg", ".jpeg", ".tif", ".tiff")
+
+
+# --- Accuracy ------------------------------------------------------------------
+
+
+def _normalize(value) -> str:
+    return re.sub(r"\s+", "", str(value or "")).lower()
+
+
+def _row_key(row: Dict) -> str:
+    return _normalize(row.get("item_nr")) or _normalize(row.get("description"))
+
+
+def _same_quantity(a, b) -> bool:
+    if a is None or b is None:
+        return a is b
+    return abs(float(a) - float(b)) < 1e-6
+
+
+def score_rows(predicted: List[Dict], golden: List[Dict]) -> Dict:
+    """Row-level accuracy of predicted BOM rows against golden rows.
+
+    Rows are paired by normalized item number (description as fallback). A
+    paired row is exact when quantity and unit also match.
+    """
+    remaining: Dict[str, List[Dict]] = {}
+    for row in golden:
+        remaining.setdefault(_row_key(row), []).append(row)
+
+    matched = exact = 0
+    for row in predicted:
+        candidates = remaining.get(_row_key(row))
+        if not candidates:
+            continue
+        expected = candidates.pop(0)
+        matched += 1
+        if _same_quantity(row.get("quantity"), expected.get("quantity")) and _normalize(
+            row.get("unit")
+        ) == _normalize(expected.get("unit")):
+            exact += 1
+
+    precision = exact / len(predicted) if predicted else 0.0
+    recall = exact / len(golden) if golden else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {
+        "golden_rows": len(golden),
+        "predicted_rows": len(predicted),
+        "matched_rows": matched,
+        "exact_rows": exact,
+        "precision": round(precision, 4),
+        "recall": round(recall, 4),
+        "f1": round(f1, 4),
+    }
+
+
+def _golden_path(golden_dir: str, filename: str) -> str:
+    return os.path.join(golden_dir, f"{filename}.json")
+
+
+def _bom_rows(bom) -> List[Dict]:
+    fields = ("part_number", "item_nr", "quantity", "unit", "description")
+    return [{field: getattr(item, field) for field in fields} for item in bom.items]
+
+
+# --- Runner --------------------------------------------------------------------
+
+
+def _configure_environment(work_dir: str, args) -> None:
+    # Must run before backend modules are imported: caches are created at import time.
+    os.environ["BOM_CACHE_PATH"] = os.path.join(work_dir, "bom_cache.sqlite")
+    os.environ["BOM_CACHE_LEGACY_PATH"] = os.path.join(work_dir, "bom_cache.pkl")
+    os.environ["PDF_RASTER_CACHE_DIR"] = os.path.join(work_dir, "raster_cache")
+    os.environ["STATE_BACKEND"] = "memory"
+    if args.no_cache:
+        os.environ["BOM_CACHE_ENABLED"] = "false"
+
+
+def _build_lm(args):
+    from backend.src.config import AVAILABLE_MODELS
+    from backend.benchmarks.replay_lm import ReplayLM
+
+    real_lm = AVAILABLE_MODELS[args.model] if args.lm in ("record", "live") else None
+    if args.lm == "live":
+        return real_lm
+    return ReplayLM(args.recordings, inner=real_lm, record=args.lm == "record")
+
+
+def _corpus_files(paths: List[str]) -> List[str]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, name)
+                for name in sorted(os.listdir(path))
+                if name.lower().endswith(SUPPORTED_SUFFIXES)
+            )
+        elif os.path.isfile(path):
+            files.append(path)
+    return files
+
+
+def _run_file(path: str, args, golden_dir: str) -> Dict:
+    from backend.src.profiling import record_stages
+    from backend.src.store import BOMStore
+    from backend.src.tools.bom_extraction.bom_tool import perform_bom_extraction
+
+    filename = os.path.basename(path)
+    result: Dict = {"file": filename}
+    start = time.perf_counter()
+    with record_stages() as recorder:
+        output = perform_bom_extraction(path, multi_page=args.multi_page)
+    result["total_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    result.update(recorder.as_dict())
+
+    match = re.search(r"Reference ID: (BOM_[A-F0-9]+)", output)
+    entry = BOMStore().get_bom(match.group(1)) if match else None
+    if entry is None:
+        result["error"] = output
+        return result
+
+    rows = _bom_rows(entry["bom"])
+    result["rows"] = len(rows)
+    golden_file = _golden_path(golden_dir, filename)
+    if args.write_golden:
+        os.makedirs(golden_dir, exist_ok=True)
+        with open(golden_file, "w") as f:
+            json.dump({"title": entry["bom"].title, "items": rows}, f, indent=2, ensure_ascii=False)
+        result["golden_written"] = True
+    elif os.path.exists(golden_file):
+        with open(golden_file, "r") as f:
+            result["accuracy"] = score_rows(rows, json.load(f)["items"])
+    return result
+
+
+def _summarize(results: List[Dict]) -> Dict:
+    ok = [r for r in results if "error" not in r]
+    stages: Dict[str, float] = {}
+    counters: Dict[str, int] = {}
+    for r in ok:
+        for name, ms in r.get("stages_ms", {}).items():
+            stages[name] = round(stages.get(name, 0.0) + ms, 3)
+        for name, value in r.get("counters", {}).items():
+            counters[name] = counters.get(name, 0) + value
+    hits = counters.get("cache_hit", 0) + counters.get("cache_hit_approximate", 0)
+    lookups = hits + counters.get("cache_miss", 0)
+    scored = [r["accuracy"] for r in ok if "accuracy" in r]
+    return {
+        "files": len(results),
+        "errors": len(results) - len(ok),
+        "total_ms": round(sum(r["total_ms"] for r in ok), 3),
+        "median_ms": round(statistics.median(r["total_ms"] for r in ok), 3) if ok else None,
+        "stages_ms": stages,
+        "counters": counters,
+        "cache_hit_ratio": round(hits / lookups, 4) if lookups else None,
+        "mean_f1": round(statistics.mean(a["f1"] for a in scored), 4) if scored else None,
+        "scored_files": len(scored),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("corpus", nargs="*", default=[DEFAULT_CORPUS], help="Files or directories to extract.")
+    parser.add_argument("--lm", choices=("replay", "record", "live"), default="replay")
+    parser.add_argument("--model", default="gemini-2.5-flash", help="Model used by --lm record/live.")
+    parser.add_argument("--recordings", default=DEFAULT_RECORDINGS)
+    parser.add_argument("--golden-dir", default=DEFAULT_GOLDEN_DIR)
+    parser.add_argument("--write-golden", action="store_true", help="Store the extracted BOMs as golden BOMs.")
+    parser.add_argument("--passes", type=int, default=2, help="Pass 1 is cold; later passes hit warm caches.")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the BOM cache.")
+    parser.add_argument("--multi-page", action="store_true")
+    parser.add_argument(
+        "--with-matching", action="store_true",
+        help="Run Xentral/Supabase matching (needs DB access; skipped by default).",
+    )
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout.")
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="kakoai-bench-")
+    _configure_environment(work_dir, args)
+
+    import dspy
+
+    dspy.configure(lm=_build_lm(args))
+
+    from backend.src.tools.bom_extraction import bom_tool
+
+    if not args.with_matching:
+        bom_tool.perform_bom_matching = lambda bom: bom
+
+    from backend.src import config
+
+    files = _corpus_files(args.corpus)
+    passes = []
+    # Pipeline logging goes to stderr so stdout stays valid JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        for index in range(1 if args.write_golden else max(args.passes, 1)):
+            results = [_run_file(path, args, args.golden_dir) for path in files]
+            passes.append({"pass": index + 1, "summary": _summarize(results), "results": results})
+
+    report = {
+        "benchmark": "bom_extraction",
+        "timestamp": datetime.now().isoformat(),
+        "commit": _git_commit(),
+        "lm": args.lm,
+        "multi_page": args.multi_page,
+        "matching": args.with_matching,
+        "config": {
+            name: getattr(config, name)
+            for name in (
+                "BOM_CACHE_ENABLED",
+                "BOM_CACHE_PHASH_ENABLED",
+                "BOM_IMAGE_CROP_ENABLED",
+                "BOM_IMAGE_TOKEN_BUDGET",
+                "BOM_IMAGE_MIN_SCALE",
+            )
+        },
+        "passes": passes,
+    }
+    payload = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+    return 0 if all(p["summary"]["errors"] == 0 for p in passes) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
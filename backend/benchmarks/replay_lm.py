@@ -0,0 +1,88 @@
+"""Record/replay language model stand-in for offline benchmarks.
+
+`ReplayLM` is a `dspy.BaseLM`, so the full DSPy path (adapter formatting,
+parsing into `RawBillOfMaterials`) still runs; only the network call is
+replaced. Responses are keyed by a hash of the request messages, which include
+the base64 image, so a recording is only replayed for exactly the same prompt
+and model image.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from types import SimpleNamespace
+from typing import Dict, Optional
+
+import dspy
+
+
+class ReplayMiss(RuntimeError):
+    """No recorded response exists for a request in replay mode."""
+
+
+def request_key(messages) -> str:
+    serialized = json.dumps(messages, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class ReplayLM(dspy.BaseLM):
+    """Replays recorded responses; in record mode forwards to `inner` and stores them.
+
+    Args:
+        recordings_path: JSON file holding {request_key: {"content", "usage", "model"}}.
+        inner: Real LM used in record mode.
+        record: Forward misses to `inner` and save the response.
+    """
+
+    def __init__(self, recordings_path: str, inner: Optional[dspy.BaseLM] = None, record: bool = False):
+        model = f"replay/{getattr(inner, 'model', 'recorded')}"
+        super().__init__(model=model, cache=False)
+        if record and inner is None:
+            raise ValueError("Record mode needs a real LM to forward to.")
+        self.recordings_path = recordings_path
+        self.inner = inner
+        self.record = record
+        self._lock = threading.Lock()
+        self._recordings: Dict[str, Dict] = {}
+        if os.path.exists(recordings_path):
+            with open(recordings_path, "r") as f:
+                self._recordings = json.load(f)
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.recordings_path) or ".", exist_ok=True)
+        tmp_path = f"{self.recordings_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._recordings, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.recordings_path)
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        messages = messages or [{"role": "user", "content": prompt}]
+        key = request_key(messages)
+        with self._lock:
+            recorded = self._recordings.get(key)
+
+        if recorded is None:
+            if not self.record:
+                raise ReplayMiss(
+                    f"No recorded LM response for request {key[:12]}; run with --lm record first."
+                )
+            response = self.inner.forward(prompt=prompt, messages=messages, **kwargs)
+            recorded = {
+                "content": response.choices[0].message.content,
+                "usage": {
+                    k: v for k, v in dict(response.usage or {}).items() if isinstance(v, (int, float))
+                },
+                "model": getattr(response, "model", self.inner.model),
+            }
+            with self._lock:
+                self._recordings[key] = recorded
+                self._save()
+
+        message = SimpleNamespace(content=recorded["content"], tool_calls=None)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=message, logprobs=None, finish_reason="stop")],
+            usage=dict(recorded.get("usage") or {}),
+            model=recorded.get("model", self.model),
+        )
@@ -2,9 +2,24 @@
 
 from __future__ import annotations
 
+from typing import Callable
+
 import dspy
 
-from backend.src.tools.bom_extraction.bom_tool import perform_bom_extraction
+from backend.src import cascade
+from backend.src.config import WORKFLOWS_ENABLED
+from backend.src.instrumentation import call_site
+from backend.src.observations import compact_tool, read_observation
+from backend.src.speculation import speculation_scope, speculative
+from backend.src.tool_runner import ToolRunner
+from backend.src.tracing import traced
+from backend.src.routing import QueryRouter
+from backend.src.workflows import WorkflowEngine
+from backend.src.tools.bom_extraction.bom_tool import (
+    perform_bom_extraction,
+    list_drawing_candidates,
+    prefetch_drawings,
+)
 from backend.src.tools.demand_analysis.inventory import (
     get_sales_orders,
     get_future_boms,
@@ -43,6 +58,8 @@ class KakoAgentSignature(dspy.Signature):
     - TRANSPARENCY: If a tool returns a result that is slightly different from the request (e.g., User asked for drawing "XX3" but the tool returned "XX4" or "XX3_Rev2"), YOU MUST PAUSE.
       -> State clearly: "I could not find 'XX3', but I found 'XX4'. Should I proceed with this file?"
       -> Do NOT assume the fuzzy match is correct without user confirmation.
+      -> If the user is unsure of a drawing name, use `list_drawing_candidates` and let them pick.
+      -> If the user names several drawings (or sales orders), call `prefetch_drawings` once first, then extract them one by one.
     - NEXT MOVES: Never leave the user hanging. After presenting a result, always suggest the immediate next step.
       -> Example: "The BOM is extracted. Would you like me to run a stock feasibility check now?"
     - EXPLAIN YOUR ACTIONS: Briefly explain why you ran a tool. "I am checking the warehouse stock to see if we can fulfill this order immediately."
@@ -95,14 +112,22 @@ class KakoAgentSignature(dspy.Signature):
        - YOU MUST pass this string into subsequent tools (`filter_sellers_by_shipping`, `sort_and_filter_by_best_price`) as the `data` argument.
        - IMPORTANT: `search_part_by_mpn` takes a LIST of strings, e.g., `["MPN1"]`, NOT a single string.
        - DO NOT ask the user to provide the JSON data.
+
+    7. PARALLEL LOOKUPS:
+       - If you need several lookups that do NOT depend on each other (stock for several products, several MPN searches, BOMs for several orders), call `run_parallel` ONCE with all of them instead of one step per lookup.
+       - Never batch a call that needs the result of another call in the same batch.
+
+    8. SHORTENED TOOL RESULTS:
+       - Large tool results are shown in a compact form (tables with the first rows only) ending in "[full result: OBS_XXXXXXXX ...]".
+       - The counts and totals in the compact form are complete. If you need rows that are not shown, call `read_observation` with that OBS_ ID and a `start_row`.
        - DO NOT invent a fake `search_id`.
 
-    7. NO FAKE TOOL CALLS:
+    9. NO FAKE TOOL CALLS:
        - You cannot "call" a tool by writing "CALL: tool_name(...)" in the final response.
        - This does NOTHING. You must use the proper tool usage format to trigger the backend execution.
        - If you need information, select the tool in the `next_tool_name` field.
     
-    8. CRITICAL - HISTORY RETRIEVAL PROTOCOL:
+    10. CRITICAL - HISTORY RETRIEVAL PROTOCOL:
     - Your memory is the `history` field. It contains previous tool outputs and IDs.
     - BEFORE you plan a tool call, you MUST perform a "History Scan":
       1.  Does the user's request refer to a "missing part", "this item", or "the BOM"?
@@ -110,7 +135,7 @@ class KakoAgentSignature(dspy.Signature):
       3.  ONLY after quoting it can you use it in a tool.
     - FAILURE MODE: If you catch yourself inventing an ID (e.g., "123-456") or saying "I don't have context," STOP. Look at the history again. The data is there.
 
-    9. STRICT DATA FIDELITY (ANTI-HALLUCINATION):
+    11. STRICT DATA FIDELITY (ANTI-HALLUCINATION):
     - NEVER 'translate' or guess a Manufacturer Part Number (MPN).
     - If the history contains an item number like 'A KU A 012...', you MUST use that exact string for 'search_part_by_mpn'.
     - You are strictly forbidden from using internal knowledge to substitute an ID from history with a different number (e.g., do NOT use '5034800800' if it is not in the text).
@@ -151,8 +176,12 @@ class KakoPlanner(dspy.Signature):
                                 "Additional Information (Quantity of items, helpful tips, constraints, ...) To support the user query."
                                     )
 
-TOOLBOX = [
+# Large results reach the LM in compact form (see observations.py); every call is a tracing span.
+# Likely follow-up calls are prefetched while the LM generates the next step (see speculation.py).
+TOOLBOX = [compact_tool(speculative(traced(f"tool.{tool.__name__}")(tool))) for tool in (
     perform_bom_extraction,
+    list_drawing_candidates,
+    prefetch_drawings,
     # demand analysis
     bom_check,
     check_feasibility,
@@ -166,7 +195,9 @@ TOOLBOX = [
     search_part_by_mpn,
     find_alternatives,
     optimize_order,
-]
+)] + [traced("tool.read_observation")(read_observation)]
+# Independent calls of one step run concurrently (see tool_runner.py)
+TOOLBOX.append(traced("tool.run_parallel")(ToolRunner(TOOLBOX).run_parallel))
 
 
 class KakoAgent:
@@ -175,17 +206,45 @@ class KakoAgent:
     def __init__(self) -> None:
         self.data = dspy.ChainOfThought(KakoPlanner)
         self.agent = dspy.ReAct(KakoAgentSignature, tools=TOOLBOX)
+        self.router = QueryRouter()
+        self.workflows = WorkflowEngine() if WORKFLOWS_ENABLED else None
            
+    def _planner(self, user_query: str, history: dspy.History) -> Callable[[], dspy.Prediction]:
+        """Zero-argument planner call for the router, attributed to the 'planner' call site."""
+
+        def run() -> dspy.Prediction:
+            with call_site("planner"), cascade.stage("planner"):
+                return self.data(history=history, query=user_query)
+
+        return run
+
+    @traced("KakoAgent.__call__")
     def __call__(
         self, user_query: str, history: dspy.History | None = None
     ) -> dspy.Prediction:
-        """Invoke the agent with a natural-language request and return the ReAct prediction."""
+        """Invoke the agent with a natural-language request and return the ReAct prediction.
+
+        Common tool chains (upload -> extraction, BOM -> feasibility/optimization)
+        run as deterministic workflows with a single summarizing LM call (see
+        workflows.py). Otherwise, the planner pre-pass only runs when the router
+        decides the query needs data from the history (see routing.py). Tool
+        calls of the request may be served by prefetches (see speculation.py).
+        """
         if history is None:
             history = dspy.History(messages=[])
 
-        extract = self.data(history=history, query=user_query)
-
-        locked_query = (f"{user_query}. You MUST use this data: {extract.data}"
-                        f"and additional information: {extract.context}")
-
-        return self.agent(user_query=locked_query, history=history)
\ No newline at end of file
+        with speculation_scope(user_query):
+            matched = self.workflows.match(user_query, history) if self.workflows else None
+            if matched is not None:
+                steps, state = matched
+                return self.workflows.run(steps, state, user_query)
+
+            _, extract = self.router.plan(self._planner(user_query, history), user_query, history)
+            if extract is not None:
+                user_query = (f"{user_query}. You MUST use this data: {extract.data}"
+                              f"and additional information: {extract.context}")
+
+            # "auto" model: a failed validation re-runs the loop on a stronger model (see cascade.py)
+            return cascade.run(
+                "react", lambda: self.agent(user_query=user_query, history=history), cascade.react_failure
+            )
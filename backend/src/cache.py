@@ -0,0 +1,190 @@
+"""Bounded in-memory cache used by the process-local stores.
+
+`BoundedCache` is an LRU keyed by string with three limits: entry count,
+resident bytes (estimated via the pickled size of each value) and a TTL that is
+refreshed whenever a key is written. Entries may name a parent key; a lineage
+(e.g. SEARCH_ results derived via `previous_id`) is kept together: touching a
+child also touches its ancestors, and evicting an entry evicts its descendants,
+so a chain never ends up with dangling references in the middle. Expiry only
+removes entries whose own TTL has passed: a child written after its parent
+outlives it and becomes the root of its remaining lineage.
+
+A value larger than the byte limit is rejected with `ValueTooLarge` rather
+than stored and evicted at once, so callers never hand out an ID for it.
+"""
+from __future__ import annotations
+
+import pickle
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from backend.src import metrics
+
+
+class ValueTooLarge(ValueError):
+    """A value exceeds the cache's total byte limit on its own."""
+
+
+def estimate_size(value: Any) -> int:
+    """Approximate resident size of a value in bytes."""
+    try:
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(value)
+
+
+class _Entry:
+    __slots__ = ("value", "size", "expires_at", "parent", "children")
+
+    def __init__(self, value: Any, size: int, expires_at: float, parent: Optional[str]):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+        self.parent = parent
+        self.children: set = set()
+
+
+class BoundedCache:
+    """Thread-safe, size-aware LRU with TTL and lineage-aware eviction."""
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int = 1000,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl_seconds: float = 3600,
+        sizeof: Callable[[Any], int] = estimate_size,
+    ) -> None:
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._sizeof = sizeof
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+        metrics.register_cache(self)
+
+    # --- Internal helpers (lock held) ---------------------------------------
+
+    def _remove(self, key: str, counter: Optional[str], now: Optional[float] = None) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry.size
+        if counter:
+            self._counters[counter] += 1
+        if entry.parent and entry.parent in self._entries:
+            self._entries[entry.parent].children.discard(key)
+        for child in list(entry.children):
+            child_entry = self._entries.get(child)
+            if counter == "expirations" and child_entry is not None and child_entry.expires_at > now:
+                # Expiry of the parent does not cut short a child that is still valid
+                child_entry.parent = None
+            else:
+                self._remove(child, counter, now)
+
+    def _touch(self, key: str) -> None:
+        # Refresh the entry and its ancestors so a lineage ages as one unit.
+        seen = set()
+        while key and key in self._entries and key not in seen:
+            seen.add(key)
+            self._entries.move_to_end(key)
+            key = self._entries[key].parent
+
+    def _expire(self, now: float) -> None:
+        expired = [k for k, e in self._entries.items() if e.expires_at <= now]
+        for key in expired:
+            self._remove(key, "expirations", now)
+
+    def _enforce_limits(self) -> None:
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            oldest = next(iter(self._entries))
+            self._remove(oldest, "evictions")
+
+    # --- Public API -----------------------------------------------------------
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters["misses"] += 1
+                return default
+            now = time.monotonic()
+            if entry.expires_at <= now:
+                self._remove(key, "expirations", now)
+                self._counters["misses"] += 1
+                return default
+            self._touch(key)
+            self._counters["hits"] += 1
+            return entry.value
+
+    def set(self, key: str, value: Any, parent: Optional[str] = None) -> None:
+        size = self._sizeof(value)
+        if size > self.max_bytes:
+            raise ValueTooLarge(f"{self.name}: value of {size} bytes exceeds the limit of {self.max_bytes} bytes")
+        with self._lock:
+            now = time.monotonic()
+            existing = self._entries.get(key)
+            children = set()
+            if existing is not None:
+                children = existing.children
+                self._bytes -= existing.size
+                if existing.parent and existing.parent in self._entries:
+                    self._entries[existing.parent].children.discard(key)
+                del self._entries[key]
+
+            if parent is not None and parent not in self._entries:
+                parent = None
+            entry = _Entry(value, size, now + self.ttl_seconds, parent)
+            entry.children = children
+            self._entries[key] = entry
+            self._bytes += size
+            if parent is not None:
+                self._entries[parent].children.add(key)
+            self._touch(key)
+
+            self._expire(now)
+            self._enforce_limits()
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            self._remove(key, None)
+            return entry.value
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        with self._lock:
+            self._expire(time.monotonic())
+            return iter([(k, e.value) for k, e in self._entries.items()])
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, **self._counters}
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry.expires_at > time.monotonic()
+
+    def __getitem__(self, key: str) -> Any:
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.set(key, value)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
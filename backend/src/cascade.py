@@ -0,0 +1,161 @@
+"""Model cascade for the "auto" model option.
+
+Requests with `model_id="auto"` do not use one model for everything. Each stage
+gets the models listed for it in `CASCADE_POLICY`:
+
+- `router`, `planner` and `title` run on the first (cheap) model only;
+- `react` and `extraction` start on the first model. They move to the next one
+  only when the result fails validation: a parse error of the structured output
+  (e.g. `RawBillOfMaterials`), a tool call whose arguments were rejected, or an
+  empty result.
+
+Every attempt is a `cascade.<stage>` span. Attempts, escalations, latency and
+LM cost per stage and model are exported as `kakoai_cascade_*` metrics. With an
+explicitly selected model, none of this applies and every stage uses that model.
+"""
+from __future__ import annotations
+
+import contextlib
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import dspy
+from dspy.utils.exceptions import AdapterParseError
+
+from backend.src import metrics, tracing
+from backend.src.config import AVAILABLE_MODELS, CASCADE_POLICY
+
+AUTO_MODEL_ID = "auto"
+
+CASCADE_ATTEMPTS = metrics.Counter(
+    "kakoai_cascade_attempts_total",
+    "Cascade attempts by stage, model and outcome (accepted, escalated, exhausted, error).",
+)
+CASCADE_LATENCY = metrics.Histogram("kakoai_cascade_latency_seconds", "Cascade attempt latency by stage and model.")
+CASCADE_COST = metrics.Counter("kakoai_cascade_cost_usd_total", "LM cost of cascade attempts by stage and model.")
+
+# Failures of the model's output rather than of the service: worth a stronger model
+# (pydantic's ValidationError is a ValueError)
+_VALIDATION_ERRORS = (AdapterParseError, ValueError)
+# Tool argument errors as dspy.ReAct records them in the observation
+_ARG_ERROR_MARKERS = ("is not in the tool's args", "is invalid:", "validation error")
+
+_active: ContextVar[bool] = ContextVar("cascade_active", default=False)
+_attempt: ContextVar[Optional[dict]] = ContextVar("cascade_attempt", default=None)
+
+
+def _parse_policy(spec: str) -> Dict[str, List[str]]:
+    """Parse "stage=model>fallback,..." into {stage: [model, fallback]} (unknown models are skipped)."""
+    policy = {}
+    for item in spec.split(","):
+        stage, _, chain = item.partition("=")
+        models = [model.strip() for model in chain.split(">") if model.strip()]
+        unknown = [model for model in models if model not in AVAILABLE_MODELS]
+        if unknown:
+            print(f"Warning: Unknown cascade models for '{stage.strip()}': {unknown}")
+        models = [model for model in models if model in AVAILABLE_MODELS]
+        if stage.strip() and models:
+            policy[stage.strip()] = models
+    return policy
+
+
+POLICY = _parse_policy(CASCADE_POLICY)
+
+
+@contextlib.contextmanager
+def cascade_scope(enabled: bool) -> Iterator[None]:
+    """Apply the cascade policy to the stages run in this block (if `enabled`)."""
+    token = _active.set(enabled)
+    try:
+        yield
+    finally:
+        _active.reset(token)
+
+
+def is_active() -> bool:
+    return _active.get()
+
+
+def policy_lm(stage: str) -> Optional[dspy.LM]:
+    """First model of the stage's policy (None if the policy has no entry for it)."""
+    models = POLICY.get(stage)
+    return AVAILABLE_MODELS[models[0]] if models else None
+
+
+def stage_lm(stage: str) -> Optional[dspy.LM]:
+    """Model for a single-model stage: its policy model inside a cascade scope, else None."""
+    return policy_lm(stage) if is_active() else None
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Run the block on the stage's policy model when the cascade is active."""
+    lm = stage_lm(name)
+    with dspy.context(lm=lm) if lm is not None else contextlib.nullcontext():
+        yield
+
+
+def add_cost(cost: float) -> None:
+    """Attribute an LM call's cost to the running cascade attempt (called by the LM instrumentation)."""
+    attempt = _attempt.get()
+    if attempt is not None:
+        attempt["cost"] += cost
+
+
+def run(stage: str, fn: Callable[[], Any], validate: Optional[Callable[[Any], Optional[str]]] = None) -> Any:
+    """Run `fn` on the stage's models in order until its result passes validation.
+
+    Args:
+        stage: Policy stage name (e.g. "react", "extraction").
+        fn: Zero-argument callable making the stage's LM call(s).
+        validate: Returns a failure reason for a result, or None if it is acceptable.
+
+    Returns:
+        The first accepted result, or the last model's result if none was accepted.
+    """
+    models = POLICY.get(stage) if is_active() else None
+    if not models:
+        return fn()
+
+    for tier, model_id in enumerate(models):
+        last = tier == len(models) - 1
+        attempt = {"cost": 0.0}
+        token = _attempt.set(attempt)
+        start = time.perf_counter()
+        try:
+            with tracing.span(f"cascade.{stage}", **{"kakoai.cascade.model": model_id, "kakoai.cascade.tier": tier}):
+                with dspy.context(lm=AVAILABLE_MODELS[model_id]):
+                    result = fn()
+            reason = validate(result) if validate else None
+        except _VALIDATION_ERRORS as e:
+            if last:
+                CASCADE_ATTEMPTS.inc(stage=stage, model=model_id, outcome="error")
+                raise
+            result, reason = None, type(e).__name__
+        finally:
+            _attempt.reset(token)
+            CASCADE_LATENCY.observe(time.perf_counter() - start, stage=stage, model=model_id)
+            CASCADE_COST.inc(attempt["cost"], stage=stage, model=model_id)
+
+        if reason is None or last:
+            CASCADE_ATTEMPTS.inc(stage=stage, model=model_id, outcome="accepted" if reason is None else "exhausted")
+            return result
+        CASCADE_ATTEMPTS.inc(stage=stage, model=model_id, outcome="escalated")
+        print(f"--- [Cascade] {stage}: {model_id} failed validation ({reason}), escalating to {models[tier + 1]} ---")
+
+
+def react_failure(prediction: dspy.Prediction) -> Optional[str]:
+    """Failure reason of a ReAct prediction: an empty answer or a tool whose last call had invalid arguments."""
+    if not str(getattr(prediction, "process_result", "") or "").strip():
+        return "empty_result"
+    trajectory = getattr(prediction, "trajectory", None) or {}
+    last_calls: Dict[str, str] = {}
+    index = 0
+    while f"tool_name_{index}" in trajectory:
+        last_calls[str(trajectory[f"tool_name_{index}"])] = str(trajectory.get(f"observation_{index}", ""))
+        index += 1
+    for tool_name, observation in last_calls.items():
+        if observation.startswith("Execution error in") and any(m in observation for m in _ARG_ERROR_MARKERS):
+            return f"invalid_args:{tool_name}"
+    return None
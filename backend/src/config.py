@@ -22,6 +22,11 @@ _procurement_api_is_live_env = os.getenv("PROCUREMENT_API_IS_LIVE", "false").low
 # tooling falls back to cached/mock behavior without preventing the API from booting.
 PROCUREMENT_API_IS_LIVE = bool(_procurement_api_is_live_env and NEXAR_CLIENT_ID and NEXAR_CLIENT_SECRET)
 PROCUREMENT_API_CACHE_TTL_MINUTES = 60  # Cache TTL in minutes for procurement API calls
+PROCUREMENT_MAX_CONCURRENT_REQUESTS = int(os.getenv("PROCUREMENT_MAX_CONCURRENT_REQUESTS", "8"))
+# BOM-level optimizer (optimize_order with consolidate_sellers=True)
+PROCUREMENT_SELLER_FIXED_COST = float(os.getenv("PROCUREMENT_SELLER_FIXED_COST", "15.0"))  # Shipping/handling per seller
+PROCUREMENT_OPTIMIZER_TIME_BUDGET_SECONDS = float(os.getenv("PROCUREMENT_OPTIMIZER_TIME_BUDGET_SECONDS", "2.0"))
+PROCUREMENT_OPTIMIZER_EXACT_MAX_PARTS = int(os.getenv("PROCUREMENT_OPTIMIZER_EXACT_MAX_PARTS", "12"))
 
 # --- Xentral API Configuration ---
 # Loaded from .env (gitignored) so secrets stay out of git.
@@ -61,8 +66,128 @@ MODEL_OPTIONS = [
     {"id": "gemini-2.5-pro", "name": "Gemini 2.5 Pro", "provider": "Google"},
     {"id": "gemini-3-pro", "name": "Gemini 3 Pro (Preview)", "provider": "Google"},
     {"id": "gemini-1.5-pro", "name": "Gemini 1.5 Pro", "provider": "Google"},
+    {"id": "auto", "name": "Auto (Flash Lite, escalates to Flash/Pro)", "provider": "Google"},
 ]
 
+# --- Model cascade (see cascade.py): model_id "auto" picks the model per stage ---
+# "stage=model>fallback>...,": the first model runs, the next ones only after a failed validation
+CASCADE_POLICY = os.getenv(
+    "CASCADE_POLICY",
+    "router=gemini-2.5-flash-lite,planner=gemini-2.5-flash-lite,title=gemini-2.5-flash-lite,"
+    "react=gemini-2.5-flash-lite>gemini-2.5-flash>gemini-2.5-pro,"
+    "extraction=gemini-2.5-flash-lite>gemini-2.5-flash>gemini-2.5-pro",
+)
+
+# --- Deterministic workflows (see workflows.py): run common tool chains without the ReAct loop ---
+WORKFLOWS_ENABLED = os.getenv("WORKFLOWS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# --- Planner routing (see routing.py) ---
+# Small model deciding whether the planner pre-pass is needed (empty = rules only, planner by default)
+ROUTER_CLASSIFIER_MODEL = os.getenv("ROUTER_CLASSIFIER_MODEL", "gemini-2.5-flash-lite")
+# Start the planner while the classifier runs, so a "needs planner" verdict costs no extra wait
+ROUTER_SPECULATIVE_PLANNER = os.getenv("ROUTER_SPECULATIVE_PLANNER", "true").lower() in ("1", "true", "yes")
+# Threads for speculative planner runs (a run still queued when the planner is needed runs inline instead)
+ROUTER_PLANNER_WORKERS = int(os.getenv("ROUTER_PLANNER_WORKERS", "8"))
+
+# --- Agent response cache (see response_cache.py); TTL depends on the tools behind an answer ---
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2000"))
+RESPONSE_CACHE_MAX_MB = float(os.getenv("RESPONSE_CACHE_MAX_MB", "64"))
+RESPONSE_CACHE_TTL_STOCK_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_STOCK_SECONDS", "120"))
+RESPONSE_CACHE_TTL_PRICE_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_PRICE_SECONDS", "900"))
+RESPONSE_CACHE_TTL_STATIC_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_STATIC_SECONDS", "3600"))
+# Embedding tier: rephrased questions with the same IDs/numbers/history reuse an answer
+RESPONSE_CACHE_SEMANTIC_ENABLED = os.getenv("RESPONSE_CACHE_SEMANTIC_ENABLED", "true").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.95"))
+
+# --- Conversation history (see history.py): token budget instead of a turn limit ---
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "8000"))
+HISTORY_MAX_TURN_TOKENS = int(os.getenv("HISTORY_MAX_TURN_TOKENS", "2000"))
+HISTORY_KEEP_RECENT_TURNS = int(os.getenv("HISTORY_KEEP_RECENT_TURNS", "4"))
+HISTORY_BOM_MAX_ROWS = int(os.getenv("HISTORY_BOM_MAX_ROWS", "60"))
+HISTORY_SUMMARY_MODEL = os.getenv("HISTORY_SUMMARY_MODEL", "gemini-2.5-flash-lite")
+
+# --- Tool observations (see observations.py): larger results reach the LM in compact form ---
+OBSERVATION_MAX_TOKENS = int(os.getenv("OBSERVATION_MAX_TOKENS", "1500"))
+OBSERVATION_MAX_ROWS = int(os.getenv("OBSERVATION_MAX_ROWS", "20"))
+
+# --- Parallel tool calls (see tool_runner.py): run_parallel batches with per-tool limits ---
+TOOL_RUNNER_MAX_BATCH = int(os.getenv("TOOL_RUNNER_MAX_BATCH", "10"))
+# Threads per tool; queued calls of a busy tool do not hold threads of the others
+TOOL_RUNNER_DEFAULT_CONCURRENCY = int(os.getenv("TOOL_RUNNER_DEFAULT_CONCURRENCY", "4"))
+# "tool=limit,..." overrides: extraction and Nexar-heavy tools are kept low
+TOOL_RUNNER_CONCURRENCY_LIMITS = os.getenv(
+    "TOOL_RUNNER_CONCURRENCY_LIMITS",
+    "perform_bom_extraction=2,search_part_by_mpn=2,find_alternatives=2,optimize_order=1",
+)
+
+# --- Speculative tool calls (see speculation.py): prefetch the likely read-only follow-up call ---
+SPECULATION_ENABLED = os.getenv("SPECULATION_ENABLED", "true").lower() in ("1", "true", "yes")
+SPECULATION_MAX_WORKERS = int(os.getenv("SPECULATION_MAX_WORKERS", "2"))
+SPECULATION_MAX_PER_REQUEST = int(os.getenv("SPECULATION_MAX_PER_REQUEST", "4"))
+
+# --- LLM call instrumentation (see instrumentation.py): per-call metrics and /agent request traces ---
+LLM_TRACE_ENABLED = os.getenv("LLM_TRACE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_TRACE_MAX_REQUESTS = int(os.getenv("LLM_TRACE_MAX_REQUESTS", "200"))
+LLM_TRACE_TTL_SECONDS = int(os.getenv("LLM_TRACE_TTL_SECONDS", "3600"))
+
+# --- Request tracing (see tracing.py): OpenTelemetry-style spans exported as JSON lines ---
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() in ("1", "true", "yes")
+TRACING_EXPORT_PATH = os.getenv("TRACING_EXPORT_PATH", os.path.expanduser("~/.kakoai/traces.jsonl"))
+TRACING_EXPORT_MAX_MB = float(os.getenv("TRACING_EXPORT_MAX_MB", "50"))
+
 # --- BOM cache configuration ---
 BOM_CACHE_ENABLED = os.getenv("BOM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
-BOM_CACHE_PATH = os.getenv("BOM_CACHE_PATH", os.path.expanduser("~/.kakoai/bom_cache.pkl"))
+BOM_CACHE_PATH = os.getenv("BOM_CACHE_PATH", os.path.expanduser("~/.kakoai/bom_cache.sqlite"))
+# Old pickled-dict cache, imported into BOM_CACHE_PATH once and renamed to *.migrated
+BOM_CACHE_LEGACY_PATH = os.getenv("BOM_CACHE_LEGACY_PATH", os.path.expanduser("~/.kakoai/bom_cache.pkl"))
+BOM_CACHE_MAX_MB = float(os.getenv("BOM_CACHE_MAX_MB", "512"))
+# Near-duplicate lookup (perceptual hash) for re-scanned/re-exported drawings
+BOM_CACHE_PHASH_ENABLED = os.getenv("BOM_CACHE_PHASH_ENABLED", "false").lower() in ("1", "true", "yes")
+BOM_CACHE_PHASH_MAX_DISTANCE = int(os.getenv("BOM_CACHE_PHASH_MAX_DISTANCE", "6"))
+# Rendered PDF pages, keyed by PDF content hash (empty = render next to the upload)
+PDF_RASTER_CACHE_DIR = os.path.expanduser(os.getenv("PDF_RASTER_CACHE_DIR", "~/.kakoai/raster_cache"))
+PDF_RASTER_CACHE_MAX_FILES = int(os.getenv("PDF_RASTER_CACHE_MAX_FILES", "500"))
+PDF_RASTER_WORKERS = int(os.getenv("PDF_RASTER_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Multi-page extraction: pages scoring at least this many table-line crossings are extracted
+BOM_PAGE_TABLE_MIN_CROSSINGS = int(os.getenv("BOM_PAGE_TABLE_MIN_CROSSINGS", "24"))
+BOM_EXTRACTION_MAX_CONCURRENCY = int(os.getenv("BOM_EXTRACTION_MAX_CONCURRENCY", "4"))
+BOM_EXTRACTION_MAX_PAGES = int(os.getenv("BOM_EXTRACTION_MAX_PAGES", "20"))
+# Model image preprocessing: crop to the table region, downscale to a vision-token budget
+BOM_IMAGE_CROP_ENABLED = os.getenv("BOM_IMAGE_CROP_ENABLED", "true").lower() in ("1", "true", "yes")
+BOM_IMAGE_TOKEN_BUDGET = int(os.getenv("BOM_IMAGE_TOKEN_BUDGET", "1548"))
+BOM_IMAGE_MIN_SCALE = float(os.getenv("BOM_IMAGE_MIN_SCALE", "0.6"))
+BOM_MODEL_IMAGE_MAX_FILES = int(os.getenv("BOM_MODEL_IMAGE_MAX_FILES", "200"))
+
+# --- Remote drawing archive (SSH/SFTP) ---
+SSH_POOL_SIZE = int(os.getenv("SSH_POOL_SIZE", "2"))
+SSH_KEEPALIVE_SECONDS = int(os.getenv("SSH_KEEPALIVE_SECONDS", "30"))
+REMOTE_LISTING_TTL_SECONDS = int(os.getenv("REMOTE_LISTING_TTL_SECONDS", "300"))
+REMOTE_LISTING_CHECK_SECONDS = int(os.getenv("REMOTE_LISTING_CHECK_SECONDS", "15"))
+REMOTE_FILE_CACHE_DIR = os.path.expanduser(os.getenv("REMOTE_FILE_CACHE_DIR", "~/.kakoai/remote_files"))
+REMOTE_FILE_CACHE_MAX_FILES = int(os.getenv("REMOTE_FILE_CACHE_MAX_FILES", "500"))
+# Background prefetch: workers, drawings per request, min. fuzzy score to resolve a name
+BOM_PREFETCH_WORKERS = int(os.getenv("BOM_PREFETCH_WORKERS", "2"))
+BOM_PREFETCH_MAX_DRAWINGS = int(os.getenv("BOM_PREFETCH_MAX_DRAWINGS", "20"))
+BOM_PREFETCH_MIN_SCORE = float(os.getenv("BOM_PREFETCH_MIN_SCORE", "90"))
+
+# --- Session state backend: memory | sqlite | redis (see state_backend.py) ---
+# Use sqlite (one host) or redis (several hosts) to run more than one worker.
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+STATE_SQLITE_PATH = os.getenv("STATE_SQLITE_PATH", os.path.expanduser("~/.kakoai/state.sqlite"))
+STATE_REDIS_URL = os.getenv("STATE_REDIS_URL", "redis://localhost:6379/0")
+
+# --- Store limits (entries / resident MB / TTL seconds) ---
+BOM_STORE_MAX_ENTRIES = int(os.getenv("BOM_STORE_MAX_ENTRIES", "500"))
+BOM_STORE_MAX_MB = float(os.getenv("BOM_STORE_MAX_MB", "64"))
+BOM_STORE_TTL_SECONDS = int(os.getenv("BOM_STORE_TTL_SECONDS", str(24 * 3600)))
+PROCUREMENT_STORE_MAX_ENTRIES = int(os.getenv("PROCUREMENT_STORE_MAX_ENTRIES", "1000"))
+PROCUREMENT_STORE_MAX_MB = float(os.getenv("PROCUREMENT_STORE_MAX_MB", "256"))
+PROCUREMENT_STORE_TTL_SECONDS = int(os.getenv("PROCUREMENT_STORE_TTL_SECONDS", str(6 * 3600)))
+OBSERVATION_STORE_MAX_ENTRIES = int(os.getenv("OBSERVATION_STORE_MAX_ENTRIES", "1000"))
+OBSERVATION_STORE_MAX_MB = float(os.getenv("OBSERVATION_STORE_MAX_MB", "128"))
+OBSERVATION_STORE_TTL_SECONDS = int(os.getenv("OBSERVATION_STORE_TTL_SECONDS", str(6 * 3600)))
+# Per-thread chat histories and confirmed BOMs (TTL refreshed on every request)
+THREAD_STATE_MAX_ENTRIES = int(os.getenv("THREAD_STATE_MAX_ENTRIES", "2000"))
+THREAD_STATE_MAX_MB = float(os.getenv("THREAD_STATE_MAX_MB", "128"))
+THREAD_STATE_TTL_SECONDS = int(os.getenv("THREAD_STATE_TTL_SECONDS", str(7 * 24 * 3600)))
@@ -0,0 +1,186 @@
+"""Token-budgeted conversation history.
+
+The history is re-sent with every planner and ReAct call, so its size is kept
+within `HISTORY_TOKEN_BUDGET` estimated tokens instead of a fixed turn count:
+
+- Large payloads are stored as references. A BOM becomes its ID plus a compact
+  CSV of its rows (tools fetch the full BOM from `BOMStore` by ID), and single
+  turn results are capped at `HISTORY_MAX_TURN_TOKENS`.
+- When the budget is exceeded, the oldest turns are folded into one running
+  summary message, written by a small model and updated incrementally. The
+  latest `HISTORY_KEEP_RECENT_TURNS` turns stay verbatim, and every BOM_/SEARCH_
+  ID of a folded turn is kept.
+
+Token counts are estimates (about 4 characters per token); the actual prompt
+usage per request is reported by `main.run_agent`.
+"""
+from __future__ import annotations
+
+import contextlib
+import math
+import re
+from typing import List, Optional
+
+import dspy
+
+from backend.src.config import (
+    AVAILABLE_MODELS,
+    HISTORY_TOKEN_BUDGET,
+    HISTORY_MAX_TURN_TOKENS,
+    HISTORY_KEEP_RECENT_TURNS,
+    HISTORY_BOM_MAX_ROWS,
+    HISTORY_SUMMARY_MODEL,
+)
+from backend.src.models import BillOfMaterials
+
+SUMMARY_MARKER = "__HISTORY_SUMMARY__"
+CHARS_PER_TOKEN = 4
+# Compaction stops once the history is back under this share of the budget,
+# so the summarizer runs once per several turns rather than on every turn
+COMPACTION_TARGET = 0.6
+
+_REFERENCE_ID = re.compile(r"\b(?:BOM|SEARCH)_[A-Z0-9]{4,}\b")
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text or "") / CHARS_PER_TOKEN)
+
+
+def message_tokens(message: dict) -> int:
+    return sum(estimate_tokens(str(value)) for value in message.values())
+
+
+def history_tokens(history: dspy.History) -> int:
+    """Estimated prompt tokens the history adds to every LM call."""
+    return sum(message_tokens(message) for message in history.messages)
+
+
+def _csv_cell(value) -> str:
+    text = "" if value is None else str(value)
+    return text.replace(";", ",").replace("\n", " ").strip()
+
+
+def bom_reference(bom_id: str, bom: BillOfMaterials, max_rows: int = HISTORY_BOM_MAX_ROWS) -> str:
+    """Compact history entry for a BOM: its ID, a summary line and its rows as CSV."""
+    lines = [
+        f"BOM ID: {bom_id}",
+        f"Title: {bom.title or 'Untitled'} | Items: {len(bom.items)} | "
+        "Full data: pass the BOM ID to tools.",
+        "pos;item_nr;quantity;unit;description;xentral_number",
+    ]
+    for item in bom.items[:max_rows]:
+        lines.append(
+            ";".join(
+                _csv_cell(value)
+                for value in (
+                    item.part_number,
+                    item.item_nr,
+                    item.quantity,
+                    getattr(item, "unit", None),
+                    getattr(item, "description", None),
+                    getattr(item, "xentral_number", None),
+                )
+            )
+        )
+    if len(bom.items) > max_rows:
+        lines.append(f"... {len(bom.items) - max_rows} more rows (use the BOM ID)")
+    return "\n".join(lines)
+
+
+def cap_text(text: str, max_tokens: int = HISTORY_MAX_TURN_TOKENS) -> str:
+    """Truncate an oversized turn result, keeping the IDs it mentions."""
+    text = text or ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    ids = sorted(set(_REFERENCE_ID.findall(text)))
+    note = f"\n[... truncated from ~{estimate_tokens(text)} tokens"
+    if ids:
+        note += f"; referenced IDs: {', '.join(ids)}"
+    return text[: max_tokens * CHARS_PER_TOKEN] + note + "; re-run the tool for full data]"
+
+
+def _extract_line(turn: dict) -> str:
+    """Fallback summary of a turn (no model): the query and the first line of the result."""
+    result = str(turn.get("process_result") or "").strip()
+    first_line = result.splitlines()[0] if result else ""
+    return f"- {str(turn.get('user_query', ''))[:200]} -> {first_line[:200]}"
+
+
+class SummarizeHistorySignature(dspy.Signature):
+    """Update the running summary of a conversation between a user and KakoAI (an industrial
+    copilot for BOM extraction, feasibility checks and procurement) with the turns that are
+    being removed from the history. Keep every BOM_/SEARCH_ reference ID, part number,
+    quantity, price and user decision verbatim; drop pleasantries. Write in the
+    conversation's language. At most 250 words."""
+
+    previous_summary: str = dspy.InputField(desc="Summary of even older turns (may be empty).")
+    turns: str = dspy.InputField(desc="The turns to fold into the summary, oldest first.")
+    summary: str = dspy.OutputField()
+
+
+class HistoryManager:
+    """Appends turns and keeps the history within its token budget (singleton)."""
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(HistoryManager, cls).__new__(cls)
+            cls._instance.summarizer = dspy.Predict(SummarizeHistorySignature)
+            cls._instance.summary_lm = AVAILABLE_MODELS.get(HISTORY_SUMMARY_MODEL)
+        return cls._instance
+
+    def append(self, history: dspy.History, user_query: str, process_result: str) -> None:
+        """Add a turn (result capped at HISTORY_MAX_TURN_TOKENS) and compact if over budget."""
+        history.messages.append({"user_query": user_query, "process_result": cap_text(process_result)})
+        self.compact(history)
+
+    def _summarize(self, previous: str, turns: List[dict]) -> str:
+        text = "\n\n".join(
+            f"User: {turn.get('user_query', '')}\nKakoAI: {turn.get('process_result', '')}" for turn in turns
+        )
+        summary: Optional[str] = None
+        try:
+            with dspy.context(lm=self.summary_lm) if self.summary_lm else contextlib.nullcontext():
+                summary = self.summarizer(previous_summary=previous, turns=text).summary
+        except Exception as e:
+            print(f"Warning: History summarization failed, keeping an extract: {e}")
+        if not summary:
+            summary = "\n".join([previous] + [_extract_line(turn) for turn in turns]).strip()
+            # Keep the newest part of the extract within the per-turn cap
+            summary = summary[-HISTORY_MAX_TURN_TOKENS * CHARS_PER_TOKEN:]
+        missing = sorted(set(_REFERENCE_ID.findall(previous + text)) - set(_REFERENCE_ID.findall(summary)))
+        if missing:
+            summary += f"\nReferenced IDs: {', '.join(missing)}"
+        return summary
+
+    def compact(self, history: dspy.History) -> None:
+        """Fold the oldest turns into the running summary while over HISTORY_TOKEN_BUDGET."""
+        if history_tokens(history) <= HISTORY_TOKEN_BUDGET:
+            return
+        messages = list(history.messages)
+        previous = ""
+        if messages and messages[0].get("user_query") == SUMMARY_MARKER:
+            previous = messages.pop(0).get("process_result", "")
+
+        recent = messages[-HISTORY_KEEP_RECENT_TURNS:] if HISTORY_KEEP_RECENT_TURNS else []
+        older = messages[: len(messages) - len(recent)]
+        target = HISTORY_TOKEN_BUDGET * COMPACTION_TARGET
+        total = estimate_tokens(previous) + sum(message_tokens(m) for m in messages)
+        fold = 0
+        while fold < len(older) and total > target:
+            total -= message_tokens(older[fold])
+            fold += 1
+        if not fold:
+            return
+
+        before = history_tokens(history)
+        summary = self._summarize(previous, older[:fold])
+        # dspy.History is frozen: replace the list contents in place
+        history.messages[:] = (
+            [{"user_query": SUMMARY_MARKER, "process_result": summary}] + older[fold:] + recent
+        )
+        print(
+            f"--- [History] Folded {fold} turns into the summary "
+            f"(~{before} -> ~{history_tokens(history)} tokens) ---"
+        )
@@ -0,0 +1,289 @@
+"""Per-call instrumentation of DSPy LM calls.
+
+`LMInstrumentation` is a DSPy callback (installed globally in `main.py`). For
+every LM call it records:
+
+- the model,
+- the call site, i.e. the signature that prompted it (`BOMExtractionSignature`,
+  `GenerateTitle`, ...), `react_step_<n>` / `react_extract` inside the agent's
+  ReAct loop, or a name set with `call_site()` (e.g. `planner`),
+- latency, prompt/completion tokens, cost, and whether the LM cache answered.
+
+These feed the `kakoai_llm_*` metrics, and each LM call is also a `tracing`
+span. Inside `request_trace()` (one `/agent` request), the LM calls, the
+modules and the tool calls are also collected as a timeline. It is kept in a
+bounded store and served by `GET /traces/{id}`, as a call summary or in the
+Chrome trace event format (chrome://tracing, Perfetto).
+"""
+from __future__ import annotations
+
+import contextlib
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+import dspy
+from dspy.utils.callback import BaseCallback
+
+from backend.src import cascade, metrics, tracing
+from backend.src.cache import ValueTooLarge
+from backend.src.config import LLM_TRACE_ENABLED, LLM_TRACE_MAX_REQUESTS, LLM_TRACE_TTL_SECONDS
+from backend.src.state_backend import JSON_CODEC, create_store
+
+LLM_CALLS = metrics.Counter("kakoai_llm_calls_total", "LM calls by model, call site and cache result.")
+LLM_LATENCY = metrics.Histogram("kakoai_llm_latency_seconds", "LM call latency by model and call site.")
+LLM_TOKENS = metrics.Counter("kakoai_llm_tokens_total", "LM tokens by model, call site and kind (prompt/completion).")
+LLM_COST = metrics.Counter("kakoai_llm_cost_usd_total", "Estimated LM cost in USD by model and call site.")
+
+# Signatures that lose their class name inside dspy modules (ReAct, ChainOfThought)
+_ANONYMOUS_SIGNATURE = "StringSignature"
+
+_call_site: ContextVar[Optional[str]] = ContextVar("llm_call_site", default=None)
+_react: ContextVar[Optional[dict]] = ContextVar("llm_react_module", default=None)
+_trace: ContextVar[Optional["RequestTrace"]] = ContextVar("llm_request_trace", default=None)
+
+
+@contextlib.contextmanager
+def call_site(name: str) -> Iterator[None]:
+    """Attribute LM calls in this block to `name` (unless a named signature is more specific)."""
+    token = _call_site.set(name)
+    try:
+        yield
+    finally:
+        _call_site.reset(token)
+
+
+class RequestTrace:
+    """Timeline of one request: LM calls, modules and tools as (name, category, start, end, args) spans."""
+
+    def __init__(self, request_id: str) -> None:
+        self.request_id = request_id
+        current = tracing.current_span()
+        # Links this timeline to the request's spans in the tracing export
+        self.trace_id = current.trace_id if current else None
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.spans: List[dict] = []
+        self._lock = threading.Lock()
+
+    def add(self, name: str, category: str, start: float, end: float, **args: Any) -> None:
+        span = {
+            "name": name,
+            "cat": category,
+            "start_ms": round((start - self.started) * 1000, 3),
+            "duration_ms": round((end - start) * 1000, 3),
+            "thread": threading.current_thread().name,
+            "args": args,
+        }
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s["start_ms"])
+        calls = [s for s in spans if s["cat"] == "lm"]
+        return {
+            "request_id": self.request_id,
+            "trace_id": self.trace_id,
+            "started_at": self.started_at,
+            "duration_ms": round((time.perf_counter() - self.started) * 1000, 3),
+            "totals": {
+                "lm_calls": len(calls),
+                "lm_ms": round(sum(s["duration_ms"] for s in calls), 3),
+                "prompt_tokens": sum(s["args"].get("prompt_tokens", 0) for s in calls),
+                "completion_tokens": sum(s["args"].get("completion_tokens", 0) for s in calls),
+                "cost_usd": round(sum(s["args"].get("cost_usd") or 0.0 for s in calls), 6),
+                "cache_hits": sum(1 for s in calls if s["args"].get("cache_hit")),
+            },
+            "spans": spans,
+        }
+
+
+_traces = create_store(
+    "llm_traces",
+    JSON_CODEC,
+    max_entries=LLM_TRACE_MAX_REQUESTS,
+    max_bytes=LLM_TRACE_MAX_REQUESTS * 64 * 1024,
+    ttl_seconds=LLM_TRACE_TTL_SECONDS,
+)
+
+
+@contextlib.contextmanager
+def request_trace(request_id: str) -> Iterator[Optional[RequestTrace]]:
+    """Collect the spans of one request and store the trace under `request_id` at the end."""
+    if not LLM_TRACE_ENABLED:
+        yield None
+        return
+    trace = RequestTrace(request_id)
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+        try:
+            _traces[request_id] = trace.to_dict()
+        except ValueTooLarge as e:
+            print(f"Warning: Request trace not stored: {e}")
+
+
+def get_trace(request_id: str) -> Optional[dict]:
+    """A stored request trace (None if unknown or expired)."""
+    return _traces.get(request_id)
+
+
+def to_chrome_trace(trace: dict) -> dict:
+    """Convert a stored trace into the Chrome trace event format (complete events, one row per thread)."""
+    threads: Dict[str, int] = {}
+    events = []
+    for span in trace["spans"]:
+        tid = threads.setdefault(span["thread"], len(threads) + 1)
+        events.append(
+            {
+                "name": span["name"],
+                "cat": span["cat"],
+                "ph": "X",
+                "ts": span["start_ms"] * 1000,
+                "dur": span["duration_ms"] * 1000,
+                "pid": 1,
+                "tid": tid,
+                "args": span["args"],
+            }
+        )
+    for name, tid in threads.items():
+        events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": name}})
+    events.append(
+        {"name": "process_name", "ph": "M", "pid": 1, "tid": 0, "args": {"name": f"/agent {trace['request_id']}"}}
+    )
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def _predict_site(instance: dspy.Predict) -> Optional[str]:
+    """Call site of a Predict: its ReAct role or its signature name (None if anonymous)."""
+    react = _react.get()
+    if react is not None:
+        module = react["module"]
+        if instance is getattr(module, "react", None):
+            step = react["steps"]
+            react["steps"] += 1
+            return f"react_step_{step}"
+        extract = getattr(module, "extract", None)
+        if instance is getattr(extract, "predict", extract):
+            return "react_extract"
+    name = getattr(instance.signature, "__name__", _ANONYMOUS_SIGNATURE)
+    return None if name == _ANONYMOUS_SIGNATURE else name
+
+
+class LMInstrumentation(BaseCallback):
+    """DSPy callback recording LM call metrics and request trace spans."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._pending: Dict[str, dict] = {}
+
+    def _begin(self, call_id: str, **state: Any) -> None:
+        with self._lock:
+            self._pending[call_id] = dict(state, start=time.perf_counter())
+
+    def _finish(self, call_id: str) -> Optional[dict]:
+        with self._lock:
+            state = self._pending.pop(call_id, None)
+        if state is not None:
+            state["end"] = time.perf_counter()
+            for var, token in state.get("tokens", ()):
+                var.reset(token)
+        return state
+
+    def on_module_start(self, call_id: str, instance: Any, inputs: Dict[str, Any]) -> None:
+        tokens = []
+        if isinstance(instance, dspy.ReAct):
+            tokens.append((_react, _react.set({"module": instance, "steps": 0})))
+            tokens.append((_call_site, _call_site.set("react")))
+            name = "ReAct"
+        elif isinstance(instance, dspy.Predict):
+            site = _predict_site(instance)
+            if site is not None:
+                tokens.append((_call_site, _call_site.set(site)))
+            name = site or _call_site.get() or "Predict"
+        else:
+            name = type(instance).__name__
+        self._begin(call_id, name=name, category="module", tokens=tokens)
+
+    def on_module_end(self, call_id: str, outputs: Any, exception: Optional[Exception] = None) -> None:
+        state = self._finish(call_id)
+        trace = _trace.get()
+        if state is not None and trace is not None:
+            trace.add(state["name"], state["category"], state["start"], state["end"], error=exception is not None)
+
+    def on_tool_start(self, call_id: str, instance: Any, inputs: Dict[str, Any]) -> None:
+        self._begin(call_id, name=getattr(instance, "name", "tool"), category="tool")
+
+    def on_tool_end(self, call_id: str, outputs: Any, exception: Optional[Exception] = None) -> None:
+        self.on_module_end(call_id, outputs, exception)
+
+    def on_lm_start(self, call_id: str, instance: Any, inputs: Dict[str, Any]) -> None:
+        site = _call_site.get() or "unattributed"
+        model = getattr(instance, "model", type(instance).__name__)
+        self._begin(
+            call_id,
+            lm=instance,
+            messages=inputs.get("messages"),
+            site=site,
+            span=tracing.start_span(
+                f"llm {site}", "client", **{"gen_ai.request.model": model, "kakoai.call_site": site}
+            ),
+        )
+
+    def _history_entry(self, lm: Any, messages: Any) -> Optional[dict]:
+        # The LM logs each call with the same messages object it was given
+        for entry in reversed(getattr(lm, "history", [])[-50:]):
+            if messages is not None and entry.get("messages") is messages:
+                return entry
+        return None
+
+    def on_lm_end(self, call_id: str, outputs: Any, exception: Optional[Exception] = None) -> None:
+        state = self._finish(call_id)
+        if state is None:
+            return
+        lm, site = state["lm"], state["site"]
+        model = getattr(lm, "model", type(lm).__name__)
+        latency = state["end"] - state["start"]
+        entry = self._history_entry(lm, state["messages"]) or {}
+        usage = entry.get("usage") or {}
+        prompt_tokens = int(usage.get("prompt_tokens") or 0)
+        completion_tokens = int(usage.get("completion_tokens") or 0)
+        cache_hit = bool(getattr(entry.get("response"), "cache_hit", False))
+        cost = entry.get("cost")
+
+        outcome = "error" if exception is not None else "hit" if cache_hit else "miss"
+        LLM_CALLS.inc(model=model, call_site=site, cache=outcome)
+        LLM_LATENCY.observe(latency, model=model, call_site=site)
+        LLM_TOKENS.inc(prompt_tokens, model=model, call_site=site, kind="prompt")
+        LLM_TOKENS.inc(completion_tokens, model=model, call_site=site, kind="completion")
+        if cost:
+            LLM_COST.inc(float(cost), model=model, call_site=site)
+            cascade.add_cost(float(cost))
+
+        span = state["span"]
+        span.set_attribute("gen_ai.usage.input_tokens", prompt_tokens)
+        span.set_attribute("gen_ai.usage.output_tokens", completion_tokens)
+        span.set_attribute("kakoai.cache_hit", cache_hit)
+        if exception is not None:
+            span.record_exception(exception)
+        span.end()
+
+        trace = _trace.get()
+        if trace is not None:
+            trace.add(
+                f"{site} ({model})",
+                "lm",
+                state["start"],
+                state["end"],
+                model=model,
+                call_site=site,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                cost_usd=float(cost) if cost else None,
+                cache_hit=cache_hit,
+                error=exception is not None,
+            )
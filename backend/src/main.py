@@ -7,6 +7,7 @@ from datetime import datetime, timezone
 import dspy
 from fastapi import FastAPI, Depends, Form, Request, HTTPException, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 import tempfile
 
@@ -14,9 +15,24 @@ import os
 import jwt
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
-from backend.src.config import GEMINI_2_5_FLASH, AVAILABLE_MODELS, MODEL_OPTIONS, SUPABASE_JWT_SECRET
+from backend.src.config import (
+    GEMINI_2_5_FLASH,
+    AVAILABLE_MODELS,
+    RESPONSE_CACHE_ENABLED,
+    MODEL_OPTIONS,
+    SUPABASE_JWT_SECRET,
+    THREAD_STATE_MAX_ENTRIES,
+    THREAD_STATE_MAX_MB,
+    THREAD_STATE_TTL_SECONDS,
+)
 from backend.src.auth_context import is_mock_user_context
+from backend.src.state_backend import BOM_ENTRY_CODEC, HISTORY_CODEC, create_store
+from backend.src import metrics, tracing
+from backend.src.cascade import AUTO_MODEL_ID, cascade_scope, policy_lm
 from backend.src.agent import KakoAgent
+from backend.src.instrumentation import LMInstrumentation, get_trace, request_trace, to_chrome_trace
+from backend.src.history import bom_reference, history_tokens
+from backend.src.response_cache import ResponseCache
 from backend.src.models import (
     AgentRequest,
     AgentResponse,
@@ -34,8 +50,8 @@ from backend.src.utils import (
     apply_bom_update,
 )
 
-## --- Configure LLM globally ---
-dspy.configure(lm=GEMINI_2_5_FLASH)
+## --- Configure LLM globally (every LM call is measured, see instrumentation.py) ---
+dspy.configure(lm=GEMINI_2_5_FLASH, callbacks=[LMInstrumentation()])
 
 app = FastAPI(title="KakoAI")
 
@@ -53,6 +69,25 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Paths not worth a span (scraped/polled constantly)
+UNTRACED_PATHS = {"/metrics", "/health"}
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Root tracing span per API request; agent, tool, LM and external-call spans nest below it."""
+    if request.url.path in UNTRACED_PATHS:
+        return await call_next(request)
+    with tracing.span(
+        f"{request.method} {request.url.path}",
+        "server",
+        **{"http.request.method": request.method, "url.path": request.url.path},
+    ) as span:
+        response = await call_next(request)
+        span.set_attribute("http.response.status_code", response.status_code)
+        return response
+
+
 # Serve temporary files (for generated images/PDFs)
 temp_dir = tempfile.gettempdir()
 print(f"Mounting static files from: {temp_dir}")
@@ -60,8 +95,25 @@ app.mount("/files", StaticFiles(directory=temp_dir), name="files")
 
 # Instantiate the unified agent once and store on app state for DI access
 app.state.agent = KakoAgent()
-app.state.histories = {}
-app.state.boms = {}
+# Per-thread state is bounded (LRU + TTL refreshed on every request) and lives in
+# the configured STATE_BACKEND so several workers can serve the same thread.
+app.state.histories = create_store(
+    "thread_histories",
+    HISTORY_CODEC,
+    max_entries=THREAD_STATE_MAX_ENTRIES,
+    max_bytes=int(THREAD_STATE_MAX_MB * 1024 * 1024),
+    ttl_seconds=THREAD_STATE_TTL_SECONDS,
+)
+app.state.boms = create_store(
+    "thread_boms",
+    BOM_ENTRY_CODEC,
+    max_entries=THREAD_STATE_MAX_ENTRIES,
+    max_bytes=int(THREAD_STATE_MAX_MB * 1024 * 1024),
+    ttl_seconds=THREAD_STATE_TTL_SECONDS,
+)
+
+# Answers to repeated questions (never uploads, confirmations or writes)
+app.state.responses = ResponseCache() if RESPONSE_CACHE_ENABLED else None
 
 
 def get_agent(request: Request) -> KakoAgent:
@@ -74,7 +126,7 @@ def get_agent(request: Request) -> KakoAgent:
 
 
 def _get_history_for_thread(thread_id: str | None) -> dspy.History:
-    """Return a per-thread DSPy History (in-memory)."""
+    """Return a per-thread DSPy History (from the session state store)."""
     tid = thread_id or "default"
     histories = app.state.histories
     history = histories.get(tid)
@@ -84,6 +136,28 @@ def _get_history_for_thread(thread_id: str | None) -> dspy.History:
     return history
 
 
+HISTORY_TOKENS_SENT = metrics.Counter(
+    "kakoai_history_tokens_total", "Estimated history tokens sent with agent requests."
+)
+LM_PROMPT_TOKENS = metrics.Counter("kakoai_lm_prompt_tokens_total", "LM prompt tokens by model.")
+LM_COMPLETION_TOKENS = metrics.Counter("kakoai_lm_completion_tokens_total", "LM completion tokens by model.")
+
+
+def _report_usage(prompt_history_tokens: int, usage: dict) -> dict:
+    """Log and count the prompt tokens of one request (history estimate + LM usage per model)."""
+    report = {"history_tokens": prompt_history_tokens, "models": {}}
+    HISTORY_TOKENS_SENT.inc(prompt_history_tokens)
+    for model, totals in usage.items():
+        prompt = int(totals.get("prompt_tokens") or 0)
+        completion = int(totals.get("completion_tokens") or 0)
+        report["models"][model] = {"prompt_tokens": prompt, "completion_tokens": completion}
+        LM_PROMPT_TOKENS.inc(prompt, model=model)
+        LM_COMPLETION_TOKENS.inc(completion, model=model)
+    total_prompt = sum(m["prompt_tokens"] for m in report["models"].values())
+    print(f"--- [Usage] History ~{prompt_history_tokens} tokens, LM prompt tokens {total_prompt} ---")
+    return report
+
+
 security = HTTPBearer()
 
 async def verify_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
@@ -202,8 +276,10 @@ async def run_agent(
         append_to_history(
             history,
             user_query="__BOM_CONFIRMED__",
-            process_result=merged.model_dump_json(),
+            process_result=bom_reference(stored["bom_id"], merged),
         )
+        # Re-store to refresh the TTL and re-account the history size.
+        app.state.histories[thread_key] = history
         if user_query.strip() == "__BOM_CONFIRM__":
             from backend.src.tools.demand_analysis.inventory import xentral_BOM
             # xentral_BOM handles mock logic internally
@@ -215,12 +291,44 @@ async def run_agent(
                 blocks=[TextBlock(content=f"BOM Saved to Xentral.\nStats: {result}")],
             )
 
-    # Select LM based on request or default
+    # Select LM based on request or default; "auto" picks the model per stage (see cascade.py)
+    auto_model = model_id == AUTO_MODEL_ID
     selected_lm = AVAILABLE_MODELS.get(model_id, GEMINI_2_5_FLASH)
+    model_key = AUTO_MODEL_ID if auto_model else selected_lm.model
     
-    # Run the agent with the selected LM context
-    with dspy.context(lm=selected_lm):
-        prediction = agent(user_query=user_query, history=history)
+    # Serve repeated questions from the response cache; uploads and BOM confirmations bypass it
+    responses = app.state.responses
+    prediction, cache_state = (
+        responses.lookup(
+            user_query,
+            history,
+            model_key,
+            bypass=file_path is not None or bom_update is not None,
+        )
+        if responses
+        else (None, {})
+    )
+    prompt_history_tokens = history_tokens(history)
+    usage = {}
+    response_id = f"msg_{uuid.uuid4()}"
+    request_span = tracing.current_span()
+    if request_span is not None:
+        request_span.set_attribute("kakoai.response_id", response_id)
+        request_span.set_attribute("kakoai.thread_id", thread_key)
+        request_span.set_attribute("gen_ai.request.model", model_key)
+        request_span.set_attribute("kakoai.response_cache_hit", prediction is not None)
+    if prediction is None:
+        # Run the agent with the selected LM context; its LM calls are traced under the response ID
+        with (
+            dspy.context(lm=selected_lm),
+            cascade_scope(auto_model),
+            dspy.track_usage() as tracker,
+            request_trace(response_id),
+        ):
+            prediction = agent(user_query=user_query, history=history)
+        usage = tracker.get_total_tokens()
+        if responses:
+            responses.store_prediction(cache_state, prediction)
     
     content = getattr(prediction, "process_result", None) or str(prediction)
 
@@ -301,8 +409,8 @@ async def run_agent(
         
         app.state.boms[thread_key] = {"bom_id": bom_id, "bom": bom, "source_document": source}
         
-        # Inject detailed history so Agent sees the Data AND the ID
-        history_content = f"BOM ID: {bom_id}\nDATA: {bom.model_dump_json()}"
+        # Inject the ID plus a compact CSV of the rows; tools load the full BOM by ID
+        history_content = bom_reference(bom_id, bom)
         append_to_history(history, user_query=f"System: BOM Extraction Completed (ID: {bom_id})", process_result=history_content)
         
         blocks.append(
@@ -316,10 +424,12 @@ async def run_agent(
         )
 
     append_to_history(history, user_query=user_query, process_result=content)
+    app.state.histories[thread_key] = history
     return AgentResponse(
-        response_id=f"msg_{uuid.uuid4()}",
+        response_id=response_id,
         created_at=datetime.now(timezone.utc),
         blocks=blocks,
+        usage=_report_usage(prompt_history_tokens, usage),
     )
 
 
@@ -334,8 +444,11 @@ async def generate_chat_title(request: AgentRequest):
 
         title_generator = dspy.Predict(GenerateTitle)
         
-        # dynamic model selection (default GEMINI_2_5_FLASH)
-        selected_lm = AVAILABLE_MODELS.get(request.model_id, GEMINI_2_5_FLASH)
+        # dynamic model selection (default GEMINI_2_5_FLASH, "auto" uses the cascade's title model)
+        if request.model_id == AUTO_MODEL_ID:
+            selected_lm = policy_lm("title") or GEMINI_2_5_FLASH
+        else:
+            selected_lm = AVAILABLE_MODELS.get(request.model_id, GEMINI_2_5_FLASH)
 
         with dspy.context(lm=selected_lm):
             prediction = title_generator(message=request.user_query)
@@ -353,6 +466,21 @@ def get_available_models() -> dict:
     return {"models": MODEL_OPTIONS}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def service_metrics() -> str:
+    """Prometheus-style metrics (store sizes, hit ratios, ...)."""
+    return metrics.render()
+
+
+@app.get("/traces/{response_id}")
+def get_request_trace(response_id: str, format: str = "summary", _: None = Depends(verify_user)) -> dict:
+    """LM call timeline of one /agent request (`format=chrome` for chrome://tracing / Perfetto)."""
+    trace = get_trace(response_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="No trace for this response (unknown or expired).")
+    return to_chrome_trace(trace) if format == "chrome" else trace
+
+
 @app.get("/health")
 def service_health() -> dict:
     """Health check endpoint."""
@@ -0,0 +1,131 @@
+"""Minimal in-process metrics registry rendered in the Prometheus text format.
+
+Kept dependency-free on purpose: metrics are plain counters/gauges held in
+memory and exposed via `GET /metrics`.
+"""
+from __future__ import annotations
+
+import threading
+import weakref
+from typing import Dict, List, Tuple
+
+_lock = threading.Lock()
+_metrics: List["_Metric"] = []
+_caches: "weakref.WeakValueDictionary[str, object]" = weakref.WeakValueDictionary()
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    inner = ",".join(f'{k}="{str(v).replace(chr(34), chr(39))}"' for k, v in labels)
+    return "{" + inner + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str) -> None:
+        self.name = name
+        self.help_text = help_text
+        self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+        self._lock = threading.Lock()
+        with _lock:
+            _metrics.append(self)
+
+    def samples(self) -> List[Tuple[str, Tuple[Tuple[str, str], ...], float]]:
+        with self._lock:
+            return [(self.name, labels, value) for labels, value in self._values.items()]
+
+
+class Counter(_Metric):
+    """Monotonically increasing value per label set."""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    """Arbitrary value per label set."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = float(value)
+
+
+class Histogram(_Metric):
+    """Distribution of observed values per label set (cumulative buckets, sum and count)."""
+
+    kind = "histogram"
+    DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[Tuple[str, str], ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            # Per-bucket counts, then sum and count
+            series = self._series.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self) -> List[Tuple[str, Tuple[Tuple[str, str], ...], float]]:
+        samples = []
+        with self._lock:
+            for labels, series in self._series.items():
+                for bound, count in zip(self.buckets, series):
+                    samples.append((f"{self.name}_bucket", labels + (("le", str(bound)),), count))
+                samples.append((f"{self.name}_bucket", labels + (("le", "+Inf"),), series[-1]))
+                samples.append((f"{self.name}_sum", labels, series[-2]))
+                samples.append((f"{self.name}_count", labels, series[-1]))
+        return samples
+
+
+def register_cache(cache) -> None:
+    """Expose entry/byte gauges and hit/miss/eviction counters for a BoundedCache."""
+    _caches[cache.name] = cache
+
+
+def _cache_samples() -> List[str]:
+    lines: List[str] = []
+    stats = {name: cache.stats() for name, cache in list(_caches.items())}
+    families = [
+        ("kakoai_cache_entries", "gauge", "Entries resident in the cache.", "entries"),
+        ("kakoai_cache_resident_bytes", "gauge", "Estimated resident bytes of the cache.", "bytes"),
+        ("kakoai_cache_hits_total", "counter", "Cache lookups that found an entry.", "hits"),
+        ("kakoai_cache_misses_total", "counter", "Cache lookups that found nothing.", "misses"),
+        ("kakoai_cache_evictions_total", "counter", "Entries evicted by size/count limits.", "evictions"),
+        ("kakoai_cache_expirations_total", "counter", "Entries dropped after their TTL.", "expirations"),
+    ]
+    for metric_name, kind, help_text, field in families:
+        lines.append(f"# HELP {metric_name} {help_text}")
+        lines.append(f"# TYPE {metric_name} {kind}")
+        for cache_name, values in sorted(stats.items()):
+            lines.append(f'{metric_name}{{cache="{cache_name}"}} {values.get(field, 0)}')
+    return lines
+
+
+def render() -> str:
+    """Render all registered metrics in the Prometheus text exposition format."""
+    lines: List[str] = []
+    with _lock:
+        metrics = list(_metrics)
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+    lines.extend(_cache_samples())
+    return "\n".join(lines) + "\n"
@@ -142,3 +142,6 @@ class AgentResponse(BaseModel):
     response_id: str
     created_at: datetime
     blocks: List[ContentBlock]
+    usage: Optional[Dict[str, Any]] = Field(
+        None, description="Prompt token report: estimated history tokens and LM usage per model."
+    )
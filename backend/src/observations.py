@@ -0,0 +1,209 @@
+"""Compact encoding of large tool observations for the ReAct prompt.
+
+Every observation in the ReAct trajectory is re-sent with each later step. An
+observation larger than `OBSERVATION_MAX_TOKENS` (estimated) is stored in the
+`ObservationStore` under an `OBS_` ID. The LM gets a compact, schema-stable
+rendering of it instead:
+
+- scalars as `key: value` lines;
+- lists of records as `;`-separated tables with a fixed column order and at
+  most `OBSERVATION_MAX_ROWS` rows, plus the total row count;
+- deeper nesting reduced to counts.
+
+USER_VIEW lines and Reference IDs (with Source/Title) are always kept. The LM can page
+through the full payload with the `read_observation` tool, and
+`utils.extract_tool_calls_from_trajectory` swaps the full payload back in, so
+UI blocks are built from complete data. Raw and encoded token counts per tool
+are exported in `/metrics`.
+"""
+from __future__ import annotations
+
+import functools
+import json
+import re
+from typing import Any, Callable, List, Optional
+
+from backend.src import metrics
+from backend.src.cache import ValueTooLarge
+from backend.src.config import OBSERVATION_MAX_TOKENS, OBSERVATION_MAX_ROWS
+from backend.src.history import CHARS_PER_TOKEN, estimate_tokens
+from backend.src.store import ObservationStore
+
+OBSERVATION_TOKENS = metrics.Counter(
+    "kakoai_observation_tokens_total",
+    "Estimated tokens of compacted tool observations, before (raw) and after (encoded) encoding.",
+)
+
+# Tables are halved down to this many rows before the text is cut off
+MIN_ROWS = 3
+MAX_CELL_CHARS = 80
+
+_OBSERVATION_ID = re.compile(r"\[full result: (OBS_[A-F0-9]{8})")
+# Parts the final answer depends on: USER_VIEW lines are copied into the reply, and
+# references are kept with their Source/Title but without the content that follows them
+_USER_VIEW_LINE = re.compile(r"^[ \t]*USER_VIEW:.*$", re.MULTILINE)
+_REFERENCE = re.compile(r"Reference ID: \w+(?:, (?:Source|Title|Approximate): [^,\n]*)*")
+
+
+def _cell(value: Any) -> str:
+    if isinstance(value, dict):
+        return f"{{{len(value)} fields}}"
+    if isinstance(value, list):
+        return f"[{len(value)} items]"
+    text = "" if value is None else str(value)
+    return text.replace(";", ",").replace("\n", " ").strip()[:MAX_CELL_CHARS]
+
+
+def _is_records(value: Any) -> bool:
+    return isinstance(value, list) and bool(value) and all(isinstance(v, dict) for v in value)
+
+
+def _table(name: str, rows: List[dict], max_rows: int, start_row: int) -> List[str]:
+    columns: List[str] = []
+    for row in rows:
+        columns.extend(key for key in row if key not in columns)
+    shown = rows[start_row : start_row + max_rows]
+    label = f"{len(rows)} rows"
+    if len(shown) < len(rows):
+        label += f", rows {start_row}-{start_row + len(shown) - 1} shown" if shown else ", none left"
+    lines = [f"{name} ({label}):", ";".join(columns)]
+    lines.extend(";".join(_cell(row.get(column)) for column in columns) for row in shown)
+    return lines
+
+
+def _render(name: str, value: Any, max_rows: int, start_row: int, depth: int = 0) -> List[str]:
+    if _is_records(value):
+        return _table(name, value, max_rows, start_row)
+    if isinstance(value, dict) and depth < 2:
+        lines = [f"{name}:"] if depth else []
+        indent = "  " if depth else ""
+        for key, child in value.items():
+            lines.extend(indent + line for line in _render(str(key), child, max_rows, start_row, depth + 1))
+        return lines
+    if isinstance(value, list):
+        more = f", ... {len(value)} total" if len(value) > max_rows else ""
+        return [f"{name}: [{', '.join(_cell(v) for v in value[:max_rows])}{more}]"]
+    return [f"{name}: {_cell(value)}"]
+
+
+def _parse(result: Any) -> Optional[Any]:
+    """The result as dict/list (JSON strings are decoded), or None for plain text."""
+    if isinstance(result, (dict, list)):
+        return result
+    if isinstance(result, str) and result.lstrip()[:1] in ("{", "["):
+        try:
+            return json.loads(result)
+        except ValueError:
+            return None
+    return None
+
+
+def encode(
+    result: Any,
+    max_tokens: int = OBSERVATION_MAX_TOKENS,
+    max_rows: int = OBSERVATION_MAX_ROWS,
+    start_row: int = 0,
+) -> str:
+    """Render a tool result within `max_tokens` (estimated).
+
+    Structured results are rendered as `key: value` lines and tables, halving
+    the table rows until the text fits. Plain text is cut off. Either way,
+    USER_VIEW lines and Reference IDs (with Source/Title) of the original are
+    kept, within the same budget.
+
+    Args:
+        result: The tool result (str, dict or list).
+        max_tokens: Token budget of the rendering.
+        max_rows: Initial number of rows per table.
+        start_row: First row of each table to show.
+
+    Returns:
+        The compact rendering.
+    """
+    data = _parse(result)
+    text = str(result)
+    if data is not None:
+        rows = max(1, max_rows)
+        while True:
+            value = data if isinstance(data, dict) else {"rows" if _is_records(data) else "items": data}
+            text = "\n".join(_render("", value, rows, start_row))
+            if estimate_tokens(text) <= max_tokens or rows <= MIN_ROWS:
+                break
+            rows = max(MIN_ROWS, rows // 2)
+    raw = str(result)
+    kept = [
+        part
+        for part in _USER_VIEW_LINE.findall(raw) + _REFERENCE.findall(raw)
+        if part.strip() not in text
+    ]
+    budget = max(0, max_tokens * CHARS_PER_TOKEN - sum(len(part) + 1 for part in kept))
+    return "\n".join(kept + [text[:budget]])
+
+
+def encode_observation(tool_name: str, result: Any) -> Any:
+    """Return `result` unchanged if small, else its compact rendering with an OBS_ reference."""
+    if not isinstance(result, (str, dict, list)):
+        return result
+    raw_tokens = estimate_tokens(result if isinstance(result, str) else json.dumps(result, default=str))
+    if raw_tokens <= OBSERVATION_MAX_TOKENS:
+        return result
+    try:
+        observation_id = ObservationStore().save(tool_name, result)
+    except ValueTooLarge as e:
+        print(f"Warning: {e}; the LM only sees the compact form")
+        observation_id = None
+        text = f"{encode(result)}\n[shortened result, ~{raw_tokens} tokens; too large to page through]"
+    else:
+        text = (
+            f"{encode(result)}\n[full result: {observation_id}, ~{raw_tokens} tokens; "
+            f"read more with read_observation('{observation_id}', start_row=...)]"
+        )
+    encoded_tokens = estimate_tokens(text)
+    if encoded_tokens >= raw_tokens:
+        # Barely over the limit: the OBS_ footer would outweigh the savings
+        return result
+    OBSERVATION_TOKENS.inc(raw_tokens, tool=tool_name, stage="raw")
+    OBSERVATION_TOKENS.inc(encoded_tokens, tool=tool_name, stage="encoded")
+    print(f"--- [Observations] {tool_name}: ~{raw_tokens} -> ~{encoded_tokens} tokens ({observation_id or 'not stored'}) ---")
+    return text
+
+
+def compact_tool(tool: Callable) -> Callable:
+    """Wrap an agent tool so its large results are encoded; name, signature and docstring are kept."""
+
+    @functools.wraps(tool)
+    def wrapper(*args, **kwargs):
+        return encode_observation(tool.__name__, tool(*args, **kwargs))
+
+    return wrapper
+
+
+def rehydrate(observation: Any) -> Any:
+    """The full stored payload of an encoded observation (unchanged if not encoded or expired)."""
+    if not isinstance(observation, str):
+        return observation
+    match = _OBSERVATION_ID.search(observation)
+    entry = ObservationStore().get(match.group(1)) if match else None
+    return entry["result"] if entry is not None else observation
+
+
+def read_observation(observation_id: str, start_row: int = 0, max_rows: int = OBSERVATION_MAX_ROWS) -> str:
+    """Reads more of a large tool result that was shortened in an earlier step.
+
+    Args:
+        observation_id: The OBS_ ID from the shortened result.
+        start_row: First row of each table to show (0-based). For plain text, the page number.
+        max_rows: Number of rows per table to show.
+
+    Returns:
+        The requested rows in the same compact format.
+    """
+    entry = ObservationStore().get(observation_id)
+    if entry is None:
+        return f"Error: Observation '{observation_id}' not found (it may have expired). Run the tool again."
+    start_row = max(0, start_row)
+    data = _parse(entry["result"])
+    if data is None:
+        window = OBSERVATION_MAX_TOKENS * CHARS_PER_TOKEN
+        return str(entry["result"])[start_row * window : (start_row + 1) * window] or "No more content."
+    return encode(data, max_rows=max_rows, start_row=start_row)
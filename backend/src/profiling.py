@@ -0,0 +1,77 @@
+"""Per-request stage timings and counters.
+
+Code marks its phases with `stage("name")` and notable events with
+`count("name")`. Every stage is also a tracing span (see tracing.py). Timings
+and counts are only recorded if a caller opened `record_stages()`;
+the recorder lives in a context variable, so worker threads started with a
+copied context (see `bom_tool._extract_multi_page`) report into the same one.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+from backend.src import tracing
+
+
+class StageRecorder:
+    """Accumulated seconds per stage and counts per event."""
+
+    def __init__(self) -> None:
+        self.stages: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def as_dict(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {
+                "stages_ms": {k: round(v * 1000, 3) for k, v in self.stages.items()},
+                "counters": dict(self.counters),
+            }
+
+
+_recorder: ContextVar[Optional[StageRecorder]] = ContextVar("stage_recorder", default=None)
+
+
+@contextmanager
+def record_stages() -> Iterator[StageRecorder]:
+    """Collect stage timings for everything run inside the block."""
+    recorder = StageRecorder()
+    token = _recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _recorder.reset(token)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Trace the block as span `stage.<name>` and, if a recorder is active, time it as `name`."""
+    recorder = _recorder.get()
+    with tracing.span(f"stage.{name}"):
+        if recorder is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            recorder.add(name, time.perf_counter() - start)
+
+
+def count(name: str, amount: int = 1) -> None:
+    """Increment an event counter if a recorder is active."""
+    recorder = _recorder.get()
+    if recorder is not None:
+        recorder.count(name, amount)
@@ -0,0 +1,259 @@
+"""Response cache in front of `KakoAgent` for repeated questions.
+
+An answer is stored under a key built from:
+
+- the normalized query text,
+- the BOM_/SEARCH_ IDs it references (plus the current content of those BOMs,
+  so a confirmed edit invalidates it),
+- the numbers and part-number-like tokens in the query,
+- the model ID,
+- whether the user is a mock (demo) user, so canned demo answers and real
+  Xentral data never cross,
+- a digest of the recent history. The digest is left out when the query is
+  self-contained (see `routing.QueryRouter.classify_by_rules`).
+
+Lookups try an exact match first. On a miss, a semantic tier compares the
+query embedding with cached queries in the same context (same IDs, numbers,
+model and history), so rephrasings hit. Quantities or part numbers never
+differ within a context, so "500 of BOM_X" cannot be answered with "50 of
+BOM_X".
+
+How long an answer stays valid depends on the tools behind it: stock and order
+data expire fastest, prices later, and answers without tools last longest.
+Uploads, BOM confirmations and runs that extract BOMs or write to Xentral are
+never cached.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import dspy
+import numpy as np
+
+from backend.src import metrics
+from backend.src.auth_context import is_current_user_mock
+from backend.src.cache import ValueTooLarge
+from backend.src.config import (
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_MAX_MB,
+    RESPONSE_CACHE_TTL_STOCK_SECONDS,
+    RESPONSE_CACHE_TTL_PRICE_SECONDS,
+    RESPONSE_CACHE_TTL_STATIC_SECONDS,
+    RESPONSE_CACHE_SEMANTIC_ENABLED,
+    RESPONSE_CACHE_SIMILARITY,
+)
+from backend.src.routing import QueryRouter
+from backend.src.state_backend import JSON_CODEC, create_store
+from backend.src.utils import extract_tool_calls_from_trajectory
+
+RESPONSE_CACHE_REQUESTS = metrics.Counter(
+    "kakoai_response_cache_requests_total", "Agent requests by response cache result."
+)
+
+# Tools whose results change with stock/orders, with market prices, or that must never be replayed
+STOCK_TOOLS = {
+    "check_feasibility",
+    "bom_check",
+    "get_sales_orders",
+    "get_future_boms",
+    "get_orders_by_customer",
+    "get_boms_for_orders",
+    "list_drawing_candidates",
+}
+PRICE_TOOLS = {
+    "search_part_by_mpn",
+    "find_alternatives",
+    "optimize_order",
+    "filter_sellers_by_shipping",
+    "sort_and_filter_by_best_price",
+}
+UNCACHEABLE_TOOLS = {"perform_bom_extraction", "prefetch_drawings", "xentral_BOM"}
+
+SEMANTIC_ENTRIES_PER_CONTEXT = 50
+
+_REFERENCE_ID = re.compile(r"\b(?:BOM|SEARCH)_[A-Z0-9]{4,}\b")
+# Quantities and part numbers: any token containing a digit
+_DIGIT_TOKEN = re.compile(r"[\w\-./]*\d[\w\-./]*")
+_WRITE_INTENT = re.compile(
+    r"\b(?:save|speicher\w*|anlegen|create|update|delete|lösch\w*|confirm\w*|bestätig\w*)\b|__BOM_",
+    re.IGNORECASE,
+)
+
+
+def normalize_query(user_query: str) -> str:
+    text = re.sub(r"[^\w\s\-./]", " ", user_query.lower())
+    return " ".join(text.split())
+
+
+def _digest(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:24]
+
+
+def _bom_versions(ids: List[str]) -> Dict[str, Optional[str]]:
+    from backend.src.store import BOMStore
+
+    versions = {}
+    for ref in ids:
+        if ref.startswith("BOM_"):
+            entry = BOMStore().get_bom(ref)
+            versions[ref] = _digest(entry["bom"].model_dump(mode="json")) if entry else None
+    return versions
+
+
+def _ttl_for_tools(tool_names: List[str]) -> Optional[float]:
+    """Validity of an answer produced with these tools (None = do not cache)."""
+    if any(name in UNCACHEABLE_TOOLS for name in tool_names):
+        return None
+    if any(name in STOCK_TOOLS or name not in PRICE_TOOLS for name in tool_names):
+        return RESPONSE_CACHE_TTL_STOCK_SECONDS
+    if tool_names:
+        return RESPONSE_CACHE_TTL_PRICE_SECONDS
+    return RESPONSE_CACHE_TTL_STATIC_SECONDS
+
+
+def _embed(text: str) -> Optional[np.ndarray]:
+    try:
+        from backend.src.tools.demand_analysis.embeddings import get_vertex_embedding
+
+        vector = np.asarray(get_vertex_embedding(text), dtype=np.float32)
+    except Exception as e:
+        print(f"Warning: Response cache embedding failed: {e}")
+        return None
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else None
+
+
+class ResponseCache:
+    """Exact + semantic cache of agent predictions (process_result and trajectory)."""
+
+    def __init__(self, semantic: bool = RESPONSE_CACHE_SEMANTIC_ENABLED) -> None:
+        self.store = create_store(
+            "agent_responses",
+            JSON_CODEC,
+            max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+            max_bytes=int(RESPONSE_CACHE_MAX_MB * 1024 * 1024),
+            ttl_seconds=max(
+                RESPONSE_CACHE_TTL_STOCK_SECONDS,
+                RESPONSE_CACHE_TTL_PRICE_SECONDS,
+                RESPONSE_CACHE_TTL_STATIC_SECONDS,
+            ),
+        )
+        self.semantic = semantic
+        self._lock = threading.Lock()
+        # Process-local semantic index: context key -> [(unit embedding, exact key)]
+        self._vectors: Dict[str, List[Tuple[np.ndarray, str]]] = {}
+
+    def _keys(self, user_query: str, history: dspy.History, model_id: str) -> Tuple[str, str, str]:
+        normalized = normalize_query(user_query)
+        ids = sorted(set(_REFERENCE_ID.findall(user_query)))
+        decision = QueryRouter.classify_by_rules(user_query, history)
+        # Self-contained queries do not depend on the conversation so far
+        history_digest = (
+            "" if decision is not None and not decision.use_planner else _digest(history.messages[-2:])
+        )
+        context = {
+            "ids": _bom_versions(ids) | {ref: None for ref in ids if not ref.startswith("BOM_")},
+            "tokens": sorted(set(_DIGIT_TOKEN.findall(normalized))),
+            "model": model_id,
+            "mock_user": is_current_user_mock(),
+            "history": history_digest,
+        }
+        context_key = _digest(context)
+        return normalized, context_key, _digest([context_key, normalized])
+
+    def _read(self, key: str) -> Optional[dspy.Prediction]:
+        entry = self.store.get(key)
+        if entry is None or entry["expires_at"] <= time.time():
+            return None
+        return dspy.Prediction(process_result=entry["process_result"], trajectory=entry["trajectory"])
+
+    def lookup(
+        self, user_query: str, history: dspy.History, model_id: str, bypass: bool = False
+    ) -> Tuple[Optional[dspy.Prediction], Dict]:
+        """Look up a cached answer.
+
+        Args:
+            user_query: The request as sent to the agent.
+            history: The thread history.
+            model_id: ID of the LM that would answer.
+            bypass: Skip the cache (uploads, BOM confirmations).
+
+        Returns:
+            (cached prediction or None, lookup state to pass to `store_prediction`)
+        """
+        if bypass or _WRITE_INTENT.search(user_query):
+            RESPONSE_CACHE_REQUESTS.inc(result="bypass")
+            return None, {}
+        normalized, context_key, key = self._keys(user_query, history, model_id)
+        state = {"normalized": normalized, "context_key": context_key, "key": key}
+
+        prediction = self._read(key)
+        if prediction is not None:
+            RESPONSE_CACHE_REQUESTS.inc(result="hit_exact")
+            print("--- [Response Cache] Exact hit ---")
+            return prediction, state
+
+        with self._lock:
+            candidates = list(self._vectors.get(context_key, []))
+        if self.semantic and candidates:
+            vector = _embed(normalized)
+            state["vector"] = vector
+            if vector is not None:
+                scores = np.stack([c[0] for c in candidates]) @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= RESPONSE_CACHE_SIMILARITY:
+                    prediction = self._read(candidates[best][1])
+                    if prediction is not None:
+                        RESPONSE_CACHE_REQUESTS.inc(result="hit_semantic")
+                        print(f"--- [Response Cache] Semantic hit (similarity {scores[best]:.3f}) ---")
+                        return prediction, state
+
+        RESPONSE_CACHE_REQUESTS.inc(result="miss")
+        return None, state
+
+    def store_prediction(self, state: Dict, prediction: dspy.Prediction) -> None:
+        """Cache a fresh agent prediction if its tools allow it."""
+        if not state:
+            return
+        trajectory = getattr(prediction, "trajectory", None) or {}
+        tool_names = [name for name, _, _ in extract_tool_calls_from_trajectory(trajectory) if name != "finish"]
+        ttl = _ttl_for_tools(tool_names)
+        process_result = getattr(prediction, "process_result", None)
+        if ttl is None or not process_result:
+            return
+        entry = {
+            "process_result": process_result,
+            "trajectory": trajectory,
+            "expires_at": time.time() + ttl,
+        }
+        try:
+            json.dumps(entry)
+        except (TypeError, ValueError):
+            return  # Observations that are not plain JSON (e.g. model objects) are not replayed
+        try:
+            self.store[state["key"]] = entry
+        except ValueTooLarge:
+            return
+
+        if self.semantic:
+            # Embedding is a network call: index in the background, off the response path
+            threading.Thread(target=self._index, args=(state,), daemon=True).start()
+
+    def _index(self, state: Dict) -> None:
+        vector = state.get("vector")
+        if vector is None:
+            vector = _embed(state["normalized"])
+        if vector is None:
+            return
+        with self._lock:
+            entries = self._vectors.pop(state["context_key"], [])
+            entries = [e for e in entries if e[1] != state["key"]][-(SEMANTIC_ENTRIES_PER_CONTEXT - 1):]
+            # Re-inserted last, so the dict stays ordered oldest context first
+            self._vectors[state["context_key"]] = entries + [(vector, state["key"])]
+            while len(self._vectors) > RESPONSE_CACHE_MAX_ENTRIES:
+                self._vectors.pop(next(iter(self._vectors)))
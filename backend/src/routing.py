@@ -0,0 +1,166 @@
+"""Decides per request whether the `KakoPlanner` pre-pass is worth running.
+
+The planner pulls the data a query needs out of the conversation history. That
+is wasted latency (a full LLM call) when the query is self-contained: a fresh
+upload, an explicit BOM_/SEARCH_ reference, or a thread without history.
+
+`QueryRouter.plan()` first applies cheap rules. Queries the rules cannot decide
+go to a small classifier model. While it runs, the planner is started
+speculatively, so a "needs planner" verdict costs no extra wait. Every decision
+is counted in `/metrics`, together with the planner time spent and an estimate
+of the time saved.
+"""
+from __future__ import annotations
+
+import contextvars
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, NamedTuple, Optional
+
+import dspy
+
+from backend.src import cascade, metrics
+from backend.src.config import (
+    AVAILABLE_MODELS,
+    ROUTER_CLASSIFIER_MODEL,
+    ROUTER_PLANNER_WORKERS,
+    ROUTER_SPECULATIVE_PLANNER,
+)
+
+ROUTE_DECISIONS = metrics.Counter(
+    "kakoai_router_decisions_total", "Planner routing decisions by path and reason."
+)
+PLANNER_SECONDS = metrics.Counter(
+    "kakoai_router_planner_seconds_total",
+    "Time spent in planner calls (including discarded speculative runs).",
+)
+PLANNER_SECONDS_SAVED = metrics.Counter(
+    "kakoai_router_planner_seconds_saved_total",
+    "Estimated planner latency avoided: mean planner time added per skip.",
+)
+
+_FILE_PATH = re.compile(r"\(file_path: '[^']+'\)")
+_REFERENCE_ID = re.compile(r"\b(?:BOM|SEARCH)_[A-Z0-9]{4,}\b")
+# Words that point back at earlier turns ("this BOM", "die Teile von oben", ...)
+_BACK_REFERENCE = re.compile(
+    r"\b(?:this|that|these|those|it|them|above|previous|last|same|"
+    r"dies\w*|jene\w*|davon|oben|vorher\w*|letzte\w*|gleiche\w*)\b",
+    re.IGNORECASE,
+)
+
+_executor = ThreadPoolExecutor(max_workers=ROUTER_PLANNER_WORKERS, thread_name_prefix="planner")
+
+
+class RouteDecision(NamedTuple):
+    use_planner: bool
+    reason: str
+
+
+class RouteQuerySignature(dspy.Signature):
+    """Decide whether the user query refers to data from earlier in the conversation
+    (e.g. "the BOM", "those parts", "the cheapest seller") that must be looked up
+    first, or whether it is self-contained."""
+
+    user_query: str = dspy.InputField()
+    last_turn: str = dspy.InputField(desc="The previous exchange of the conversation.")
+    needs_history: bool = dspy.OutputField(desc="True if the query depends on earlier results.")
+
+
+class QueryRouter:
+    """Rule-based routing with a small-model fallback."""
+
+    def __init__(self) -> None:
+        self.classifier = dspy.Predict(RouteQuerySignature)
+        self.classifier_lm = AVAILABLE_MODELS.get(ROUTER_CLASSIFIER_MODEL) if ROUTER_CLASSIFIER_MODEL else None
+        self._lock = threading.Lock()
+        self._planner_runs = 0
+        self._planner_mean_seconds = 0.0
+
+    @staticmethod
+    def classify_by_rules(user_query: str, history: dspy.History) -> Optional[RouteDecision]:
+        """Decide from the query text alone; None if the rules are inconclusive."""
+        if not history.messages:
+            return RouteDecision(False, "empty_history")
+        if _FILE_PATH.search(user_query):
+            return RouteDecision(False, "file_upload")
+        # "compare BOM_X with those parts from above" names an ID and still needs the history
+        if _BACK_REFERENCE.search(user_query):
+            return RouteDecision(True, "back_reference")
+        if _REFERENCE_ID.search(user_query):
+            return RouteDecision(False, "explicit_reference")
+        return None
+
+    def _classify_by_model(self, user_query: str, history: dspy.History, classifier_lm: dspy.LM) -> RouteDecision:
+        last = history.messages[-1]
+        last_turn = f"User: {last.get('user_query', '')}\nAssistant: {str(last.get('process_result', ''))[:1000]}"
+        try:
+            with dspy.context(lm=classifier_lm):
+                prediction = self.classifier(user_query=user_query, last_turn=last_turn)
+            return RouteDecision(bool(prediction.needs_history), "classifier")
+        except Exception as e:
+            print(f"Warning: Router classifier failed, running planner: {e}")
+            return RouteDecision(True, "classifier_error")
+
+    def _record_planner(self, seconds: float) -> None:
+        PLANNER_SECONDS.inc(seconds)
+        with self._lock:
+            self._planner_runs += 1
+            self._planner_mean_seconds += (seconds - self._planner_mean_seconds) / self._planner_runs
+
+    def _record(self, decision: RouteDecision) -> None:
+        path = "planner" if decision.use_planner else "skip"
+        ROUTE_DECISIONS.inc(path=path, reason=decision.reason)
+        if not decision.use_planner:
+            with self._lock:
+                PLANNER_SECONDS_SAVED.inc(self._planner_mean_seconds)
+        print(f"--- [Router] {'Running' if decision.use_planner else 'Skipping'} planner ({decision.reason}) ---")
+
+    def _timed(self, planner: Callable[[], dspy.Prediction]) -> dspy.Prediction:
+        start = time.perf_counter()
+        try:
+            return planner()
+        finally:
+            self._record_planner(time.perf_counter() - start)
+
+    def plan(
+        self, planner: Callable[[], dspy.Prediction], user_query: str, history: dspy.History
+    ) -> tuple[RouteDecision, Optional[dspy.Prediction]]:
+        """Run `planner` only if the query needs it.
+
+        Args:
+            planner: Zero-argument callable running the planner for this request.
+            user_query: The raw user query (including any injected file_path).
+            history: The thread history.
+
+        Returns:
+            (decision, planner prediction or None if it was skipped)
+        """
+        decision = self.classify_by_rules(user_query, history)
+        # The "auto" model cascade brings its own router model
+        classifier_lm = cascade.stage_lm("router") or self.classifier_lm
+        if decision is None and classifier_lm is None:
+            decision = RouteDecision(True, "no_classifier")
+
+        if decision is not None:
+            self._record(decision)
+            return decision, self._timed(planner) if decision.use_planner else None
+
+        # Inconclusive: classify with the small model while the planner runs speculatively
+        # (in a copy of this context, so the request's dspy.context(lm=...) applies).
+        speculative = (
+            _executor.submit(contextvars.copy_context().run, self._timed, planner)
+            if ROUTER_SPECULATIVE_PLANNER
+            else None
+        )
+        decision = self._classify_by_model(user_query, history, classifier_lm)
+        self._record(decision)
+        if not decision.use_planner:
+            if speculative is not None:
+                speculative.cancel()
+            return decision, None
+        if speculative is not None and speculative.cancel():
+            # Still queued behind other requests' planner runs: run it here instead of waiting
+            speculative = None
+        return decision, speculative.result() if speculative else self._timed(planner)
@@ -0,0 +1,209 @@
+"""Speculative prefetching of the agent's likely next tool call.
+
+Some tool chains are near-deterministic. When the user asks whether a drawing
+is feasible for a given amount, `perform_bom_extraction` is followed by
+`check_feasibility` for the new `BOM_` ID. When such a tool returns, the
+speculator starts the predicted follow-up call in the background, while the LM
+is still generating its next step. If the agent then
+asks for exactly that call (same arguments after defaults are applied), the
+prefetched result is returned instead of running the tool again.
+
+Only read-only follow-ups are started (`SPECULATIVE_TOOLS`), so a wrong guess
+costs one wasted lookup and nothing else. `sort_and_filter_by_best_price` is not
+one of them, because it stores a new `SEARCH_` entry. Speculation is scoped to one agent
+request (`speculation_scope()` in `KakoAgent.__call__`). Results therefore
+never cross users or requests, and prefetches that were never used are counted
+as wasted when the request ends. Outcomes are exported in `/metrics`.
+"""
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+import dspy
+
+from backend.src import metrics, tracing
+from backend.src.config import SPECULATION_ENABLED, SPECULATION_MAX_WORKERS, SPECULATION_MAX_PER_REQUEST
+from backend.src.workflows import _FEASIBILITY, _FILE_PATH, _ORDER_AMOUNT, WorkflowState
+
+SPECULATIVE_CALLS = metrics.Counter(
+    "kakoai_speculative_calls_total",
+    "Speculative tool calls by tool and outcome (started, hit, wasted, failed).",
+)
+SPECULATIVE_SECONDS_SAVED = metrics.Counter(
+    "kakoai_speculative_seconds_saved_total",
+    "Tool time that ran ahead of the agent's request for a prefetched result.",
+)
+
+# Follow-ups that only read data and may run without the agent asking for them
+SPECULATIVE_TOOLS = {"check_feasibility"}
+
+_BOM_REFERENCE = re.compile(r"Reference ID: (BOM_[A-F0-9]+)")
+
+_executor = ThreadPoolExecutor(max_workers=SPECULATION_MAX_WORKERS, thread_name_prefix="speculation")
+_scope: ContextVar[Optional["SpeculationScope"]] = ContextVar("speculation_scope", default=None)
+# The wrapped tools by name, used to run the predicted calls
+_tools: Dict[str, Callable] = {}
+
+
+def _after_extraction(args: Dict[str, Any], result: Any, scope: "SpeculationScope") -> Optional[Tuple[str, Dict]]:
+    match = _BOM_REFERENCE.search(str(result))
+    if not match or scope.feasibility_amount is None:
+        return None
+    return "check_feasibility", {"bom_input": match.group(1), "order_amount": scope.feasibility_amount}
+
+
+# tool -> rules mapping (bound call arguments, result, scope) to a predicted (tool, args)
+RULES: Dict[str, Tuple[Callable, ...]] = {
+    "perform_bom_extraction": (_after_extraction,),
+}
+
+
+def _call_key(name: str, args: tuple, kwargs: dict) -> Optional[str]:
+    """Argument-order independent key of a call, with defaults filled in (None if the args do not bind)."""
+    try:
+        bound = inspect.signature(_tools[name]).bind(*args, **kwargs)
+    except (KeyError, TypeError, ValueError):
+        return None
+    bound.apply_defaults()
+    return f"{name}:{json.dumps(bound.arguments, sort_keys=True, default=str)}"
+
+
+def _bound_arguments(name: str, args: tuple, kwargs: dict) -> Dict[str, Any]:
+    try:
+        bound = inspect.signature(_tools[name]).bind(*args, **kwargs)
+    except (KeyError, TypeError, ValueError):
+        return dict(kwargs)
+    bound.apply_defaults()
+    return dict(bound.arguments)
+
+
+class _Prefetch:
+    def __init__(self, name: str, future: Future) -> None:
+        self.name = name
+        self.future = future
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+
+class SpeculationScope:
+    """Prefetched calls of one agent request, keyed by tool and normalized arguments."""
+
+    def __init__(self, user_query: str) -> None:
+        # Order amount of an explicit feasibility request (the agent does not check feasibility unasked)
+        text = _FILE_PATH.sub("", user_query)
+        asks_feasibility = bool(_FEASIBILITY.search(text) and _ORDER_AMOUNT.search(text))
+        self.feasibility_amount: Optional[int] = (
+            WorkflowState(user_query, dspy.History(messages=[])).order_amount if asks_feasibility else None
+        )
+        self._prefetched: Dict[str, _Prefetch] = {}
+        self._started = 0
+        self._lock = threading.Lock()
+
+    def take(self, name: str, args: tuple, kwargs: dict) -> Tuple[bool, Any]:
+        """(True, result) if this exact call was prefetched successfully, else (False, None)."""
+        key = _call_key(name, args, kwargs)
+        with self._lock:
+            prefetch = self._prefetched.pop(key, None) if key else None
+        if prefetch is None:
+            return False, None
+        requested = time.perf_counter()
+        try:
+            result = prefetch.future.result()
+        except Exception as e:
+            print(f"--- [Speculation] Prefetched {name} failed ({e}); running it again ---")
+            SPECULATIVE_CALLS.inc(tool=name, outcome="failed")
+            return False, None
+        # Tool time that had already passed when the agent asked for the result
+        saved = min(prefetch.finished or requested, requested) - prefetch.started
+        SPECULATIVE_SECONDS_SAVED.inc(max(0.0, saved))
+        SPECULATIVE_CALLS.inc(tool=name, outcome="hit")
+        print(f"--- [Speculation] Hit: {name} ({saved:.2f}s saved) ---")
+        return True, result
+
+    def predict(self, name: str, args: tuple, kwargs: dict, result: Any) -> None:
+        """Start the follow-up calls the rules predict after `name` returned `result`."""
+        arguments = _bound_arguments(name, args, kwargs)
+        for rule in RULES.get(name, ()):
+            prediction = rule(arguments, result, self)
+            if prediction is not None:
+                self._start(*prediction)
+
+    def _start(self, name: str, kwargs: Dict[str, Any]) -> None:
+        if name not in SPECULATIVE_TOOLS or name not in _tools:
+            return
+        key = _call_key(name, (), kwargs)
+        with self._lock:
+            if key is None or key in self._prefetched or self._started >= SPECULATION_MAX_PER_REQUEST:
+                return
+            self._started += 1
+            future: Future = Future()
+            prefetch = _Prefetch(name, future)
+            self._prefetched[key] = prefetch
+
+        def run() -> None:
+            try:
+                with tracing.span(f"speculation.{name}", **{"kakoai.speculative": True}):
+                    result = _tools[name](**kwargs)
+            except Exception as e:
+                prefetch.finished = time.perf_counter()
+                future.set_exception(e)
+                return
+            prefetch.finished = time.perf_counter()
+            future.set_result(result)
+
+        SPECULATIVE_CALLS.inc(tool=name, outcome="started")
+        print(f"--- [Speculation] Prefetching {name}({kwargs}) ---")
+        # Copied context: the prefetch sees the request's mock-user flag and trace
+        _executor.submit(contextvars.copy_context().run, run)
+
+    def close(self) -> None:
+        """Count prefetches the agent never asked for as wasted."""
+        with self._lock:
+            unused = list(self._prefetched.values())
+            self._prefetched.clear()
+        for prefetch in unused:
+            SPECULATIVE_CALLS.inc(tool=prefetch.name, outcome="wasted")
+
+
+@contextlib.contextmanager
+def speculation_scope(user_query: str) -> Iterator[Optional[SpeculationScope]]:
+    """Enable speculative prefetching for the tool calls of one agent request."""
+    if not SPECULATION_ENABLED:
+        yield None
+        return
+    scope = SpeculationScope(user_query)
+    token = _scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _scope.reset(token)
+        scope.close()
+
+
+def speculative(tool: Callable) -> Callable:
+    """Wrap a tool so it serves prefetched results and triggers predictions for its follow-ups."""
+    name = tool.__name__
+    _tools[name] = tool
+
+    @functools.wraps(tool)
+    def wrapper(*args, **kwargs):
+        scope = _scope.get()
+        if scope is None:
+            return tool(*args, **kwargs)
+        hit, result = scope.take(name, args, kwargs)
+        if not hit:
+            result = tool(*args, **kwargs)
+        scope.predict(name, args, kwargs, result)
+        return result
+
+    return wrapper
@@ -0,0 +1,385 @@
+"""Pluggable backends for session state shared between backend workers.
+
+All stores expose the `BoundedCache` interface (`get`, `set(..., parent=)`,
+`pop`, `items`, `stats`, `[]`, `in`). The backend is chosen via `STATE_BACKEND`:
+
+- ``memory`` (default): process-local `BoundedCache`, no serialization.
+- ``sqlite``: one shared SQLite file (WAL), lets several uvicorn workers on the
+  same host serve the same thread.
+- ``redis``: any Redis-compatible server, for several hosts. Requires the
+  optional ``redis`` package; count/byte limits are left to the server's
+  ``maxmemory`` policy.
+
+Values are serialized with a per-store `Codec` (compact JSON + zlib).
+"""
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, Iterator, NamedTuple, Optional, Tuple
+
+import dspy
+
+from backend.src import metrics
+from backend.src.cache import BoundedCache, ValueTooLarge
+from backend.src.config import STATE_BACKEND, STATE_REDIS_URL, STATE_SQLITE_PATH
+from backend.src.models import BillOfMaterials
+
+
+class Codec(NamedTuple):
+    """Serializer pair used by the external backends."""
+
+    dumps: Callable[[Any], bytes]
+    loads: Callable[[bytes], Any]
+
+
+def _pack(obj: Any) -> bytes:
+    return zlib.compress(json.dumps(obj, separators=(",", ":")).encode("utf-8"), 6)
+
+
+def _unpack(raw: bytes) -> Any:
+    return json.loads(zlib.decompress(raw).decode("utf-8"))
+
+
+def _dump_bom_entry(entry: Dict[str, Any]) -> bytes:
+    payload = dict(entry)
+    payload["bom"] = entry["bom"].model_dump(mode="json")
+    return _pack(payload)
+
+
+def _load_bom_entry(raw: bytes) -> Dict[str, Any]:
+    payload = _unpack(raw)
+    payload["bom"] = BillOfMaterials.model_validate(payload["bom"])
+    return payload
+
+
+JSON_CODEC = Codec(_pack, _unpack)
+BOM_ENTRY_CODEC = Codec(_dump_bom_entry, _load_bom_entry)
+HISTORY_CODEC = Codec(
+    lambda history: _pack(history.messages),
+    lambda raw: dspy.History(messages=_unpack(raw)),
+)
+
+
+class SQLiteStateStore:
+    """Shared-file store; safe across threads and processes on one host."""
+
+    def __init__(
+        self,
+        name: str,
+        codec: Codec,
+        path: str = STATE_SQLITE_PATH,
+        max_entries: int = 1000,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl_seconds: float = 3600,
+    ) -> None:
+        self.name = name
+        self.codec = codec
+        self.path = os.path.expanduser(path)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+        dirn = os.path.dirname(self.path)
+        if dirn:
+            os.makedirs(dirn, exist_ok=True)
+        with self._conn() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS state (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    parent TEXT,
+                    size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS state_lru ON state (namespace, accessed_at)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS state_parent ON state (namespace, parent)"
+            )
+        metrics.register_cache(self)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _delete_subtree(self, conn: sqlite3.Connection, key: str) -> int:
+        cursor = conn.execute(
+            """
+            WITH RECURSIVE sub(key) AS (
+                SELECT ?
+                UNION
+                SELECT s.key FROM state s JOIN sub ON s.parent = sub.key
+                WHERE s.namespace = ?
+            )
+            DELETE FROM state WHERE namespace = ? AND key IN (SELECT key FROM sub)
+            """,
+            (key, self.name, self.name),
+        )
+        return cursor.rowcount
+
+    def _touch(self, conn: sqlite3.Connection, key: str, now: float) -> None:
+        seen = set()
+        while key and key not in seen:
+            seen.add(key)
+            row = conn.execute(
+                "UPDATE state SET accessed_at = ? WHERE namespace = ? AND key = ? RETURNING parent",
+                (now, self.name, key),
+            ).fetchone()
+            key = row[0] if row else None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        conn = self._conn()
+        now = time.time()
+        row = conn.execute(
+            "SELECT value, expires_at FROM state WHERE namespace = ? AND key = ?",
+            (self.name, key),
+        ).fetchone()
+        if row is None or row[1] <= now:
+            self._counters["misses"] += 1
+            return default
+        self._touch(conn, key, now)
+        self._counters["hits"] += 1
+        return self.codec.loads(row[0])
+
+    def set(self, key: str, value: Any, parent: Optional[str] = None) -> None:
+        raw = self.codec.dumps(value)
+        if len(raw) > self.max_bytes:
+            raise ValueTooLarge(f"{self.name}: value of {len(raw)} bytes exceeds the limit of {self.max_bytes} bytes")
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if parent is not None and conn.execute(
+                "SELECT 1 FROM state WHERE namespace = ? AND key = ?", (self.name, parent)
+            ).fetchone() is None:
+                parent = None
+            conn.execute(
+                """
+                INSERT INTO state (namespace, key, value, parent, size, expires_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (namespace, key) DO UPDATE SET
+                    value = excluded.value,
+                    parent = excluded.parent,
+                    size = excluded.size,
+                    expires_at = excluded.expires_at,
+                    accessed_at = excluded.accessed_at
+                """,
+                (self.name, key, raw, parent, len(raw), now + self.ttl_seconds, now),
+            )
+            self._touch(conn, key, now)
+
+            expired = conn.execute(
+                "DELETE FROM state WHERE namespace = ? AND expires_at <= ?", (self.name, now)
+            ).rowcount
+            self._counters["expirations"] += max(expired, 0)
+
+            while True:
+                count, total = conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM state WHERE namespace = ?",
+                    (self.name,),
+                ).fetchone()
+                if count <= self.max_entries and total <= self.max_bytes:
+                    break
+                oldest = conn.execute(
+                    "SELECT key FROM state WHERE namespace = ? ORDER BY accessed_at LIMIT 1",
+                    (self.name,),
+                ).fetchone()
+                if oldest is None:
+                    break
+                self._counters["evictions"] += self._delete_subtree(conn, oldest[0])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        value = self.get(key, default)
+        self._delete_subtree(self._conn(), key)
+        return value
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT key, value FROM state WHERE namespace = ? AND expires_at > ?",
+            (self.name, time.time()),
+        ).fetchall()
+        return iter([(key, self.codec.loads(raw)) for key, raw in rows])
+
+    def stats(self) -> Dict[str, int]:
+        count, total = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM state WHERE namespace = ?",
+            (self.name,),
+        ).fetchone()
+        return {"entries": count, "bytes": total, **self._counters}
+
+    def __contains__(self, key: str) -> bool:
+        row = self._conn().execute(
+            "SELECT 1 FROM state WHERE namespace = ? AND key = ? AND expires_at > ?",
+            (self.name, key, time.time()),
+        ).fetchone()
+        return row is not None
+
+    def __getitem__(self, key: str) -> Any:
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.set(key, value)
+
+    def __len__(self) -> int:
+        return self.stats()["entries"]
+
+
+class RedisStateStore:
+    """Store on a Redis-compatible server; shared across hosts."""
+
+    def __init__(
+        self,
+        name: str,
+        codec: Codec,
+        url: str = STATE_REDIS_URL,
+        ttl_seconds: float = 3600,
+    ) -> None:
+        try:
+            import redis
+        except ImportError as exc:
+            raise RuntimeError(
+                "STATE_BACKEND=redis requires the 'redis' package (pip install redis)."
+            ) from exc
+        self.name = name
+        self.codec = codec
+        self.ttl_seconds = int(ttl_seconds)
+        self._redis = redis.Redis.from_url(url)
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+        metrics.register_cache(self)
+
+    def _key(self, key: str) -> str:
+        return f"kakoai:{self.name}:{key}"
+
+    def _children_key(self, key: str) -> str:
+        return f"kakoai:{self.name}:children:{key}"
+
+    def get(self, key: str, default: Any = None) -> Any:
+        raw, parent = self._redis.hmget(self._key(key), "v", "p")
+        if raw is None:
+            self._counters["misses"] += 1
+            return default
+        # Reading each ancestor keeps the lineage warm for the server's LRU policy.
+        seen = {key}
+        while parent:
+            parent = parent.decode("utf-8")
+            if parent in seen:
+                break
+            seen.add(parent)
+            parent = self._redis.hget(self._key(parent), "p")
+        self._counters["hits"] += 1
+        return self.codec.loads(raw)
+
+    def set(self, key: str, value: Any, parent: Optional[str] = None) -> None:
+        mapping = {"v": self.codec.dumps(value)}
+        if parent is not None:
+            mapping["p"] = parent
+        pipe = self._redis.pipeline()
+        pipe.delete(self._key(key))
+        pipe.hset(self._key(key), mapping=mapping)
+        pipe.expire(self._key(key), self.ttl_seconds)
+        if parent is not None:
+            pipe.sadd(self._children_key(parent), key)
+            pipe.expire(self._children_key(parent), self.ttl_seconds)
+        pipe.execute()
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        value = self.get(key, default)
+        stack = [key]
+        while stack:
+            current = stack.pop()
+            stack.extend(c.decode("utf-8") for c in self._redis.smembers(self._children_key(current)))
+            self._redis.delete(self._key(current), self._children_key(current))
+        return value
+
+    def _data_keys(self) -> list:
+        prefix = f"kakoai:{self.name}:"
+        return [
+            k for k in self._redis.scan_iter(match=f"{prefix}*", count=500)
+            if not k.decode("utf-8").startswith(f"{prefix}children:")
+        ]
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        prefix = len(f"kakoai:{self.name}:")
+        result = []
+        for k in self._data_keys():
+            raw = self._redis.hget(k, "v")
+            if raw is not None:
+                result.append((k.decode("utf-8")[prefix:], self.codec.loads(raw)))
+        return iter(result)
+
+    def stats(self) -> Dict[str, int]:
+        keys = self._data_keys()
+        pipe = self._redis.pipeline()
+        for k in keys:
+            pipe.hstrlen(k, "v")
+        sizes = pipe.execute() if keys else []
+        return {"entries": len(keys), "bytes": int(sum(sizes)), **self._counters}
+
+    def __contains__(self, key: str) -> bool:
+        return bool(self._redis.exists(self._key(key)))
+
+    def __getitem__(self, key: str) -> Any:
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.set(key, value)
+
+    def __len__(self) -> int:
+        return self.stats()["entries"]
+
+
+def create_store(
+    name: str,
+    codec: Codec,
+    max_entries: int,
+    max_bytes: int,
+    ttl_seconds: float,
+):
+    """Create a session-state store for the configured STATE_BACKEND."""
+    backend = (STATE_BACKEND or "memory").lower()
+    if backend == "sqlite":
+        return SQLiteStateStore(
+            name,
+            codec,
+            path=STATE_SQLITE_PATH,
+            max_entries=max_entries,
+            max_bytes=max_bytes,
+            ttl_seconds=ttl_seconds,
+        )
+    if backend == "redis":
+        return RedisStateStore(name, codec, url=STATE_REDIS_URL, ttl_seconds=ttl_seconds)
+    if backend != "memory":
+        print(f"Warning: Unknown STATE_BACKEND '{STATE_BACKEND}', using in-memory state.")
+    return BoundedCache(
+        name, max_entries=max_entries, max_bytes=max_bytes, ttl_seconds=ttl_seconds
+    )
@@ -1,5 +1,17 @@
 from typing import Dict, Optional, Any
+from backend.src.config import (
+    BOM_STORE_MAX_ENTRIES,
+    BOM_STORE_MAX_MB,
+    BOM_STORE_TTL_SECONDS,
+    PROCUREMENT_STORE_MAX_ENTRIES,
+    PROCUREMENT_STORE_MAX_MB,
+    PROCUREMENT_STORE_TTL_SECONDS,
+    OBSERVATION_STORE_MAX_ENTRIES,
+    OBSERVATION_STORE_MAX_MB,
+    OBSERVATION_STORE_TTL_SECONDS,
+)
 from backend.src.models import BillOfMaterials
+from backend.src.state_backend import BOM_ENTRY_CODEC, JSON_CODEC, create_store
 
 class BOMStore:
     _instance = None
@@ -7,23 +19,32 @@ class BOMStore:
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(BOMStore, cls).__new__(cls)
-            cls._instance._boms = {}
+            cls._instance._boms = create_store(
+                "bom_store",
+                BOM_ENTRY_CODEC,
+                max_entries=BOM_STORE_MAX_ENTRIES,
+                max_bytes=int(BOM_STORE_MAX_MB * 1024 * 1024),
+                ttl_seconds=BOM_STORE_TTL_SECONDS,
+            )
         return cls._instance
 
     def save_bom(self, bom_id: str, bom: BillOfMaterials, source_document: str = ""):
-        """Store a BOM in memory."""
+        """Store a BOM in the session state backend."""
         self._boms[bom_id] = {
             "bom": bom,
             "source_document": source_document
         }
-        print(f"--- [BOMStore] Saved BOM {bom_id} to memory. ---")
+        print(f"--- [BOMStore] Saved BOM {bom_id} to state store. ---")
 
     def get_bom(self, bom_id: str) -> Optional[Dict[str, Any]]:
-        """Retrieve a BOM by ID."""
+        """Retrieve a BOM by ID (None if unknown or evicted)."""
         return self._boms.get(bom_id)
 
     def list_boms(self) -> Dict[str, Any]:
-        return self._boms
+        return dict(self._boms.items())
+
+    def stats(self) -> Dict[str, int]:
+        return self._boms.stats()
 
 
 class ProcurementStore:
@@ -33,17 +54,61 @@ class ProcurementStore:
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(ProcurementStore, cls).__new__(cls)
-            cls._instance._searches = {}
+            cls._instance._searches = create_store(
+                "procurement_store",
+                JSON_CODEC,
+                max_entries=PROCUREMENT_STORE_MAX_ENTRIES,
+                max_bytes=int(PROCUREMENT_STORE_MAX_MB * 1024 * 1024),
+                ttl_seconds=PROCUREMENT_STORE_TTL_SECONDS,
+            )
         return cls._instance
 
-    def save_search_result(self, data: Any) -> str:
-        """Store a search result and return an ID."""
+    def save_search_result(self, data: Any, previous_id: Optional[str] = None) -> str:
+        """Store a search result and return an ID.
+
+        Derived results (filters/sorts) pass the ID they were derived from so the
+        whole chain is kept alive and evicted together.
+        """
         import uuid
         search_id = f"SEARCH_{uuid.uuid4().hex[:8].upper()}"
-        self._searches[search_id] = data
+        self._searches.set(search_id, data, parent=previous_id)
         print(f"--- [ProcurementStore] Cached data under {search_id} ---")
         return search_id
 
     def get_search_result(self, search_id: str) -> Optional[Any]:
-        """Retrieve a search result by ID."""
+        """Retrieve a search result by ID (None if unknown or evicted)."""
         return self._searches.get(search_id)
+
+    def stats(self) -> Dict[str, int]:
+        return self._searches.stats()
+
+
+class ObservationStore:
+    """Full payloads of tool results that reached the LM in compact form (see observations.py)."""
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(ObservationStore, cls).__new__(cls)
+            cls._instance._observations = create_store(
+                "observation_store",
+                JSON_CODEC,
+                max_entries=OBSERVATION_STORE_MAX_ENTRIES,
+                max_bytes=int(OBSERVATION_STORE_MAX_MB * 1024 * 1024),
+                ttl_seconds=OBSERVATION_STORE_TTL_SECONDS,
+            )
+        return cls._instance
+
+    def save(self, tool_name: str, result: Any) -> str:
+        """Store a tool result and return its OBS_ ID."""
+        import uuid
+        observation_id = f"OBS_{uuid.uuid4().hex[:8].upper()}"
+        self._observations[observation_id] = {"tool": tool_name, "result": result}
+        return observation_id
+
+    def get(self, observation_id: str) -> Optional[Dict[str, Any]]:
+        """Retrieve a stored observation ({"tool", "result"}; None if unknown or evicted)."""
+        return self._observations.get(observation_id)
+
+    def stats(self) -> Dict[str, int]:
+        return self._observations.stats()
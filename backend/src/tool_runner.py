@@ -0,0 +1,150 @@
+"""Concurrent execution of independent tool calls requested in one ReAct step.
+
+`dspy.ReAct` runs one tool per step, so a fan-out question ("stock for these
+five products", "search these MPNs", "BOMs of these orders") costs one LM
+round-trip per lookup. The `run_parallel` tool takes a batch of independent
+calls. It runs them in a copied context so request tracing and the mock-user
+flag apply. Results come back in one observation.
+
+Each tool runs on its own thread pool, sized to its concurrency limit
+(`TOOL_RUNNER_CONCURRENCY_LIMITS`, default `TOOL_RUNNER_DEFAULT_CONCURRENCY`).
+A batch therefore cannot flood Xentral, Nexar or the extraction model, and calls
+waiting for a slow tool are queued without holding threads that other tools
+need. `utils.extract_tool_calls_from_trajectory` expands a `run_parallel` step
+back into its individual calls, so UI blocks and the response cache see the
+real tools.
+"""
+from __future__ import annotations
+
+import contextvars
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from backend.src import metrics
+from backend.src.config import (
+    TOOL_RUNNER_MAX_BATCH,
+    TOOL_RUNNER_DEFAULT_CONCURRENCY,
+    TOOL_RUNNER_CONCURRENCY_LIMITS,
+)
+
+PARALLEL_TOOL_CALLS = metrics.Counter(
+    "kakoai_parallel_tool_calls_total", "Tool calls run inside run_parallel batches, by tool and outcome."
+)
+PARALLEL_SECONDS_SAVED = metrics.Counter(
+    "kakoai_parallel_tool_seconds_saved_total",
+    "Sum of the tool durations of a batch minus its wall time.",
+)
+
+PARALLEL_TOOL_NAME = "run_parallel"
+# One header line per call in the combined observation: "### [<index>] <tool>"
+_RESULT_HEADER = re.compile(r"^### \[(\d+)\] ([\w.]+)$", re.MULTILINE)
+
+def _parse_limits(spec: str) -> Dict[str, int]:
+    """Parse "tool=2,other=1" into {"tool": 2, "other": 1} (malformed entries are skipped)."""
+    limits = {}
+    for item in spec.split(","):
+        name, _, value = item.partition("=")
+        if name.strip() and value.strip().isdigit():
+            limits[name.strip()] = max(1, int(value))
+    return limits
+
+
+class ToolRunner:
+    """Runs batches of tool calls concurrently on one pool per tool, sized to the tool's limit."""
+
+    def __init__(self, tools: List[Callable]) -> None:
+        self.tools = {tool.__name__: tool for tool in tools}
+        limits = _parse_limits(TOOL_RUNNER_CONCURRENCY_LIMITS)
+        self._executors = {
+            name: ThreadPoolExecutor(
+                max_workers=limits.get(name, TOOL_RUNNER_DEFAULT_CONCURRENCY), thread_name_prefix=f"tool-{name}"
+            )
+            for name in self.tools
+        }
+
+    def _call(self, name: str, args: Dict[str, Any]) -> Tuple[Any, float]:
+        start = time.perf_counter()
+        try:
+            result = self.tools[name](**args)
+            PARALLEL_TOOL_CALLS.inc(tool=name, outcome="ok")
+        except Exception as e:
+            result = f"Error: {name} failed: {e}"
+            PARALLEL_TOOL_CALLS.inc(tool=name, outcome="error")
+        return result, time.perf_counter() - start
+
+    def _validate(self, call: Any) -> Tuple[Optional[str], Dict[str, Any], Optional[str]]:
+        if not isinstance(call, dict):
+            return None, {}, "Error: each call must be an object with 'tool' and 'args'."
+        name = call.get("tool") or call.get("tool_name")
+        args = call.get("args") or call.get("tool_args") or {}
+        if isinstance(args, str):
+            try:
+                args = json.loads(args)
+            except ValueError:
+                return name, {}, "Error: 'args' must be an object."
+        if not isinstance(name, str) or name not in self.tools:
+            return name, args, f"Error: unknown tool '{name}'. Available: {', '.join(sorted(self.tools))}."
+        if not isinstance(args, dict):
+            return name, {}, "Error: 'args' must be an object."
+        return name, args, None
+
+    def run_parallel(self, calls: List[Dict[str, Any]]) -> str:
+        """Runs several INDEPENDENT tool calls at once and returns all results together.
+
+        Use this instead of one step per call when you need several lookups that do not
+        depend on each other's results (e.g. stock of several products, several MPN searches,
+        BOMs of several orders). Do not use it when a call needs the output of another one.
+
+        Args:
+            calls: The calls to run, e.g. [{"tool": "search_part_by_mpn", "args": {"mpns": ["X1"]}},
+                {"tool": "get_sales_orders", "args": {"time_quantity": "2", "time_unit": "weeks"}}].
+
+        Returns:
+            One section per call, in the given order, headed "### [<index>] <tool>".
+        """
+        if not isinstance(calls, list) or not calls:
+            return "Error: 'calls' must be a non-empty list of {\"tool\": ..., \"args\": {...}} objects."
+        if len(calls) > TOOL_RUNNER_MAX_BATCH:
+            return f"Error: at most {TOOL_RUNNER_MAX_BATCH} calls per batch; split the request."
+
+        validated = [self._validate(call) for call in calls]
+        started = time.perf_counter()
+        futures = {
+            index: self._executors[name].submit(contextvars.copy_context().run, self._call, name, args)
+            for index, (name, args, error) in enumerate(validated)
+            if error is None
+        }
+        sections = []
+        durations = 0.0
+        for index, (name, args, error) in enumerate(validated):
+            if error is None:
+                result, seconds = futures[index].result()
+                durations += seconds
+                if not isinstance(result, str):
+                    result = json.dumps(result, ensure_ascii=False, default=str)
+            else:
+                result = error
+                PARALLEL_TOOL_CALLS.inc(tool=str(name), outcome="invalid")
+            sections.append(f"### [{index}] {name}\n{result}")
+        wall = time.perf_counter() - started
+        PARALLEL_SECONDS_SAVED.inc(max(0.0, durations - wall))
+        print(f"--- [Tool Runner] {len(futures)} calls in {wall:.2f}s (sequential {durations:.2f}s) ---")
+        return "\n\n".join(sections)
+
+
+def expand_parallel_call(tool_args: Dict[str, Any], observation: Any) -> List[Tuple[str, Dict[str, Any], Any]]:
+    """Split a run_parallel step into (tool_name, tool_args, observation) per call."""
+    calls = tool_args.get("calls") or []
+    text = str(observation or "")
+    headers = list(_RESULT_HEADER.finditer(text))
+    expanded = []
+    for position, match in enumerate(headers):
+        index = int(match.group(1))
+        end = headers[position + 1].start() if position + 1 < len(headers) else len(text)
+        call = calls[index] if index < len(calls) and isinstance(calls[index], dict) else {}
+        args = call.get("args") or call.get("tool_args") or {}
+        expanded.append((match.group(2), args if isinstance(args, dict) else {}, text[match.end() + 1 : end].rstrip()))
+    return expanded
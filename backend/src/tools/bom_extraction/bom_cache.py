@@ -2,16 +2,42 @@ from __future__ import annotations
 
 import os
 import pickle
-import tempfile
+import sqlite3
+import threading
+import time
+from functools import lru_cache
 from typing import Optional
 from filelock import FileLock
 import cv2
 import hashlib
 
+from backend.src.tools.bom_extraction.hashing import file_digest
+from backend.src.tools.bom_extraction.phash import BKTree, dhash
+
 
 class BOMCache:
     """
-    Minimal pickled dict cache for BOMs. Stores only the full (pre-enrichment) BOM as a dict.
+    Per-entry BOM cache backed by SQLite. Stores only the full (pre-enrichment) BOM.
+
+    Every entry is its own row keyed by prefix+image hash, so reads and writes no
+    longer load or rewrite the whole cache. WAL mode makes concurrent access from
+    several threads/workers safe. When the stored bytes exceed `max_bytes` the
+    least recently used entries are evicted.
+
+    Keys are two-level: entries are stored under the normalized pixel hash, and
+    an alias table maps the raw-bytes digest of the source file (PDF or image as
+    uploaded) to that entry. Callers check the alias first via
+    `get_full_bom_by_source` and only normalize the image on a miss. Uploaded
+    images (`rotate_portrait=True`) are hashed turned landscape, the orientation
+    they were stored in when uploads were still rotated in place, so those
+    entries keep matching.
+
+    With `phash_enabled`, a perceptual hash of every stored image is indexed so
+    `find_similar_bom` can return the BOM of a near-duplicate drawing (re-scan,
+    re-export) within `phash_max_distance` bits.
+
+    A legacy pickled-dict cache (`bom_cache.pkl`) found next to the database (or
+    at `legacy_path`) is imported once on startup.
 
     If initialized with enabled=False the cache acts as a no-op in order to keep
     caller code simple (no need to check config flags everywhere).
@@ -23,44 +49,94 @@ class BOMCache:
         lock_timeout: int = 10,
         enabled: bool = True,
         key_prefix: str = "",
+        max_bytes: int = 512 * 1024 * 1024,
+        legacy_path: Optional[str] = None,
+        phash_enabled: bool = False,
+        phash_max_distance: int = 6,
     ):
         self.enabled = bool(enabled)
-        self.path = os.path.expanduser(path or "~/.kakoai/bom_cache.pkl")
+        path = os.path.expanduser(path or "~/.kakoai/bom_cache.sqlite")
+        if path.endswith(".pkl"):
+            # Old configuration pointing at the pickled dict: migrate next to it.
+            legacy_path = legacy_path or path
+            path = path[: -len(".pkl")] + ".sqlite"
+        self.path = path
+        self.legacy_path = os.path.expanduser(
+            legacy_path or os.path.join(os.path.dirname(self.path), "bom_cache.pkl")
+        )
         self.key_prefix = key_prefix
-        self.lock = None
+        self.max_bytes = max_bytes
+        self.lock_timeout = lock_timeout
+        self._local = threading.local()
+        self.phash_enabled = phash_enabled
+        self.phash_max_distance = phash_max_distance
+        self._phash_tree = BKTree()
+        self._phash_rowid = 0
+        self._phash_lock = threading.Lock()
         if self.enabled:
             dirn = os.path.dirname(self.path)
             if dirn:
                 os.makedirs(dirn, exist_ok=True)
-            self.lock = FileLock(self.path + ".lock", timeout=lock_timeout)
+            self._init_schema()
+            if os.path.exists(self.legacy_path):
+                self.import_legacy_pickle(self.legacy_path)
 
-    def _load_unlocked(self) -> dict:
-        if not os.path.exists(self.path):
-            return {}
-        try:
-            with open(self.path, "rb") as f:
-                return pickle.load(f) or {}
-        except Exception:
-            return {}
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.lock_timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._conn()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (accessed_at)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+        )
+        conn.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('total_bytes', 0)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS aliases (source_key TEXT PRIMARY KEY, key TEXT NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS aliases_key ON aliases (key)")
+        conn.execute("CREATE TABLE IF NOT EXISTS phashes (key TEXT PRIMARY KEY, phash TEXT NOT NULL)")
 
-    def _load(self) -> dict:
+    def import_legacy_pickle(self, legacy_path: str) -> int:
+        """Import entries from an old pickled-dict cache and rename it to `*.migrated`."""
         if not self.enabled:
-            return {}
-        with self.lock:
-            return self._load_unlocked()
-
-    def _atomic_write(self, data: dict):
-        dirn = os.path.dirname(self.path) or "."
-        if dirn and dirn != ".":
-            os.makedirs(dirn, exist_ok=True)
-        fd, tmp = tempfile.mkstemp(dir=dirn)
-        os.close(fd)
-        with open(tmp, "wb") as f:
-            pickle.dump(data, f)
-        os.replace(tmp, self.path)
-
-    def _make_key(self, image_path: str) -> str:
-        image_hash = self.compute_image_hash(image_path)
+            return 0
+        imported = 0
+        with FileLock(legacy_path + ".lock", timeout=self.lock_timeout):
+            if not os.path.exists(legacy_path):
+                return 0
+            try:
+                with open(legacy_path, "rb") as f:
+                    data = pickle.load(f) or {}
+            except Exception as e:
+                print(f"Warning: Could not read legacy BOM cache {legacy_path}: {e}")
+                return 0
+            for key, value in data.items():
+                if self._get(key) is None:
+                    self._set(key, value)
+                    imported += 1
+            os.replace(legacy_path, legacy_path + ".migrated")
+        print(f"--- [BOM Cache] Imported {imported} entries from {legacy_path} ---")
+        return imported
+
+    def _make_key(self, image_path: str, rotate_portrait: bool = False) -> str:
+        image_hash = self.compute_image_hash(image_path, rotate_portrait)
         if self.key_prefix:
             return f"{self.key_prefix}:{image_hash}"
         return image_hash
@@ -68,51 +144,175 @@ class BOMCache:
     def _get(self, key: str):
         if not self.enabled:
             return None
-        d = self._load()
-        return d.get(key)
+        conn = self._conn()
+        row = conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        try:
+            return pickle.loads(row[0])
+        except Exception:
+            return None
 
     def _set(self, key: str, value):
         if not self.enabled:
             return
-        with self.lock:
-            d = self._load_unlocked()
-            d[key] = value
-            self._atomic_write(d)
+        raw = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            old = conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, raw, len(raw), time.time()),
+            )
+            delta = len(raw) - (old[0] if old else 0)
+            conn.execute(
+                "UPDATE meta SET value = value + ? WHERE name = 'total_bytes'", (delta,)
+            )
+            self._evict(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _evict(self, conn: sqlite3.Connection):
+        """Drop least recently used entries until the cache fits `max_bytes`."""
+        total = conn.execute("SELECT value FROM meta WHERE name = 'total_bytes'").fetchone()[0]
+        while total > self.max_bytes:
+            row = conn.execute(
+                "SELECT key, size FROM entries ORDER BY accessed_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                break
+            conn.execute("DELETE FROM entries WHERE key = ?", (row[0],))
+            conn.execute("DELETE FROM aliases WHERE key = ?", (row[0],))
+            conn.execute("DELETE FROM phashes WHERE key = ?", (row[0],))
+            total -= row[1]
+        conn.execute("UPDATE meta SET value = ? WHERE name = 'total_bytes'", (max(total, 0),))
+
+    def _prefixed(self, digest: str) -> str:
+        if self.key_prefix:
+            return f"{self.key_prefix}:{digest}"
+        return digest
+
+    def _set_alias(self, source_hash: str, key: str):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO aliases (source_key, key) VALUES (?, ?)",
+            (self._prefixed(source_hash), key),
+        )
 
-    def is_in_cache(self, image_path: str) -> bool:
+    def compute_source_hash(self, source_path: str) -> str:
+        """Cheap raw-bytes digest of the source file, used as the first-level key."""
+        return file_digest(source_path)
+
+    def get_full_bom_by_source(self, source_hash: str):
+        """Return the full BOM aliased to a source file digest, or None."""
+        if not self.enabled:
+            return None
+        row = self._conn().execute(
+            "SELECT key FROM aliases WHERE source_key = ?", (self._prefixed(source_hash),)
+        ).fetchone()
+        if row is None:
+            return None
+        return self._get(row[0])
+
+    def is_in_cache(self, image_path: str, rotate_portrait: bool = False) -> bool:
         """Return True if a full BOM for the normalized image is present in the cache."""
         if not self.enabled:
             return False
-        key = self._make_key(image_path)
-        return self._get(key) is not None
+        key = self._make_key(image_path, rotate_portrait)
+        row = self._conn().execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone()
+        return row is not None
 
-    def get_full_bom(self, image_path: str):
-        """Return the stored full (pre-enrichment) BOM dict for the image, or None."""
+    def get_full_bom(self, image_path: str, source_hash: Optional[str] = None, rotate_portrait: bool = False):
+        """Return the stored full (pre-enrichment) BOM dict for the image, or None.
+
+        On a hit, `source_hash` (if given) is aliased to the entry so the next
+        upload of the same file skips normalization.
+        """
         if not self.enabled:
             return None
-        key = self._make_key(image_path)
-        return self._get(key)
+        key = self._make_key(image_path, rotate_portrait)
+        value = self._get(key)
+        if value is not None and source_hash:
+            self._set_alias(source_hash, key)
+        return value
 
-    def set_full_bom(self, image_path: str, value):
+    def set_full_bom(
+        self, image_path: str, value, source_hash: Optional[str] = None, rotate_portrait: bool = False
+    ):
         """Store the full (pre-enrichment) BOM for the normalized image."""
         if not self.enabled:
             return
-        key = self._make_key(image_path)
+        key = self._make_key(image_path, rotate_portrait)
         self._set(key, value)
+        if source_hash:
+            self._set_alias(source_hash, key)
+        if self.phash_enabled:
+            phash = dhash(image_path, rotate_portrait=rotate_portrait)
+            if phash is not None:
+                self._conn().execute(
+                    "INSERT OR REPLACE INTO phashes (key, phash) VALUES (?, ?)",
+                    (key, format(phash, "016x")),
+                )
+
+    def _refresh_phash_index(self):
+        # Pick up hashes written since the last lookup (also by other workers).
+        prefix = f"{self.key_prefix}:%" if self.key_prefix else "%"
+        rows = self._conn().execute(
+            "SELECT rowid, key, phash FROM phashes WHERE rowid > ? AND key LIKE ? ORDER BY rowid",
+            (self._phash_rowid, prefix),
+        ).fetchall()
+        for rowid, key, phash in rows:
+            self._phash_tree.add(int(phash, 16), key)
+            self._phash_rowid = rowid
 
-    def compute_image_hash(self, image_path: str) -> str:
+    def find_similar_bom(self, image_path: str, max_distance: Optional[int] = None, rotate_portrait: bool = False):
+        """Return (bom, distance) for the closest near-duplicate drawing, or None.
+
+        The result is approximate: callers should flag it for user review.
+        """
+        if not (self.enabled and self.phash_enabled):
+            return None
+        phash = dhash(image_path, rotate_portrait=rotate_portrait)
+        if phash is None:
+            return None
+        limit = self.phash_max_distance if max_distance is None else max_distance
+        with self._phash_lock:
+            self._refresh_phash_index()
+            matches = self._phash_tree.search(phash, limit)
+        for distance, key in matches:
+            # Evicted entries stay in the in-memory tree; skip them.
+            value = self._get(key)
+            if value is not None:
+                return value, distance
+        return None
+
+    @staticmethod
+    def compute_image_hash(image_path: str, rotate_portrait: bool = False) -> str:
         """Compute a stable SHA256 hash for the normalized image.
 
-        Preference: re-encode the loaded image to PNG to avoid differences in metadata.
+        Preference: re-encode the loaded image to PNG to avoid differences in metadata
+        (turned landscape first if `rotate_portrait` and the image is portrait).
         Fallback: hash raw file bytes if OpenCV cannot read the image.
+        Memoized per file version, so lookup and store hash the image only once.
         """
-        try:
-            img = cv2.imread(image_path)
-            if img is not None:
-                _, buf = cv2.imencode(".png", img, [cv2.IMWRITE_PNG_COMPRESSION, 3])
-                return hashlib.sha256(buf.tobytes()).hexdigest()
-        except Exception:
-            pass
+        stat = os.stat(image_path)
+        return _image_hash(image_path, stat.st_mtime_ns, stat.st_size, rotate_portrait)
+
+
+@lru_cache(maxsize=1024)
+def _image_hash(image_path: str, mtime_ns: int, size: int, rotate_portrait: bool = False) -> str:
+    try:
+        img = cv2.imread(image_path)
+        if img is not None:
+            if rotate_portrait and img.shape[0] > img.shape[1]:
+                img = cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
+            _, buf = cv2.imencode(".png", img, [cv2.IMWRITE_PNG_COMPRESSION, 3])
+            return hashlib.sha256(buf.tobytes()).hexdigest()
+    except Exception:
+        pass
 
-        with open(image_path, "rb") as f:
-            return hashlib.sha256(f.read()).hexdigest()
+    with open(image_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
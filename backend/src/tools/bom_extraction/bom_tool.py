@@ -2,19 +2,42 @@ from __future__ import annotations
 
 import os
 import hashlib
-import cv2
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 import dspy
 
+from backend.src import cascade
 from backend.src.models import RawBillOfMaterials, BillOfMaterials, BOMItem
 from backend.src.tools.bom_extraction.file_utils import (
     fetch_file_via_ssh,
+    find_remote_drawings,
     convert_pdf_to_png,
+    get_pdf_geometry,
     get_pdf_orientation,
+    render_pdf_pages,
 )
+from backend.src.tools.bom_extraction.page_detection import select_parts_list_pages
+from backend.src.tools.bom_extraction.prefetch import DrawingPrefetcher
+from backend.src.tools.bom_extraction.preprocess import prepare_model_image
 from backend.src.tools.demand_analysis.bom import perform_bom_matching
+from backend.src.tools.demand_analysis.inventory import get_order_article_numbers
 from backend.src.auth_context import is_current_user_mock
+from backend.src.profiling import count, stage
 from backend.src.tools.bom_extraction.bom_cache import BOMCache
-from backend.src.config import BOM_CACHE_ENABLED, BOM_CACHE_PATH
+from backend.src.config import (
+    BOM_CACHE_ENABLED,
+    BOM_CACHE_PATH,
+    BOM_CACHE_LEGACY_PATH,
+    BOM_CACHE_MAX_MB,
+    BOM_CACHE_PHASH_ENABLED,
+    BOM_CACHE_PHASH_MAX_DISTANCE,
+    BOM_PAGE_TABLE_MIN_CROSSINGS,
+    BOM_EXTRACTION_MAX_CONCURRENCY,
+    BOM_EXTRACTION_MAX_PAGES,
+    BOM_IMAGE_CROP_ENABLED,
+    BOM_IMAGE_TOKEN_BUDGET,
+    BOM_IMAGE_MIN_SCALE,
+)
 
 
 class BOMExtractionSignature(dspy.Signature):
@@ -52,6 +75,10 @@ CACHE = BOMCache(
     path=BOM_CACHE_PATH,
     enabled=BOM_CACHE_ENABLED,
     key_prefix=_bom_cache_prefix(),
+    max_bytes=int(BOM_CACHE_MAX_MB * 1024 * 1024),
+    legacy_path=BOM_CACHE_LEGACY_PATH,
+    phash_enabled=BOM_CACHE_PHASH_ENABLED,
+    phash_max_distance=BOM_CACHE_PHASH_MAX_DISTANCE,
 )
 
 
@@ -69,79 +96,288 @@ def _resolve_local_path(file_path: str) -> tuple[str, str, bool]:
     if is_current_user_mock():
         raise PermissionError(f"I cannot search the server for '{os.path.basename(file_path)}' in Mock Mode. Please upload the file manually.")
 
-    # 2. Fallback to SSH fetch if it's a remote file reference
+    # 2. Fallback to SSH fetch if it's a remote file reference.
+    # A background prefetch of this drawing may be running; let it finish instead of downloading twice.
+    DrawingPrefetcher().wait(file_path)
     return fetch_file_via_ssh(file_path)
 
 
-def _prepare_image_for_model(local_path: str) -> str:
-    """Ensure the model gets an image. If PDF, convert first page to PNG."""
+def list_drawing_candidates(query: str, limit: int = 5) -> str:
+    """List remote drawing files that best match a (partial or misspelled) name.
+
+    Use this when the user is unsure of the exact drawing name, or to present
+    several candidates at once; then call `perform_bom_extraction` with the
+    exact filename the user picks.
+
+    Args:
+        query: Drawing name, number or fragment to search for.
+        limit: Maximum number of candidates to return (default 5, max 20).
+    """
+    if is_current_user_mock():
+        return "I cannot search the server for drawings in Mock Mode. Please upload the file manually."
+    try:
+        matches = find_remote_drawings(query, limit=max(1, min(int(limit), 20)))
+    except Exception as exc:
+        return f"Error searching drawings: {exc}"
+    if not matches:
+        return f"No drawings found similar to '{query}'."
+    lines = [f"{i}. {name} (match {score:.0f}%)" for i, (name, score) in enumerate(matches, 1)]
+    return f"Drawings matching '{query}':\n" + "\n".join(lines)
+
+
+def prefetch_drawings(
+    drawing_names: list[str] | None = None, order_numbers: list[str] | None = None
+) -> str:
+    """Start downloading and preparing remote drawings in the background.
+
+    Call this as soon as the user names several drawings or sales orders, before
+    extracting them one by one with `perform_bom_extraction`; the extractions
+    then start from warm local caches. Returns immediately.
+
+    Args:
+        drawing_names: Drawing filenames from the remote archive.
+        order_numbers: Sales order numbers (Belegnummer); the drawings named
+            after their article numbers are prefetched.
+    """
+    if is_current_user_mock():
+        return "I cannot fetch drawings from the server in Mock Mode. Please upload the files manually."
+
+    queries = list(drawing_names or [])
+    for order_number in order_numbers or []:
+        queries.extend(get_order_article_numbers(order_number))
+    if not queries:
+        return "No drawings to prefetch."
+    try:
+        status = DrawingPrefetcher().submit(queries)
+    except Exception as exc:
+        return f"Error starting prefetch: {exc}"
+
+    queued = sorted({name for name in status.values() if name != "not found"})
+    missing = [query for query, name in status.items() if name == "not found"]
+    result = f"Prefetching {len(queued)} drawing(s) in the background: {', '.join(queued) or '-'}"
+    if missing:
+        result += f"\nNot found: {', '.join(missing)}"
+    return result
+
+
+def _prepare_image_for_model(local_path: str, source_hash: str | None = None) -> str:
+    """Ensure the model gets an image. If PDF, convert first page to PNG.
+
+    This is the image the cache is keyed on; cropping/rotation for the model
+    happens later in `_extract_full_bom` and never touches this file.
+    """
     if local_path.lower().endswith(".pdf"):
         # We create a separate png file for the model, but keep the original PDF for the UI
-        return convert_pdf_to_png(local_path)
-
-    # Normalize orientation if it's already an image
-    img_check = cv2.imread(local_path)
-    if img_check is not None:
-        h, w = img_check.shape[:2]
-        if h > w:
-            cv2.imwrite(
-                local_path, cv2.rotate(img_check, cv2.ROTATE_90_COUNTERCLOCKWISE)
-            )
+        with stage("raster"):
+            return convert_pdf_to_png(local_path, content_hash=source_hash)
     return local_path
 
 
-def perform_bom_extraction(file_path: str) -> str | tuple[BillOfMaterials, str]:
-    """Extract a BOM from a local path or a remote filename."""
+def _bom_failure(prediction: dspy.Prediction) -> str | None:
+    return None if prediction.bom.items else "empty_result"
+
+
+def _extract_full_bom(
+    model_image_path: str, orientation: str, rotate_portrait: bool = False
+) -> BillOfMaterials:
+    """Run the LLM extraction on one image and convert it to a full BOM.
+
+    The image is cropped to its table region and downscaled to the vision-token
+    budget first (see `preprocess.prepare_model_image`).
+    """
+    with stage("preprocess"):
+        llm_image_path, transform = prepare_model_image(
+            model_image_path,
+            token_budget=BOM_IMAGE_TOKEN_BUDGET,
+            min_scale=BOM_IMAGE_MIN_SCALE,
+            rotate_portrait=rotate_portrait,
+            crop_enabled=BOM_IMAGE_CROP_ENABLED,
+        )
+    print(f"--- [BOM Extraction] Model image transform: {transform} ---")
+
+    count("llm_calls")
+    with stage("llm"):
+        dspy_image = dspy.Image(url=llm_image_path)
+        extractor = dspy.Predict(BOMExtractionSignature)
+        # "auto" model: parse errors and empty tables escalate to a stronger model
+        prediction = cascade.run("extraction", lambda: extractor(drawing=dspy_image), _bom_failure)
+
+    raw_bom = prediction.bom
+    full_items = []
+    for raw_item in raw_bom.items:
+        # Create a BOMItem using the data extracted by the AI
+        full_item = BOMItem(**raw_item.dict())
+        full_items.append(full_item)
+
+    return BillOfMaterials(
+        items=full_items,
+        title=raw_bom.title,
+        orientation=orientation,
+    )
+
+
+def _extract_page(
+    display_path: str, page: int, page_image: str, source_hash: str | None
+) -> BillOfMaterials:
+    """Extract one PDF page, using its own cache entry so unchanged sheets are reused."""
+    page_source = f"{source_hash}#p{page}" if source_hash else None
+    with stage("cache_lookup"):
+        full_bom = CACHE.get_full_bom_by_source(page_source) if page_source else None
+        if full_bom is None:
+            full_bom = CACHE.get_full_bom(page_image, source_hash=page_source)
+    if full_bom is not None:
+        count("cache_hit")
+    else:
+        count("cache_miss")
+        print(f"--- [BOM Extraction] Extracting page {page} ---")
+        full_bom = _extract_full_bom(page_image, get_pdf_orientation(display_path, page))
+        with stage("cache_write"):
+            CACHE.set_full_bom(page_image, full_bom, source_hash=page_source)
+    return full_bom
+
+
+def _extract_multi_page(display_path: str, source_hash: str | None) -> BillOfMaterials:
+    """Extract every parts-list sheet of a PDF and merge them into one BOM.
+
+    Pages are rendered in a process pool, filtered with a table-line heuristic,
+    and extracted concurrently (bounded by BOM_EXTRACTION_MAX_CONCURRENCY).
+    """
+    page_count = min(get_pdf_geometry(display_path)["page_count"], BOM_EXTRACTION_MAX_PAGES)
+    with stage("raster"):
+        page_images = render_pdf_pages(
+            display_path, list(range(1, page_count + 1)), content_hash=source_hash
+        )
+    if not page_images:
+        raise RuntimeError("PDF pages could not be rendered.")
+    with stage("page_detection"):
+        pages = select_parts_list_pages(page_images, BOM_PAGE_TABLE_MIN_CROSSINGS)
+    print(f"--- [BOM Extraction] Extracting pages {pages} of {page_count} ---")
+
+    max_workers = max(1, min(len(pages), BOM_EXTRACTION_MAX_CONCURRENCY))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Each task runs in a copy of the caller's context so the request's
+        # dspy.context(lm=...) and auth context apply inside the worker thread.
+        futures = [
+            executor.submit(
+                contextvars.copy_context().run,
+                _extract_page, display_path, page, page_images[page], source_hash,
+            )
+            for page in pages
+        ]
+        page_boms = [future.result() for future in futures]
+
+    items = [item for bom in page_boms for item in bom.items]
+    title = next((bom.title for bom in page_boms if bom.title), None)
+    return BillOfMaterials(items=items, title=title, orientation=page_boms[0].orientation)
+
+
+def perform_bom_extraction(
+    file_path: str, multi_page: bool = False
+) -> str | tuple[BillOfMaterials, str]:
+    """Extract a BOM from a local path or a remote filename.
+
+    Args:
+        file_path: Uploaded file path or remote drawing filename.
+        multi_page: For multi-sheet PDFs, extract every sheet that contains a
+            parts list and merge them (default: first page only).
+    """
     try:
         # 1. Get the actual file (PDF or Image) - works for both local uploads and remote lookups
-        display_path, resolved_filename, is_exact_match = _resolve_local_path(file_path)
+        with stage("resolve"):
+            display_path, resolved_filename, is_exact_match = _resolve_local_path(file_path)
         if not is_exact_match:
-            return f"Did not find drawing '{file_path}'. Did you mean '{resolved_filename}'?"
+            others = [
+                name for name, _ in find_remote_drawings(file_path, limit=3) if name != resolved_filename
+            ]
+            suggestion = f"Did not find drawing '{file_path}'. Did you mean '{resolved_filename}'?"
+            if others:
+                suggestion += " Other candidates: " + ", ".join(f"'{name}'" for name in others)
+            return suggestion
+
+        # Cheap raw-bytes lookup first: a repeat upload skips rasterization entirely
+        with stage("hashing"):
+            source_hash = CACHE.compute_source_hash(display_path) if CACHE.enabled else None
+        is_multi_page = (
+            multi_page
+            and display_path.lower().endswith(".pdf")
+            and get_pdf_geometry(display_path)["page_count"] > 1
+        )
+        full_bom = None
+        if is_multi_page:
+            full_bom = _extract_multi_page(display_path, source_hash)
+        elif source_hash:
+            with stage("cache_lookup"):
+                full_bom = CACHE.get_full_bom_by_source(source_hash)
+            if full_bom is not None:
+                count("cache_hit")
+                print("--- [BOM Cache] Hit on source file digest ---")
+
+        # Uploaded images are turned landscape (for the model and the cache key), PDF pages are not
+        is_image_upload = not display_path.lower().endswith(".pdf")
 
         # 2. Get an image version for the AI model
-        model_image_path = _prepare_image_for_model(display_path)
+        if full_bom is None:
+            model_image_path = _prepare_image_for_model(display_path, source_hash)
 
-        # Check if we already ran extraction for this image, if so skip it
-        full_bom = CACHE.get_full_bom(model_image_path)
+            # Check if we already ran extraction for this image, if so skip it
+            with stage("cache_lookup"):
+                full_bom = CACHE.get_full_bom(
+                    model_image_path, source_hash=source_hash, rotate_portrait=is_image_upload
+                )
+            if full_bom is not None:
+                count("cache_hit")
+
+        # Near-duplicate drawing (re-scan/re-export): reuse its BOM, flagged as approximate
+        approximate_distance = None
+        if full_bom is None:
+            with stage("cache_lookup"):
+                similar = CACHE.find_similar_bom(model_image_path, rotate_portrait=is_image_upload)
+            if similar is not None:
+                full_bom, approximate_distance = similar
+                count("cache_hit_approximate")
+                print(f"--- [BOM Cache] Near-duplicate hit (distance {approximate_distance}) ---")
         if full_bom is None:
+            count("cache_miss")
             # 3. Perform the actual extraction
-            dspy_image = dspy.Image(url=model_image_path)
-            extractor = dspy.Predict(BOMExtractionSignature)
-            prediction = extractor(drawing=dspy_image)
-
-            # Return the BOM AND the path to the ORIGINAL file for display (PDF or Image)
-            raw_bom = prediction.bom
-            full_items = []
-            for raw_item in raw_bom.items:
-                # Create a BOMItem using the data extracted by the AI
-                full_item = BOMItem(**raw_item.dict())
-                full_items.append(full_item)
-
-            full_bom = BillOfMaterials(
-                items=full_items, 
-                title=raw_bom.title,
-                orientation=get_pdf_orientation(display_path)
+            full_bom = _extract_full_bom(
+                model_image_path,
+                get_pdf_orientation(display_path),
+                rotate_portrait=is_image_upload,
             )
 
             # Persist the full (pre-enrichment) BOM so future runs can skip the LLM
-            CACHE.set_full_bom(model_image_path, full_bom)
+            with stage("cache_write"):
+                CACHE.set_full_bom(
+                    model_image_path, full_bom, source_hash=source_hash, rotate_portrait=is_image_upload
+                )
 
         # 4. Enrich Data (Database Step)
-        enriched_bom = perform_bom_matching(full_bom)
+        with stage("matching"):
+            enriched_bom = perform_bom_matching(full_bom)
         
         # 5. Save to BOM Store (Context)
         import uuid
         from backend.src.store import BOMStore
         
         bom_id = f"BOM_{uuid.uuid4().hex[:8].upper()}"
-        store = BOMStore()
-        store.save_bom(bom_id, enriched_bom, source_document=resolved_filename)
+        with stage("store"):
+            store = BOMStore()
+            store.save_bom(bom_id, enriched_bom, source_document=resolved_filename)
 
         title = enriched_bom.title or 'Untitled'
+        if approximate_distance is None:
+            user_view = f"USER_VIEW: BOM '{title}' extracted successfully.\n"
+            approximate_note = ""
+        else:
+            user_view = (
+                f"USER_VIEW: BOM '{title}' reused from a near-identical cached drawing "
+                f"(approximate match, {approximate_distance}/64 bits differ). Please verify it.\n"
+            )
+            approximate_note = ", Approximate: true"
         summary = (
-            f"USER_VIEW: BOM '{title}' extracted successfully.\n"
-            f"AGENT_DATA: Reference ID: {bom_id}, Source: {resolved_filename}, "
-            f"Title: {title}, Content: {str(enriched_bom)}"
+            user_view
+            + f"AGENT_DATA: Reference ID: {bom_id}, Source: {resolved_filename}, "
+            f"Title: {title}{approximate_note}, Content: {str(enriched_bom)}"
         )
         print(f"--- [BOM Extraction] Saved as {bom_id} ---")
 
@@ -1,117 +1,221 @@
 import os
-import paramiko
-import tempfile
-from scp import SCPClient
-from thefuzz import process
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pdf2image import convert_from_path
-from dotenv import load_dotenv
 
-load_dotenv()
+from backend.src import tracing
+from backend.src.config import (
+    PDF_RASTER_CACHE_DIR,
+    PDF_RASTER_CACHE_MAX_FILES,
+    PDF_RASTER_WORKERS,
+)
+from backend.src.tools.bom_extraction.filename_index import FilenameIndex
+from backend.src.tools.bom_extraction.hashing import file_digest
+from backend.src.tools.bom_extraction.remote_files import (
+    REMOTE_DIR,
+    RemoteArchive,
+    is_configured,
+)
 
-SSH_HOST = os.getenv("SSH_HOST")
-SSH_PORT = int(os.getenv("SSH_PORT"))
-SSH_USER = os.getenv("SSH_USER")
-SSH_PASS = os.getenv("SSH_PASS")
-REMOTE_DIR = os.getenv("REMOTE_DIR")
+_index_lock = threading.Lock()
+_index_state: dict = {"version": None, "index": None}
 
-def fetch_file_via_ssh(filename: str) -> tuple[str, str, bool]:
-    """Fetch a file from a remote SSH host into a local temp file.
 
-    Returns:
-        (local_path, remote_filename, is_exact_match)
-    """
-    if not SSH_HOST or not SSH_USER or not REMOTE_DIR:
+def _remote_filename_index() -> FilenameIndex:
+    """Filename index over the cached remote listing, rebuilt when the listing changes."""
+    archive = RemoteArchive()
+    remote_files = archive.listing()
+    with _index_lock:
+        if _index_state["version"] != archive.version or _index_state["index"] is None:
+            _index_state["index"] = FilenameIndex(f.name for f in remote_files)
+            _index_state["version"] = archive.version
+        return _index_state["index"]
+
+
+def find_remote_drawings(query: str, limit: int = 5, score_cutoff: float = 60) -> list[tuple[str, float]]:
+    """Return up to `limit` (filename, score) matches from the remote drawing archive."""
+    if not is_configured():
         raise RuntimeError(
             "SSH-based file lookup is not configured "
             "(SSH_HOST, SSH_USER or REMOTE_DIR are missing)."
         )
+    index = _remote_filename_index()
+    if not len(index):
+        raise FileNotFoundError(f"Remote directory '{REMOTE_DIR}' empty/unreadable.")
+    return index.search(query, limit=limit, score_cutoff=score_cutoff)
+
+
+def fetch_file_via_ssh(filename: str) -> tuple[str | None, str, bool]:
+    """Fetch a file from the remote drawing archive into the local file cache.
 
+    The remote listing and SSH connections are cached (see remote_files), and
+    unchanged files are served from the local copy without a download. Only
+    exact matches are downloaded; for a fuzzy match the local path is None.
+
+    Returns:
+        (local_path, remote_filename, is_exact_match)
+    """
     print(f"--- 🔍 Fuzzy Search: Looking for '{filename}' in {REMOTE_DIR}... ---")
-    
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    
+
+    matches = find_remote_drawings(filename, limit=1)
+    if not matches:
+        raise FileNotFoundError(f"No file found similar to '{filename}'")
+    best_filename, score = matches[0]
+    print(f"--> Match Found: '{best_filename}' (Confidence: {score}%)")
+
+    is_exact = filename == best_filename
+    if not is_exact:
+        return None, best_filename, False
+
+    archive = RemoteArchive()
+    return archive.download(archive.get(best_filename)), best_filename, True
+
+
+def _raster_cache_path(content_hash: str, page: int, dpi: int) -> str:
+    safe_hash = content_hash.replace(":", "_")
+    return os.path.join(PDF_RASTER_CACHE_DIR, f"{safe_hash}_p{page}_{dpi}dpi.png")
+
+
+def _prune_raster_cache():
+    """Keep at most PDF_RASTER_CACHE_MAX_FILES rendered pages (oldest access first)."""
     try:
-        ssh.connect(SSH_HOST, port=SSH_PORT, username=SSH_USER, password=SSH_PASS)
-        stdin, stdout, stderr = ssh.exec_command(f"ls -1 '{REMOTE_DIR}'")
-        remote_files = [line.strip() for line in stdout.readlines()]
-        
-        if not remote_files:
-            raise FileNotFoundError(f"Remote directory '{REMOTE_DIR}' empty/unreadable.")
-
-        match_result = process.extractOne(filename, remote_files, score_cutoff=60)
-        if match_result:
-            best_filename, score = match_result
-            print(f"--> Match Found: '{best_filename}' (Confidence: {score}%)")
-        else:
-            raise FileNotFoundError(f"No file found similar to '{filename}'")
-
-        remote_path = f"{REMOTE_DIR}/{best_filename}"
-        ext = os.path.splitext(best_filename)[1]
-        temp_fd, local_path = tempfile.mkstemp(suffix=ext)
-        os.close(temp_fd)
-        
-        with SCPClient(ssh.get_transport()) as scp:
-            print(f"Downloading: {remote_path}")
-            scp.get(remote_path, local_path)
-        
-        is_exact = (filename.lower() == best_filename.lower()) or (filename.lower() in best_filename.lower() and score == 100) # Strict exactness usually implies score 100
-        
-        is_exact = filename == best_filename
-        
-        return local_path, best_filename, is_exact
-        
-    finally:
-        ssh.close()
-
-def convert_pdf_to_png(local_path: str) -> str:
-    """Converts a PDF to PNG if necessary. Returns the path to the image."""
+        entries = [
+            os.path.join(PDF_RASTER_CACHE_DIR, name)
+            for name in os.listdir(PDF_RASTER_CACHE_DIR)
+            if name.endswith(".png")
+        ]
+        if len(entries) <= PDF_RASTER_CACHE_MAX_FILES:
+            return
+        entries.sort(key=lambda path: os.stat(path).st_atime)
+        for path in entries[: len(entries) - PDF_RASTER_CACHE_MAX_FILES]:
+            os.remove(path)
+    except OSError as e:
+        print(f"Warning: Could not prune raster cache: {e}")
+
+
+def convert_pdf_to_png(
+    local_path: str, page: int = 1, dpi: int = 150, content_hash: str | None = None
+) -> str:
+    """Converts a PDF to PNG if necessary. Returns the path to the image.
+
+    Only `page` (1-based) is rendered. The PNG is cached by PDF content hash, so
+    repeat uploads of the same PDF skip rasterization.
+
+    Args:
+        local_path: Path to the PDF (other files are returned unchanged).
+        page: 1-based page number to render.
+        dpi: Render resolution.
+        content_hash: Precomputed `file_digest` of the PDF, if the caller has one.
+    """
     if local_path.lower().endswith(".pdf"):
-        print("--- 📄 Converting PDF (150 DPI)... ---")
         try:
-            images = convert_from_path(local_path, dpi=150)
+            if PDF_RASTER_CACHE_DIR:
+                content_hash = content_hash or file_digest(local_path)
+                png_path = _raster_cache_path(content_hash, page, dpi)
+                if os.path.exists(png_path):
+                    os.utime(png_path)
+                    print(f"--- 📄 Reusing rendered PDF page {page} ---")
+                    return png_path
+            else:
+                png_path = local_path[: -len(".pdf")] + (".png" if page == 1 else f"_p{page}.png")
+
+            print(f"--- 📄 Converting PDF page {page} ({dpi} DPI)... ---")
+            with tracing.span("pdf.render", page=page, dpi=dpi):
+                images = convert_from_path(local_path, dpi=dpi, first_page=page, last_page=page)
             if images:
-                png_path = local_path.replace(".pdf", ".png")
-                images[0].save(png_path, "PNG")
+                if PDF_RASTER_CACHE_DIR:
+                    os.makedirs(PDF_RASTER_CACHE_DIR, exist_ok=True)
+                    # Write then rename so concurrent readers never see a partial PNG
+                    tmp_path = f"{png_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                    images[0].save(tmp_path, "PNG")
+                    os.replace(tmp_path, png_path)
+                    _prune_raster_cache()
+                else:
+                    images[0].save(png_path, "PNG")
                 return png_path
         except Exception as e:
             print(f"Warning: PDF conversion failed: {e}")
     return local_path
 
 
-def get_pdf_orientation(local_path: str) -> str:
+def render_pdf_pages(
+    local_path: str,
+    pages: list[int],
+    dpi: int = 150,
+    content_hash: str | None = None,
+    max_workers: int = PDF_RASTER_WORKERS,
+) -> dict[int, str]:
+    """Render several PDF pages in a process pool.
+
+    Each page goes through `convert_pdf_to_png`, so already cached pages are
+    not rendered again.
+
+    Returns:
+        Mapping of 1-based page number to PNG path (pages that failed to render
+        are omitted).
     """
-    Detects if a PDF is landscape or portrait based on the first page.
+    content_hash = content_hash or file_digest(local_path)
+    if len(pages) <= 1 or max_workers <= 1:
+        rendered = {page: convert_pdf_to_png(local_path, page, dpi, content_hash) for page in pages}
+    else:
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(pages))) as executor:
+            futures = {
+                page: executor.submit(convert_pdf_to_png, local_path, page, dpi, content_hash)
+                for page in pages
+            }
+            rendered = {page: future.result() for page, future in futures.items()}
+    return {page: path for page, path in rendered.items() if path != local_path}
+
+
+@lru_cache(maxsize=256)
+def _read_pdf_geometry(local_path: str, mtime_ns: int, size: int) -> dict:
+    from pypdf import PdfReader
+
+    reader = PdfReader(local_path)
+    pages = []
+    for page in reader.pages:
+        # Physical dimensions (MediaBox), swapped for rotated pages
+        mbox = page.mediabox
+        width = float(mbox.width)
+        height = float(mbox.height)
+        rotation = int(page.get("/Rotate", 0)) % 360
+        if rotation in (90, 270):
+            width, height = height, width
+        pages.append({"width": width, "height": height, "rotation": rotation})
+    return {"page_count": len(pages), "pages": pages}
+
+
+def get_pdf_geometry(local_path: str) -> dict:
+    """Return page count and per-page size/rotation of a PDF.
+
+    The PDF is parsed once per file version (path, mtime, size); rasterization
+    and orientation detection share the result.
+
+    Returns:
+        {"page_count": int, "pages": [{"width", "height", "rotation"}, ...]}
+    """
+    stat = os.stat(local_path)
+    return _read_pdf_geometry(local_path, stat.st_mtime_ns, stat.st_size)
+
+
+def get_pdf_orientation(local_path: str, page: int = 1) -> str:
+    """
+    Detects if a PDF is landscape or portrait based on the given page (default: first).
     Returns "landscape" or "portrait".
     """
     if not local_path.lower().endswith(".pdf"):
         return "portrait" # Default
 
     try:
-        from pypdf import PdfReader
-        
-        reader = PdfReader(local_path)
-        if not reader.pages:
+        pages = get_pdf_geometry(local_path)["pages"]
+        if len(pages) < page:
             return "portrait"
-            
-        page = reader.pages[0]
-        
-        # 1. Get Physical Dimensions (MediaBox)
-        mbox = page.mediabox
-        width = float(mbox.width)
-        height = float(mbox.height)
-        
-        # 2. Check for Rotation
-        rotation = page.get("/Rotate", 0)
-        rotation = int(rotation) % 360
-        
-        if rotation in (90, 270):
-             width, height = height, width
-             
-        # 3. Decision
-        if width > height:
+
+        geometry = pages[page - 1]
+        if geometry["width"] > geometry["height"]:
             return "landscape"
-            
+
     except Exception as e:
         print(f"Warning: Orientation detection failed (pypdf): {e}")
     
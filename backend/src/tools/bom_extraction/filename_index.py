@@ -0,0 +1,79 @@
+"""Trigram-indexed fuzzy search over remote drawing filenames.
+
+Scoring every filename with a fuzzy ratio is O(n) per query. The index keeps
+normalized names and an inverted trigram index; a query only scores the
+names that share the most trigrams with it (via rapidfuzz), so top-k lookups
+stay in the millisecond range for archives with tens of thousands of files.
+"""
+from __future__ import annotations
+
+import re
+from collections import defaultdict
+from typing import Iterable, List, Tuple
+
+import numpy as np
+from rapidfuzz import fuzz, process
+
+# Number of trigram-ranked candidates passed to the fuzzy scorer per result
+CANDIDATES_PER_RESULT = 50
+MIN_CANDIDATES = 200
+
+
+def normalize(name: str) -> str:
+    """Lowercase and split on separators: 'DRW_1001-Rev2.PDF' -> 'drw 1001 rev2 pdf'."""
+    return " ".join(re.split(r"[^0-9a-z]+", name.lower())).strip()
+
+
+def trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class FilenameIndex:
+    """Immutable index over a list of filenames."""
+
+    def __init__(self, names: Iterable[str]) -> None:
+        self.names: List[str] = list(names)
+        self._normalized = [normalize(name) for name in self.names]
+        self._exact = {name: doc_id for doc_id, name in enumerate(self.names)}
+        postings = defaultdict(list)
+        for doc_id, text in enumerate(self._normalized):
+            for gram in trigrams(text):
+                postings[gram].append(doc_id)
+        self._postings = {gram: np.asarray(ids, dtype=np.int32) for gram, ids in postings.items()}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _candidates(self, query: str, limit: int) -> List[int]:
+        arrays = [self._postings[gram] for gram in trigrams(query) if gram in self._postings]
+        if not arrays:
+            return []
+        overlap = np.bincount(np.concatenate(arrays), minlength=len(self.names))
+        hits = np.flatnonzero(overlap)
+        if len(hits) > limit:
+            hits = hits[np.argpartition(overlap[hits], -limit)[-limit:]]
+        return hits.tolist()
+
+    def search(self, query: str, limit: int = 5, score_cutoff: float = 0) -> List[Tuple[str, float]]:
+        """Return up to `limit` (filename, score 0-100) pairs, best first."""
+        normalized_query = normalize(query)
+        if not normalized_query or not self.names:
+            return []
+        candidate_ids = self._candidates(
+            normalized_query, max(MIN_CANDIDATES, limit * CANDIDATES_PER_RESULT)
+        )
+        choices = {doc_id: self._normalized[doc_id] for doc_id in candidate_ids}
+        results = process.extract(
+            normalized_query, choices, scorer=fuzz.WRatio, limit=None, score_cutoff=score_cutoff
+        )
+        # WRatio caps partial matches at the same value, so many names tie;
+        # token_set_ratio breaks ties in favour of names containing every query token
+        results.sort(
+            key=lambda item: (item[1], fuzz.token_set_ratio(normalized_query, item[0])), reverse=True
+        )
+        ranked = [(self.names[doc_id], round(score, 1)) for _, score, doc_id in results[:limit]]
+        # An exact filename always wins over equally scored near-duplicates
+        if query in self._exact:
+            ranked = [(query, 100.0)] + [item for item in ranked if item[0] != query]
+        return ranked[:limit]
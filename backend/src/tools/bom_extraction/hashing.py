@@ -0,0 +1,49 @@
+"""Fast content digests for drawing files.
+
+Used as the first-level BOM cache key: hashing the raw bytes of an upload is
+far cheaper than decoding and re-encoding its pixels, so repeat uploads of the
+same file can be answered before any PDF rasterization or image normalization.
+xxhash is used when installed, otherwise BLAKE2b from the standard library.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+from functools import lru_cache
+
+try:
+    import xxhash
+except ImportError:  # optional dependency
+    xxhash = None
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _new_hasher():
+    if xxhash is not None:
+        return xxhash.xxh3_128()
+    return hashlib.blake2b(digest_size=16)
+
+
+def hash_algorithm() -> str:
+    """Name of the digest used by `file_digest` (part of the cache key)."""
+    return "xxh3_128" if xxhash is not None else "blake2b128"
+
+
+@lru_cache(maxsize=1024)
+def _digest(path: str, mtime_ns: int, size: int) -> str:
+    hasher = _new_hasher()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return f"{hash_algorithm()}:{hasher.hexdigest()}"
+
+
+def file_digest(path: str) -> str:
+    """Stream the file in chunks and return a hex digest of its raw bytes.
+
+    Digests are memoized per file version (path, mtime, size), so a file
+    hashed ahead of time (e.g. by the prefetcher) is not read again.
+    """
+    stat = os.stat(path)
+    return _digest(path, stat.st_mtime_ns, stat.st_size)
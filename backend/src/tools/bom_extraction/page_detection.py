@@ -0,0 +1,104 @@
+"""Cheap image heuristic to find drawing sheets that contain a parts list.
+
+Parts lists are ruled tables: many long horizontal rules crossed by several
+vertical rules. Both are isolated with morphological opening, and the number of
+crossings is used as a score. Plain sheets (views, sections) only show the
+frame and title block, which produce far fewer crossings than a table.
+"""
+from __future__ import annotations
+
+import cv2
+import numpy as np
+
+ANALYSIS_WIDTH = 1600
+
+
+def downscale_for_analysis(img):
+    """Shrink a grayscale image to ANALYSIS_WIDTH; returns (image, scale)."""
+    h, w = img.shape[:2]
+    if w <= ANALYSIS_WIDTH:
+        return img, 1.0
+    scale = ANALYSIS_WIDTH / w
+    return cv2.resize(img, (ANALYSIS_WIDTH, int(h * scale)), interpolation=cv2.INTER_AREA), scale
+
+
+def line_crossings(img):
+    """Return a binary mask of horizontal/vertical rule crossings in a grayscale image."""
+    h, w = img.shape[:2]
+    binary = cv2.adaptiveThreshold(
+        cv2.bitwise_not(img), 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, 15, -2
+    )
+    horizontal = cv2.morphologyEx(
+        binary, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (max(w // 40, 10), 1))
+    )
+    vertical = cv2.morphologyEx(
+        binary, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (1, max(h // 60, 10)))
+    )
+    return cv2.dilate(cv2.bitwise_and(horizontal, vertical), None, iterations=2)
+
+
+def table_score(image_path: str) -> int:
+    """Return the number of ruled-table line crossings found in the image."""
+    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return 0
+    img, _ = downscale_for_analysis(img)
+    count, _ = cv2.connectedComponents(line_crossings(img))
+    return max(count - 1, 0)
+
+
+def find_table_region(img, min_crossings: int = 4):
+    """Return the bounding box (x, y, w, h) of the ruled tables in a grayscale image.
+
+    Crossings are grouped into clusters; clusters with fewer than
+    `min_crossings` crossings (frame corners, stray lines) are ignored. The box
+    covers all remaining clusters so a parts list and its title block stay
+    together. Returns None if nothing table-like is found.
+    """
+    h, w = img.shape[:2]
+    crossings = line_crossings(img)
+    count, _, _, centroids = cv2.connectedComponentsWithStats(crossings)
+    if count <= 1:
+        return None
+
+    # Merge crossings that belong to the same table (gaps smaller than a few cells).
+    points = np.zeros_like(crossings)
+    for cx, cy in centroids[1:]:
+        points[int(cy), int(cx)] = 255
+    gap = max(w, h) // 25
+    merged = cv2.dilate(points, cv2.getStructuringElement(cv2.MORPH_RECT, (gap, gap)))
+    cluster_count, labels, cluster_stats, _ = cv2.connectedComponentsWithStats(merged)
+
+    boxes = []
+    for label in range(1, cluster_count):
+        members = sum(
+            1 for cx, cy in centroids[1:] if labels[int(cy), int(cx)] == label
+        )
+        if members >= min_crossings:
+            x, y, bw, bh = cluster_stats[label][:4]
+            boxes.append((x, y, x + bw, y + bh))
+    if not boxes:
+        return None
+    x0 = max(min(b[0] for b in boxes), 0)
+    y0 = max(min(b[1] for b in boxes), 0)
+    x1 = min(max(b[2] for b in boxes), w)
+    y1 = min(max(b[3] for b in boxes), h)
+    return int(x0), int(y0), int(x1 - x0), int(y1 - y0)
+
+
+def select_parts_list_pages(page_images: dict[int, str], min_crossings: int) -> list[int]:
+    """Return the pages that look like they contain a parts list.
+
+    Falls back to the single highest-scoring page so extraction always runs on
+    at least one page.
+
+    Args:
+        page_images: Mapping of 1-based page number to rendered image path.
+        min_crossings: Minimum `table_score` for a page to be selected.
+    """
+    scores = {page: table_score(path) for page, path in page_images.items()}
+    print(f"--- [BOM Extraction] Page table scores: {scores} ---")
+    selected = [page for page, score in sorted(scores.items()) if score >= min_crossings]
+    if not selected and scores:
+        selected = [max(scores, key=lambda page: (scores[page], -page))]
+    return selected
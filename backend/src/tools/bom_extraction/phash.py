@@ -0,0 +1,73 @@
+"""Perceptual hashing for near-duplicate drawing lookup.
+
+A 64-bit difference hash (dHash) of the downscaled grayscale image stays
+stable across re-scans, re-exports and small compression or DPI changes that
+break the exact pixel hash. Hashes are searched with a BK-tree under Hamming
+distance.
+"""
+from __future__ import annotations
+
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+
+
+def dhash(image_path: str, hash_size: int = 8, rotate_portrait: bool = False) -> Optional[int]:
+    """Return the 64-bit dHash of an image (turned landscape if `rotate_portrait`), or None if unreadable."""
+    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+    if rotate_portrait and img.shape[0] > img.shape[1]:
+        img = cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    small = cv2.resize(img, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """BK-tree over integer hashes; each node holds every key sharing its hash."""
+
+    def __init__(self) -> None:
+        self._root: Optional[Tuple[int, List[str], Dict[int, tuple]]] = None
+
+    def add(self, value: int, key: str) -> None:
+        if self._root is None:
+            self._root = (value, [key], {})
+            return
+        node = self._root
+        while True:
+            node_value, keys, children = node
+            distance = hamming(value, node_value)
+            if distance == 0:
+                if key not in keys:
+                    keys.append(key)
+                return
+            child = children.get(distance)
+            if child is None:
+                children[distance] = (value, [key], {})
+                return
+            node = child
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, str]]:
+        """Return (distance, key) pairs within `max_distance`, closest first."""
+        if self._root is None:
+            return []
+        results: List[Tuple[int, str]] = []
+        stack = [self._root]
+        while stack:
+            node_value, keys, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= max_distance:
+                results.extend((distance, key) for key in keys)
+            for edge, child in children.items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        results.sort()
+        return results
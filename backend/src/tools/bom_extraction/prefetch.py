@@ -0,0 +1,98 @@
+"""Background prefetch of remote drawings.
+
+Given drawing names (or sales orders, whose article numbers name drawings),
+`DrawingPrefetcher` resolves each name against the cached remote listing and,
+in a small worker pool, downloads the file over the SSH pool, renders its first
+page and computes its cache keys. A later `perform_bom_extraction` for the same
+drawing then starts from the local file, raster and hash caches, and waits for
+an in-flight prefetch instead of fetching the file a second time.
+"""
+from __future__ import annotations
+
+import contextvars
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from backend.src.config import (
+    BOM_PREFETCH_WORKERS,
+    BOM_PREFETCH_MAX_DRAWINGS,
+    BOM_PREFETCH_MIN_SCORE,
+)
+from backend.src.tools.bom_extraction.bom_cache import BOMCache
+from backend.src.tools.bom_extraction.file_utils import convert_pdf_to_png, find_remote_drawings
+from backend.src.tools.bom_extraction.hashing import file_digest
+from backend.src.tools.bom_extraction.remote_files import RemoteArchive, RemoteFile
+
+
+def _warm(remote: RemoteFile) -> str:
+    """Download one drawing and precompute everything the extraction keys on."""
+    local_path = RemoteArchive().download(remote)
+    source_hash = file_digest(local_path)
+    model_image = convert_pdf_to_png(local_path, content_hash=source_hash)
+    BOMCache.compute_image_hash(model_image, rotate_portrait=not local_path.lower().endswith(".pdf"))
+    print(f"--- [Prefetch] '{remote.name}' is ready ---")
+    return local_path
+
+
+class DrawingPrefetcher:
+    """Worker pool that warms local caches for remote drawings (singleton)."""
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(DrawingPrefetcher, cls).__new__(cls)
+            cls._instance._executor = ThreadPoolExecutor(
+                max_workers=max(BOM_PREFETCH_WORKERS, 1), thread_name_prefix="drawing-prefetch"
+            )
+            cls._instance._lock = threading.Lock()
+            cls._instance._jobs: Dict[str, Future] = {}
+        return cls._instance
+
+    def _resolve(self, query: str) -> Optional[RemoteFile]:
+        archive = RemoteArchive()
+        remote = archive.get(query)
+        if remote is None:
+            matches = find_remote_drawings(query, limit=1, score_cutoff=BOM_PREFETCH_MIN_SCORE)
+            remote = archive.get(matches[0][0]) if matches else None
+        return remote
+
+    def submit(self, queries: List[str]) -> Dict[str, str]:
+        """Queue drawings for prefetching and return immediately.
+
+        Args:
+            queries: Drawing names; near-exact names (score >= BOM_PREFETCH_MIN_SCORE)
+                resolve to the best match.
+
+        Returns:
+            Mapping of each query to the resolved filename, or to a note if it
+            was not found or skipped.
+        """
+        status: Dict[str, str] = {}
+        for query in list(dict.fromkeys(queries))[:BOM_PREFETCH_MAX_DRAWINGS]:
+            remote = self._resolve(query)
+            if remote is None:
+                status[query] = "not found"
+                continue
+            with self._lock:
+                job = self._jobs.get(remote.name)
+                # Failed jobs are retried; finished ones are re-queued so a changed file is fetched again
+                if job is None or job.done():
+                    self._jobs[remote.name] = self._executor.submit(
+                        contextvars.copy_context().run, _warm, remote
+                    )
+            status[query] = remote.name
+        return status
+
+    def wait(self, name: str, timeout: Optional[float] = None) -> Optional[str]:
+        """Wait for an in-flight prefetch of `name`; returns its local path, or None."""
+        with self._lock:
+            job = self._jobs.get(name)
+        if job is None:
+            return None
+        try:
+            return job.result(timeout=timeout)
+        except Exception as e:
+            print(f"Warning: Prefetch of '{name}' failed: {e}")
+            return None
@@ -0,0 +1,138 @@
+"""Shrink drawings to the parts-list region before they are sent to the model.
+
+The whole sheet is rarely needed: the BOM is a ruled table (usually next to the
+title block). The table region is detected from rule crossings, cropped with a
+margin and downscaled until the estimated vision-token cost fits the budget,
+without going below a minimum scale that keeps small table text legible. The
+original file is never modified; the model image is written to a separate
+working directory, which keeps at most `BOM_MODEL_IMAGE_MAX_FILES` images.
+"""
+from __future__ import annotations
+
+import hashlib
+import math
+import os
+import tempfile
+import threading
+
+import cv2
+
+from backend.src.config import BOM_MODEL_IMAGE_MAX_FILES
+from backend.src.tools.bom_extraction.page_detection import (
+    downscale_for_analysis,
+    find_table_region,
+)
+
+# Gemini bills large images per 768x768 tile at 258 tokens each
+TILE_SIZE = 768
+TOKENS_PER_TILE = 258
+CROP_MARGIN = 0.03
+# Crops covering more than this share of the sheet are not worth it
+MAX_CROP_AREA_RATIO = 0.8
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """Estimate Gemini vision tokens for an image of the given size."""
+    if width <= 384 and height <= 384:
+        return TOKENS_PER_TILE
+    return TOKENS_PER_TILE * math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+
+
+def _prune_model_images(output_dir: str) -> None:
+    """Keep at most BOM_MODEL_IMAGE_MAX_FILES model images (oldest access first)."""
+    try:
+        entries = [
+            os.path.join(output_dir, name)
+            for name in os.listdir(output_dir)
+            if name.endswith(".model.png")
+        ]
+        if len(entries) <= BOM_MODEL_IMAGE_MAX_FILES:
+            return
+        entries.sort(key=lambda path: os.stat(path).st_atime)
+        for path in entries[: len(entries) - BOM_MODEL_IMAGE_MAX_FILES]:
+            os.remove(path)
+    except OSError as e:
+        print(f"Warning: Could not prune model images: {e}")
+
+
+def prepare_model_image(
+    image_path: str,
+    token_budget: int,
+    min_scale: float,
+    rotate_portrait: bool = False,
+    crop_enabled: bool = True,
+    output_dir: str | None = None,
+) -> tuple[str, dict]:
+    """Write the image the model should see and describe how it was derived.
+
+    Args:
+        image_path: Normalized drawing image (rendered PDF page or upload).
+        token_budget: Target upper bound for estimated vision tokens.
+        min_scale: Never downscale below this factor of the original resolution.
+        rotate_portrait: Rotate portrait images to landscape first.
+        crop_enabled: Crop to the detected table region.
+        output_dir: Where to write the model image (default: system temp dir).
+
+    Returns:
+        (model_image_path, transform) where transform records rotation, crop box
+        (in rotated source pixels), scale and estimated tokens before/after.
+        If nothing needs to change, the input path is returned unchanged.
+    """
+    img = cv2.imread(image_path)
+    if img is None:
+        return image_path, {"applied": False}
+
+    h, w = img.shape[:2]
+    transform = {
+        "applied": False,
+        "source_size": [w, h],
+        "rotated": False,
+        "crop": None,
+        "scale": 1.0,
+        "tokens_before": estimate_image_tokens(w, h),
+    }
+
+    if rotate_portrait and h > w:
+        img = cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
+        h, w = img.shape[:2]
+        transform["rotated"] = True
+
+    if crop_enabled:
+        gray, analysis_scale = downscale_for_analysis(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))
+        region = find_table_region(gray)
+        if region is not None:
+            x, y, rw, rh = (int(round(v / analysis_scale)) for v in region)
+            margin = int(max(w, h) * CROP_MARGIN)
+            x0, y0 = max(x - margin, 0), max(y - margin, 0)
+            x1, y1 = min(x + rw + margin, w), min(y + rh + margin, h)
+            if (x1 - x0) * (y1 - y0) <= MAX_CROP_AREA_RATIO * w * h:
+                img = img[y0:y1, x0:x1]
+                h, w = img.shape[:2]
+                transform["crop"] = [x0, y0, x1 - x0, y1 - y0]
+
+    scale = 1.0
+    while estimate_image_tokens(int(w * scale), int(h * scale)) > token_budget and scale > min_scale:
+        scale = max(scale * 0.9, min_scale)
+    if scale < 1.0:
+        img = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+        h, w = img.shape[:2]
+        transform["scale"] = round(scale, 3)
+
+    transform["output_size"] = [w, h]
+    transform["tokens_after"] = estimate_image_tokens(w, h)
+    if not (transform["rotated"] or transform["crop"] or scale < 1.0):
+        return image_path, transform
+
+    transform["applied"] = True
+    output_dir = output_dir or os.path.join(tempfile.gettempdir(), "kakoai_model_images")
+    os.makedirs(output_dir, exist_ok=True)
+    # One file per input path, overwritten on re-extraction
+    path_tag = hashlib.sha1(os.path.abspath(image_path).encode("utf-8")).hexdigest()[:12]
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    model_path = os.path.join(output_dir, f"{stem}.{path_tag}.model.png")
+    # Write then rename so concurrent extractions never read a partial PNG
+    tmp_path = f"{model_path}.{os.getpid()}.{threading.get_ident()}.tmp.png"
+    cv2.imwrite(tmp_path, img)
+    os.replace(tmp_path, model_path)
+    _prune_model_images(output_dir)
+    return model_path, transform
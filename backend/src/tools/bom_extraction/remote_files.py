@@ -0,0 +1,212 @@
+"""Pooled SSH/SFTP access to the remote drawing archive.
+
+- `SSHPool` keeps a few authenticated connections open (with keepalives) and
+  hands them out per operation instead of connecting for every lookup.
+- `RemoteArchive.listing()` caches the `REMOTE_DIR` listing (name, size,
+  mtime). It is re-read after `REMOTE_LISTING_TTL_SECONDS`, or earlier when a
+  cheap directory stat (at most every `REMOTE_LISTING_CHECK_SECONDS`) shows
+  files were added or removed. In-place edits only show after the TTL, since
+  they do not change the directory mtime.
+- `RemoteArchive.download()` streams files over SFTP into a local content
+  cache keyed by remote path + mtime + size, so a drawing that has not changed
+  remotely is served from disk without touching the network.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, NamedTuple, Optional
+
+import paramiko
+from dotenv import load_dotenv
+
+from backend.src import tracing
+from backend.src.config import (
+    SSH_POOL_SIZE,
+    SSH_KEEPALIVE_SECONDS,
+    REMOTE_LISTING_TTL_SECONDS,
+    REMOTE_LISTING_CHECK_SECONDS,
+    REMOTE_FILE_CACHE_DIR,
+    REMOTE_FILE_CACHE_MAX_FILES,
+)
+
+load_dotenv()
+
+SSH_HOST = os.getenv("SSH_HOST")
+SSH_PORT = int(os.getenv("SSH_PORT", "22"))
+SSH_USER = os.getenv("SSH_USER")
+SSH_PASS = os.getenv("SSH_PASS")
+REMOTE_DIR = os.getenv("REMOTE_DIR")
+
+
+class RemoteFile(NamedTuple):
+    name: str
+    size: int
+    mtime: int
+
+
+def is_configured() -> bool:
+    return bool(SSH_HOST and SSH_USER and REMOTE_DIR)
+
+
+class SSHPool:
+    """Small pool of reusable, keepalive-enabled SSH connections (singleton)."""
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(SSHPool, cls).__new__(cls)
+            cls._instance._idle = queue.LifoQueue()
+            cls._instance._slots = threading.BoundedSemaphore(max(SSH_POOL_SIZE, 1))
+        return cls._instance
+
+    def _connect(self) -> paramiko.SSHClient:
+        print(f"--- [SSH Pool] Connecting to {SSH_HOST}:{SSH_PORT} ---")
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(SSH_HOST, port=SSH_PORT, username=SSH_USER, password=SSH_PASS)
+        client.get_transport().set_keepalive(SSH_KEEPALIVE_SECONDS)
+        return client
+
+    @staticmethod
+    def _is_alive(client: paramiko.SSHClient) -> bool:
+        transport = client.get_transport()
+        return transport is not None and transport.is_active()
+
+    @contextmanager
+    def sftp(self) -> Iterator[paramiko.SFTPClient]:
+        """Borrow a pooled connection and yield an SFTP session on it."""
+        with self._slots:
+            client = None
+            while client is None:
+                try:
+                    candidate = self._idle.get_nowait()
+                except queue.Empty:
+                    candidate = self._connect()
+                if self._is_alive(candidate):
+                    client = candidate
+                else:
+                    candidate.close()
+
+            healthy = True
+            sftp = client.open_sftp()
+            try:
+                yield sftp
+            except (paramiko.SSHException, EOFError, OSError):
+                healthy = self._is_alive(client)
+                raise
+            finally:
+                sftp.close()
+                if healthy:
+                    self._idle.put(client)
+                else:
+                    client.close()
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class RemoteArchive:
+    """Cached view of REMOTE_DIR plus a local content cache (singleton)."""
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(RemoteArchive, cls).__new__(cls)
+            cls._instance._lock = threading.Lock()
+            cls._instance._files = {}
+            cls._instance._dir_mtime = None
+            cls._instance._listed_at = 0.0
+            cls._instance._checked_at = 0.0
+            cls._instance._version = 0
+        return cls._instance
+
+    @property
+    def version(self) -> int:
+        """Incremented whenever the cached listing changes."""
+        return self._version
+
+    def listing(self, force_refresh: bool = False) -> List[RemoteFile]:
+        """Return the cached REMOTE_DIR listing, refreshing it if stale."""
+        with self._lock:
+            now = time.monotonic()
+            expired = force_refresh or not self._files or now - self._listed_at >= REMOTE_LISTING_TTL_SECONDS
+            if expired or now - self._checked_at >= REMOTE_LISTING_CHECK_SECONDS:
+                with tracing.span("ssh.listing", "client", **{"peer.service": "ssh"}), SSHPool().sftp() as sftp:
+                    dir_mtime = int(sftp.stat(REMOTE_DIR).st_mtime or 0)
+                    if expired or dir_mtime != self._dir_mtime:
+                        print(f"--- [Remote Archive] Listing {REMOTE_DIR} ---")
+                        files = {
+                            attr.filename: RemoteFile(
+                                attr.filename, int(attr.st_size or 0), int(attr.st_mtime or 0)
+                            )
+                            for attr in sftp.listdir_attr(REMOTE_DIR)
+                        }
+                        if files != self._files:
+                            self._files = files
+                            self._version += 1
+                        self._dir_mtime = dir_mtime
+                        self._listed_at = now
+                self._checked_at = now
+            return list(self._files.values())
+
+    def get(self, name: str) -> Optional[RemoteFile]:
+        with self._lock:
+            return self._files.get(name)
+
+    @staticmethod
+    def _local_path(remote: RemoteFile) -> str:
+        remote_path = f"{REMOTE_DIR}/{remote.name}"
+        digest = hashlib.sha1(remote_path.encode("utf-8")).hexdigest()[:16]
+        ext = os.path.splitext(remote.name)[1]
+        return os.path.join(REMOTE_FILE_CACHE_DIR, f"{digest}_{remote.mtime}_{remote.size}{ext}")
+
+    def cached_path(self, remote: RemoteFile) -> Optional[str]:
+        """Local copy of this remote version, if already downloaded."""
+        local_path = self._local_path(remote)
+        return local_path if os.path.exists(local_path) else None
+
+    def download(self, remote: RemoteFile) -> str:
+        """Return a local copy of the remote file, downloading it over SFTP if needed."""
+        local_path = self._local_path(remote)
+        if os.path.exists(local_path):
+            os.utime(local_path)
+            print(f"--- [Remote Archive] Local copy of '{remote.name}' is current ---")
+            return local_path
+
+        os.makedirs(REMOTE_FILE_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{local_path}.{os.getpid()}.{threading.get_ident()}.part"
+        print(f"Downloading: {REMOTE_DIR}/{remote.name}")
+        with tracing.span(
+            "ssh.download", "client", **{"peer.service": "ssh", "file.name": remote.name, "file.size": remote.size}
+        ), SSHPool().sftp() as sftp:
+            sftp.get(f"{REMOTE_DIR}/{remote.name}", tmp_path)
+        os.replace(tmp_path, local_path)
+        self._prune()
+        return local_path
+
+    @staticmethod
+    def _prune() -> None:
+        try:
+            entries = [
+                os.path.join(REMOTE_FILE_CACHE_DIR, name)
+                for name in os.listdir(REMOTE_FILE_CACHE_DIR)
+                if not name.endswith(".part")
+            ]
+            if len(entries) <= REMOTE_FILE_CACHE_MAX_FILES:
+                return
+            entries.sort(key=lambda path: os.stat(path).st_atime)
+            for path in entries[: len(entries) - REMOTE_FILE_CACHE_MAX_FILES]:
+                os.remove(path)
+        except OSError as e:
+            print(f"Warning: Could not prune remote file cache: {e}")
@@ -1,6 +1,5 @@
 from __future__ import annotations
 
-import requests
 from datetime import datetime, timedelta
 from typing import Any, Dict, List, Optional, Tuple, Union
 from dateutil.relativedelta import relativedelta
@@ -9,6 +8,7 @@ from backend.src.config import XENTRAL_BEARER_TOKEN, XENTRAL_BASE_URL, XENTRAL_T
 from backend.src.models import BillOfMaterials
 from backend.src.tools.demand_analysis.shared import ProductInfoStore
 from backend.src.auth_context import is_current_user_mock
+from backend.src.tracing import traced_request
 from backend.src.tools.demand_analysis import mock_data
 
 
@@ -79,7 +79,7 @@ def get_inventory_for_product(product_id: str) -> Optional[dict]:
     params_direct = {"include": "lagerbestand"}
     
     try:
-        resp = requests.get(url_direct, params=params_direct, headers=_build_headers(), timeout=XENTRAL_TIMEOUT_SECONDS)
+        resp = traced_request("xentral", "GET", url_direct, params=params_direct, headers=_build_headers(), timeout=XENTRAL_TIMEOUT_SECONDS)
         if resp.status_code == 200:
              data = resp.json()
              # Direct ID often returns the object directly or wrapped in data
@@ -104,7 +104,7 @@ def get_inventory_for_product(product_id: str) -> Optional[dict]:
     }
     
     try:
-        resp = requests.get(url_search, params=params_search, headers=_build_headers(), timeout=XENTRAL_TIMEOUT_SECONDS)
+        resp = traced_request("xentral", "GET", url_search, params=params_search, headers=_build_headers(), timeout=XENTRAL_TIMEOUT_SECONDS)
         resp.raise_for_status()
         data = resp.json()
         items = data.get("data", [])
@@ -138,7 +138,7 @@ def get_sales_orders(time_quantity: str, time_unit: str) -> Any:
         "items": 1000,
     }
     print(params)
-    resp = requests.get(url, params=params, headers=_build_headers(), timeout=XENTRAL_TIMEOUT_SECONDS)
+    resp = traced_request("xentral", "GET", url, params=params, headers=_build_headers(), timeout=XENTRAL_TIMEOUT_SECONDS)
     resp.raise_for_status()
     data = resp.json() if resp.content else {}
     if isinstance(data, dict) and "data" in data:
@@ -243,7 +243,7 @@ def get_orders_by_customer(customer_id: str, start_date: str = None, end_date: s
     }
     
     try:
-        resp = requests.get(url, params=params, headers=_build_headers(), timeout=XENTRAL_TIMEOUT_SECONDS)
+        resp = traced_request("xentral", "GET", url, params=params, headers=_build_headers(), timeout=XENTRAL_TIMEOUT_SECONDS)
         if resp.status_code == 404:
             return []
         resp.raise_for_status()
@@ -279,7 +279,7 @@ def get_boms_for_orders(order_numbers: List[str]) -> Dict[str, Any]:
         }
         
         try:
-            resp = requests.get(url, params=params, headers=_build_headers(), timeout=XENTRAL_TIMEOUT_SECONDS)
+            resp = traced_request("xentral", "GET", url, params=params, headers=_build_headers(), timeout=XENTRAL_TIMEOUT_SECONDS)
             if resp.status_code == 404:
                 results[order_nr] = {"error": "Order not found (404)"}
                 continue
@@ -318,12 +318,47 @@ def get_boms_for_orders(order_numbers: List[str]) -> Dict[str, Any]:
             
     return results
 
+def get_order_article_numbers(order_number: str) -> List[str]:
+    """
+    Return the article numbers (Nummer) of all positions of a sales order.
+
+    Used to find the drawings referenced by an order (drawings are named after
+    the article number).
+
+    Args:
+        order_number: Order number (Belegnummer, e.g., 'AT-2024-059561').
+    """
+    if is_current_user_mock() or not XENTRAL_BEARER_TOKEN or not XENTRAL_BASE_URL:
+        return []
+
+    print(f"--- [Inventory] Get Articles for Order: {order_number} ---")
+    url = f"{XENTRAL_BASE_URL}/api/v1/belege/auftraege"
+    params = {
+        "filter[0][property]": "belegnr",
+        "filter[0][expression]": "eq",
+        "filter[0][value]": order_number,
+        "include": "positionen",
+        "items": 1
+    }
+    try:
+        resp = traced_request("xentral", "GET", url, params=params, headers=_build_headers(), timeout=XENTRAL_TIMEOUT_SECONDS)
+        if resp.status_code == 404:
+            return []
+        resp.raise_for_status()
+        orders = resp.json().get("data", [])
+    except Exception as e:
+        print(f"Warning: Could not fetch order {order_number}: {e}")
+        return []
+    if not orders:
+        return []
+    return [str(pos["nummer"]) for pos in orders[0].get("positionen", []) if pos.get("nummer")]
+
 # --- Private Helpers (Internal) ----------------------------------------------
 
 def _fetch_bom_for_product(product_id: str) -> List[Dict[str, Any]]:
     url = f"{XENTRAL_BASE_URL}/api/v1/products/{product_id}/parts"
     try:
-        resp = requests.get(url, headers=_build_headers(), timeout=XENTRAL_TIMEOUT_SECONDS)
+        resp = traced_request("xentral", "GET", url, headers=_build_headers(), timeout=XENTRAL_TIMEOUT_SECONDS)
         resp.raise_for_status()
         if not resp.content:
             return []
@@ -448,7 +483,7 @@ def _get_id_from_api_by_number(number: str) -> str | None:
         "items": 1
     }
     try:
-        resp = requests.get(url, params=params, headers=_build_headers(), timeout=XENTRAL_TIMEOUT_SECONDS)
+        resp = traced_request("xentral", "GET", url, params=params, headers=_build_headers(), timeout=XENTRAL_TIMEOUT_SECONDS)
         if resp.status_code == 200:
             data = resp.json()
             rows = data.get("data", []) if isinstance(data, dict) else []
@@ -468,7 +503,7 @@ def _get_id_from_api_by_name(name: str) -> Tuple[str | None, str | None]:
         "items": 1
     }
     try:
-        resp = requests.get(url, params=params, headers=_build_headers(), timeout=XENTRAL_TIMEOUT_SECONDS)
+        resp = traced_request("xentral", "GET", url, params=params, headers=_build_headers(), timeout=XENTRAL_TIMEOUT_SECONDS)
         if resp.status_code == 200:
             data = resp.json()
             rows = data.get("data", []) if isinstance(data, dict) else []
@@ -495,7 +530,7 @@ def _create_product(name: str) -> Tuple[str | None, str | None]:
     }
 
     try:
-        resp = requests.post(url, json=payload, headers=_build_headers(), timeout=XENTRAL_TIMEOUT_SECONDS)
+        resp = traced_request("xentral", "POST", url, json=payload, headers=_build_headers(), timeout=XENTRAL_TIMEOUT_SECONDS)
         
         if resp.status_code == 201:
             location_url = resp.headers.get("Location", "")
@@ -509,7 +544,7 @@ def _create_product(name: str) -> Tuple[str | None, str | None]:
                 return None, None
 
             details_url = f"{XENTRAL_BASE_URL}/api/v1/products/{new_id}"
-            det_resp = requests.get(details_url, headers=_build_headers(), timeout=XENTRAL_TIMEOUT_SECONDS)
+            det_resp = traced_request("xentral", "GET", details_url, headers=_build_headers(), timeout=XENTRAL_TIMEOUT_SECONDS)
             
             new_number = "UNKNOWN"
             if det_resp.status_code == 200:
@@ -548,7 +583,7 @@ def _create_bom_part_v1(parent_id: str, child_part_id: int, quantity: float) ->
     }]
     
     try:
-        resp = requests.post(url, json=payload, headers=_build_headers(), timeout=XENTRAL_TIMEOUT_SECONDS)
+        resp = traced_request("xentral", "POST", url, json=payload, headers=_build_headers(), timeout=XENTRAL_TIMEOUT_SECONDS)
         
         if resp.status_code in [200, 201]:
             return True
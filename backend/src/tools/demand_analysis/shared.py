@@ -2,6 +2,7 @@
 from __future__ import annotations
 import psycopg2
 from backend.src.config import SUPABASE_DSN
+from backend.src.tracing import traced
 
 class ProductInfoStore:
     _instance = None
@@ -20,6 +21,7 @@ class ProductInfoStore:
             return ""
         return str(text).replace(" ", "").lower()
 
+    @traced("ProductInfoStore.search", kind="client", **{"db.system": "postgresql", "peer.service": "supabase"})
     def search(self, bom_number, bom_desc):
         num_raw = str(bom_number).strip()
         q_num = self._normalize(num_raw)
@@ -32,9 +32,13 @@ import os
 import random
 import hashlib
 import copy
+import threading
 from typing import Dict
 from datetime import datetime
 
+from backend.src.tracing import traced_request
+from .query_manager import project_to_query
+
 NEXAR_URL = "https://api.nexar.com/graphql"
 PROD_TOKEN_URL = "https://identity.nexar.com/connect/token"
 
@@ -47,8 +51,10 @@ def get_token(client_id, client_secret):
 
     token = {}
     try:
-        token = requests.post(
-            url=PROD_TOKEN_URL,
+        token = traced_request(
+            "nexar",
+            "POST",
+            PROD_TOKEN_URL,
             data={
                 "grant_type": "client_credentials",
                 "client_id": client_id,
@@ -82,6 +88,8 @@ class NexarClient:
             os.path.dirname(__file__), "persistent_cache.json"
         )
         self.persistent_cache = self._load_persistent_cache()
+        # Guards cache writes and token refresh when queries run from worker threads
+        self._lock = threading.Lock()
 
         if is_live:
             self.s = requests.session()
@@ -129,57 +137,65 @@ class NexarClient:
         serialized_vars = json.dumps(variables, sort_keys=True)
         return hashlib.sha256(serialized_vars.encode("utf-8")).hexdigest()
 
-    def get_query(self, query: str, variables: Dict) -> dict:
-        """Return Nexar response for the query."""
+    def _get_cached(self, query_hash: str, variables_hash: str):
+        """Return cached data for the query/variables pair, or None if missing or outdated."""
+        cached_entry = self.persistent_cache.get(query_hash, {}).get(variables_hash)
+        if cached_entry is None:
+            return None
+
+        if not self.is_live:
+            # Return data immediately, ignoring timestamp
+            return cached_entry["data"]
+
+        # Check if entry follows new format with timestamp
+        if "timestamp" in cached_entry and "data" in cached_entry:
+            try:
+                stored_time = datetime.fromisoformat(cached_entry["timestamp"])
+                age_minutes = (datetime.now() - stored_time).total_seconds() / 60
+                if age_minutes < self.cache_ttl_minutes:
+                    return cached_entry["data"]
+            except ValueError:
+                pass  # invalid date format, treat as outdated
+        return None
+
+    def get_query(self, query: str, variables: Dict, wider_queries=()) -> dict:
+        """Return Nexar response for the query.
+
+        `wider_queries` are queries whose field sets contain this one's. A cached
+        response of any of them is narrowed to this query's fields instead of
+        issuing a new request.
+        """
 
         query_hash = self._get_query_hash(query)
         variables_hash = self._get_variables_hash(variables)
+        candidates = [(query, query_hash)] + [
+            (wider, self._get_query_hash(wider)) for wider in wider_queries
+        ]
 
-        # 1. Check persistent cache first if enabled
+        # 1. Check persistent cache first if enabled (exact query, then wider ones)
         if self.enable_caching:
-            if query_hash in self.persistent_cache:
-                if variables_hash in self.persistent_cache[query_hash]:
-                    cached_entry = self.persistent_cache[query_hash][variables_hash]
-
-                    if self.is_live:
-                        is_outdated = True
-                        # Check if entry follows new format with timestamp
-                        if "timestamp" in cached_entry and "data" in cached_entry:
-                            try:
-                                stored_time = datetime.fromisoformat(
-                                    cached_entry["timestamp"]
-                                )
-                                age_minutes = (
-                                    datetime.now() - stored_time
-                                ).total_seconds() / 60
-                                if age_minutes < self.cache_ttl_minutes:
-                                    is_outdated = False
-                            except ValueError:
-                                pass  # invalid date format, treat as outdated
-
-                        # If not outdated, return cached data
-                        if not is_outdated:
-                            return cached_entry["data"]
-                        # If outdated, fall through to the API request below
-
-                    else:
-                        # Return data immediately, ignoring timestamp
-                        return cached_entry["data"]
+            for candidate_query, candidate_hash in candidates:
+                data = self._get_cached(candidate_hash, variables_hash)
+                if data is not None:
+                    if candidate_query is query:
+                        return data
+                    return project_to_query(data, query)
 
         # 2. If not in cache and not live, use mock fallback
         if not self.is_live:
-            # Try to find ANY entry for this query in persistent cache
-            if (
-                query_hash in self.persistent_cache
-                and self.persistent_cache[query_hash]
-            ):
+            # Try to find ANY entry for this query (or a wider one) in persistent cache
+            for candidate_query, candidate_hash in candidates:
+                if not self.persistent_cache.get(candidate_hash):
+                    continue
                 # Pick random entry
                 random_var_hash = random.choice(
-                    list(self.persistent_cache[query_hash].keys())
+                    list(self.persistent_cache[candidate_hash].keys())
                 )
                 cached_data = copy.deepcopy(
-                    self.persistent_cache[query_hash][random_var_hash]["data"]
+                    self.persistent_cache[candidate_hash][random_var_hash]["data"]
                 )
+                if candidate_query is not query:
+                    cached_data = project_to_query(cached_data, query)
 
                 # Swap MPNs to make it "realistic"
                 if "queries" in variables:
@@ -193,9 +209,13 @@ class NexarClient:
             return {"supMultiMatch": []}
 
         try:
-            self.check_exp()
-            r = self.s.post(
+            with self._lock:
+                self.check_exp()
+            r = traced_request(
+                "nexar",
+                "POST",
                 NEXAR_URL,
+                session=self.s,
                 json={"query": query, "variables": variables},
             )
 
@@ -212,13 +232,14 @@ class NexarClient:
         # 3. Save to persistent cache if enabled
         data = response["data"]
         if self.enable_caching:
-            if query_hash not in self.persistent_cache:
-                self.persistent_cache[query_hash] = {}
+            with self._lock:
+                if query_hash not in self.persistent_cache:
+                    self.persistent_cache[query_hash] = {}
 
-            cache_entry = {"timestamp": datetime.now().isoformat(), "data": data}
+                cache_entry = {"timestamp": datetime.now().isoformat(), "data": data}
 
-            self.persistent_cache[query_hash][variables_hash] = cache_entry
-            self._save_persistent_cache()
+                self.persistent_cache[query_hash][variables_hash] = cache_entry
+                self._save_persistent_cache()
 
         return data
 
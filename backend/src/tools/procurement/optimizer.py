@@ -0,0 +1,427 @@
+"""BOM-level procurement optimizer with seller consolidation.
+
+`optimize_order` used to pick the cheapest offer for every line in isolation.
+This module solves the whole BOM as an assignment problem instead:
+
+    minimize   sum(line cost) + seller_fixed_cost * (#distinct sellers used)
+
+where each line cost already respects inventory, MOQ, order multiples and
+price breaks (ordering up to a cheaper break is considered when it lowers the
+line total). With `allow_split` a line may be covered by several offers when
+no single offer has enough stock.
+
+Small BOMs are solved exactly with branch-and-bound; large BOMs use a greedy
+assignment followed by a "drop seller" local search. Both run inside a time
+budget and always return the best plan found so far.
+"""
+from __future__ import annotations
+
+import math
+import random
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+
+class Allocation(NamedTuple):
+    """A single purchase from one offer."""
+
+    seller_key: str
+    seller: dict
+    offer: dict
+    order_quantity: int
+    unit_price: float
+    currency: str
+
+
+class Candidate(NamedTuple):
+    """One way of covering a BOM line (one or more allocations)."""
+
+    part: dict
+    allocations: Tuple[Allocation, ...]
+    cost: float
+    sellers: frozenset
+
+
+def _seller_key(seller: dict) -> str:
+    company = seller.get("company", {}) or {}
+    return str(company.get("id") or company.get("name") or "unknown")
+
+
+def _round_to_multiple(quantity: int, multiple: Optional[int]) -> int:
+    if not multiple or multiple <= 1:
+        return quantity
+    return int(math.ceil(quantity / multiple) * multiple)
+
+
+def _unit_price_for(prices: List[Dict], quantity: int) -> Optional[Dict]:
+    """Return the highest price break whose quantity does not exceed `quantity`."""
+    applicable = None
+    for price in sorted(prices, key=lambda p: p.get("quantity", 0) or 0):
+        if price.get("convertedPrice") is None:
+            continue
+        if (price.get("quantity", 0) or 0) <= quantity:
+            applicable = price
+        else:
+            break
+    return applicable
+
+
+def _best_allocation(
+    seller: dict, offer: dict, quantity: int, require_full: bool = True
+) -> Optional[Allocation]:
+    """Cheapest way to buy `quantity` (or as much as possible) from a single offer.
+
+    Considers ordering up to a higher price break when that lowers the total.
+    """
+    inventory = offer.get("inventoryLevel", 0) or 0
+    moq = offer.get("moq") or 1
+    multiple = offer.get("orderMultiple") or 1
+    prices = offer.get("prices", []) or []
+    if not prices or inventory <= 0:
+        return None
+
+    wanted = quantity if require_full else min(quantity, inventory)
+    base_quantity = _round_to_multiple(max(wanted, moq), multiple)
+    if base_quantity > inventory:
+        return None
+
+    order_quantities = {base_quantity}
+    for price in prices:
+        tier_quantity = _round_to_multiple(price.get("quantity", 0) or 0, multiple)
+        if base_quantity < tier_quantity <= inventory:
+            order_quantities.add(tier_quantity)
+
+    best = None
+    best_total = float("inf")
+    for order_quantity in order_quantities:
+        price = _unit_price_for(prices, order_quantity)
+        if price is None:
+            continue
+        total = price["convertedPrice"] * order_quantity
+        if total < best_total:
+            best_total = total
+            best = Allocation(
+                seller_key=_seller_key(seller),
+                seller=seller,
+                offer=offer,
+                order_quantity=order_quantity,
+                unit_price=price["convertedPrice"],
+                currency=price.get("convertedCurrency", "USD"),
+            )
+    return best
+
+
+def _split_candidate(part: dict, quantity: int) -> Optional[Candidate]:
+    """Cover `quantity` by combining offers, cheapest unit price first."""
+    partials = []
+    for seller in part.get("sellers", []) or []:
+        for offer in seller.get("offers", []) or []:
+            allocation = _best_allocation(seller, offer, quantity, require_full=False)
+            if allocation is not None:
+                partials.append((seller, offer, allocation))
+    partials.sort(key=lambda entry: entry[2].unit_price)
+
+    remaining = quantity
+    allocations: List[Allocation] = []
+    for seller, offer, _ in partials:
+        if remaining <= 0:
+            break
+        allocation = _best_allocation(seller, offer, remaining, require_full=False)
+        if allocation is None:
+            continue
+        allocations.append(allocation)
+        remaining -= allocation.order_quantity
+
+    if remaining > 0 or len(allocations) < 2:
+        return None
+    return Candidate(
+        part=part,
+        allocations=tuple(allocations),
+        cost=sum(a.unit_price * a.order_quantity for a in allocations),
+        sellers=frozenset(a.seller_key for a in allocations),
+    )
+
+
+def build_candidates(
+    parts: List[dict], quantity: int, allow_split: bool = False
+) -> List[Candidate]:
+    """Return the cheapest candidate per seller (plus an optional split) for one BOM line.
+
+    `parts` may contain the original part and any alternatives; all are considered.
+    """
+    per_seller: Dict[Tuple[str, str], Candidate] = {}
+    for part in parts:
+        for seller in part.get("sellers", []) or []:
+            for offer in seller.get("offers", []) or []:
+                allocation = _best_allocation(seller, offer, quantity)
+                if allocation is None:
+                    continue
+                candidate = Candidate(
+                    part=part,
+                    allocations=(allocation,),
+                    cost=allocation.unit_price * allocation.order_quantity,
+                    sellers=frozenset([allocation.seller_key]),
+                )
+                key = (allocation.seller_key, part.get("mpn") or "")
+                if key not in per_seller or candidate.cost < per_seller[key].cost:
+                    per_seller[key] = candidate
+
+    candidates = sorted(per_seller.values(), key=lambda c: c.cost)
+    if allow_split and not candidates:
+        for part in parts:
+            split = _split_candidate(part, quantity)
+            if split is not None:
+                candidates.append(split)
+        candidates.sort(key=lambda c: c.cost)
+    return candidates
+
+
+def _plan_cost(plan: List[Candidate], seller_fixed_cost: float) -> float:
+    sellers = set()
+    for candidate in plan:
+        sellers |= candidate.sellers
+    return sum(c.cost for c in plan) + seller_fixed_cost * len(sellers)
+
+
+def _greedy(lines: List[List[Candidate]], seller_fixed_cost: float) -> List[Candidate]:
+    """Assign lines in order of regret, charging the fixed cost only for new sellers."""
+    order = sorted(
+        range(len(lines)),
+        key=lambda i: -(lines[i][1].cost - lines[i][0].cost) if len(lines[i]) > 1 else 0,
+    )
+    open_sellers: set = set()
+    plan: Dict[int, Candidate] = {}
+    for i in order:
+        best = min(
+            lines[i],
+            key=lambda c: c.cost + seller_fixed_cost * len(c.sellers - open_sellers),
+        )
+        plan[i] = best
+        open_sellers |= best.sellers
+    return [plan[i] for i in range(len(lines))]
+
+
+def _local_search(
+    lines: List[List[Candidate]],
+    plan: List[Candidate],
+    seller_fixed_cost: float,
+    deadline: float,
+) -> List[Candidate]:
+    """Improve a plan by closing sellers and re-assigning their lines to open ones."""
+    best_cost = _plan_cost(plan, seller_fixed_cost)
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+
+        # Move 1: re-assign single lines given the current set of open sellers.
+        for i, options in enumerate(lines):
+            others = set()
+            for j, candidate in enumerate(plan):
+                if j != i:
+                    others |= candidate.sellers
+            best = min(
+                options,
+                key=lambda c: c.cost + seller_fixed_cost * len(c.sellers - others),
+            )
+            if best is not plan[i]:
+                trial = plan[:i] + [best] + plan[i + 1:]
+                trial_cost = _plan_cost(trial, seller_fixed_cost)
+                if trial_cost < best_cost - 1e-9:
+                    plan, best_cost, improved = trial, trial_cost, True
+
+        # Move 2: close one seller entirely.
+        open_sellers = set()
+        for candidate in plan:
+            open_sellers |= candidate.sellers
+        for closed in sorted(open_sellers):
+            if time.perf_counter() >= deadline:
+                break
+            remaining = open_sellers - {closed}
+            trial = []
+            for i, candidate in enumerate(plan):
+                if closed not in candidate.sellers:
+                    trial.append(candidate)
+                    continue
+                options = [c for c in lines[i] if closed not in c.sellers]
+                if not options:
+                    trial = None
+                    break
+                trial.append(
+                    min(
+                        options,
+                        key=lambda c: c.cost + seller_fixed_cost * len(c.sellers - remaining),
+                    )
+                )
+            if trial is None:
+                continue
+            trial_cost = _plan_cost(trial, seller_fixed_cost)
+            if trial_cost < best_cost - 1e-9:
+                plan, best_cost, improved = trial, trial_cost, True
+                break
+    return plan
+
+
+def _branch_and_bound(
+    lines: List[List[Candidate]],
+    incumbent: List[Candidate],
+    seller_fixed_cost: float,
+    deadline: float,
+) -> Tuple[List[Candidate], bool]:
+    """Exact search seeded with a heuristic incumbent. Returns (plan, proven_optimal)."""
+    # Branch on the most constrained lines first.
+    order = sorted(range(len(lines)), key=lambda i: len(lines[i]))
+    # Lower bound for the unassigned suffix: cheapest line cost, ignoring fixed costs.
+    suffix_bound = [0.0] * (len(order) + 1)
+    for depth in range(len(order) - 1, -1, -1):
+        suffix_bound[depth] = suffix_bound[depth + 1] + lines[order[depth]][0].cost
+
+    best_plan = list(incumbent)
+    best_cost = _plan_cost(incumbent, seller_fixed_cost)
+    chosen: Dict[int, Candidate] = {}
+    timed_out = False
+
+    def recurse(depth: int, cost: float, open_sellers: frozenset) -> None:
+        nonlocal best_plan, best_cost, timed_out
+        if timed_out:
+            return
+        if time.perf_counter() >= deadline:
+            timed_out = True
+            return
+        if depth == len(order):
+            if cost < best_cost - 1e-9:
+                best_cost = cost
+                best_plan = [chosen[i] for i in range(len(lines))]
+            return
+        if cost + suffix_bound[depth] >= best_cost - 1e-9:
+            return
+
+        line = order[depth]
+        options = sorted(
+            lines[line],
+            key=lambda c: c.cost + seller_fixed_cost * len(c.sellers - open_sellers),
+        )
+        for candidate in options:
+            added = seller_fixed_cost * len(candidate.sellers - open_sellers)
+            chosen[line] = candidate
+            recurse(depth + 1, cost + candidate.cost + added, open_sellers | candidate.sellers)
+            if timed_out:
+                break
+        chosen.pop(line, None)
+
+    recurse(0, 0.0, frozenset())
+    return best_plan, not timed_out
+
+
+def solve_assignment(
+    lines: List[List[Candidate]],
+    seller_fixed_cost: float = 0.0,
+    time_budget_s: float = 2.0,
+    exact_max_lines: int = 12,
+) -> Dict:
+    """Pick one candidate per BOM line minimizing line costs plus per-seller fixed costs.
+
+    Args:
+        lines: Candidate lists per line, each non-empty.
+        seller_fixed_cost: Fixed cost (shipping/handling) charged once per seller used.
+        time_budget_s: Hard wall-clock budget for the search.
+        exact_max_lines: Use branch-and-bound when the BOM has at most this many lines.
+
+    Returns:
+        Dict with 'plan' (list of Candidate), 'total_cost', 'sellers', 'solver',
+        'optimal' and 'runtime_ms'.
+    """
+    started = time.perf_counter()
+    deadline = started + max(time_budget_s, 0.0)
+
+    if not lines:
+        return {
+            "plan": [],
+            "total_cost": 0.0,
+            "sellers": [],
+            "solver": "empty",
+            "optimal": True,
+            "runtime_ms": 0.0,
+        }
+
+    # The regret order, the optimality check and the branch-and-bound suffix bound
+    # all read the cheapest candidate of a line from index 0.
+    lines = [sorted(options, key=lambda c: c.cost) for options in lines]
+
+    # Seed with the better of the regret-greedy plan and the per-line cheapest plan.
+    independent = [options[0] for options in lines]
+    plan = min(
+        (_greedy(lines, seller_fixed_cost), independent),
+        key=lambda p: _plan_cost(p, seller_fixed_cost),
+    )
+    plan = _local_search(lines, plan, seller_fixed_cost, deadline)
+    solver = "greedy+local_search"
+    optimal = seller_fixed_cost <= 0 and all(
+        c is options[0] for c, options in zip(plan, lines)
+    )
+
+    if not optimal and len(lines) <= exact_max_lines:
+        plan, optimal = _branch_and_bound(lines, plan, seller_fixed_cost, deadline)
+        solver = "branch_and_bound"
+
+    sellers = set()
+    for candidate in plan:
+        sellers |= candidate.sellers
+
+    return {
+        "plan": plan,
+        "total_cost": _plan_cost(plan, seller_fixed_cost),
+        "sellers": sorted(sellers),
+        "solver": solver,
+        "optimal": optimal,
+        "runtime_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+
+
+def _synthetic_bom(n_lines: int, n_sellers: int, seed: int = 0) -> List[List[Candidate]]:
+    """Random BOM with overlapping seller coverage, used by the benchmark below."""
+    rng = random.Random(seed)
+    lines = []
+    for i in range(n_lines):
+        quantity = rng.choice([1, 10, 50, 100, 500])
+        sellers = []
+        for s in rng.sample(range(n_sellers), k=max(1, n_sellers // 2)):
+            base = rng.uniform(0.05, 5.0)
+            sellers.append(
+                {
+                    "company": {"id": f"S{s}", "name": f"Seller {s}"},
+                    "offers": [
+                        {
+                            "id": f"O{i}-{s}",
+                            "inventoryLevel": rng.choice([0, quantity, quantity * 10]),
+                            "moq": rng.choice([1, 1, 10, 100]),
+                            "prices": [
+                                {"quantity": 1, "convertedPrice": base, "convertedCurrency": "EUR"},
+                                {"quantity": 100, "convertedPrice": base * 0.8, "convertedCurrency": "EUR"},
+                                {"quantity": 1000, "convertedPrice": base * 0.6, "convertedCurrency": "EUR"},
+                            ],
+                        }
+                    ],
+                }
+            )
+        candidates = build_candidates([{"mpn": f"MPN{i}", "sellers": sellers}], quantity, allow_split=True)
+        if candidates:
+            lines.append(candidates)
+    return lines
+
+
+if __name__ == "__main__":
+    # Benchmark: python -m backend.src.tools.procurement.optimizer
+    for n_lines, n_sellers in [(5, 6), (10, 8), (12, 10), (50, 15), (200, 25)]:
+        lines = _synthetic_bom(n_lines, n_sellers)
+        independent = sum(options[0].cost for options in lines)
+        result = solve_assignment(lines, seller_fixed_cost=15.0)
+        naive_sellers = set()
+        for options in lines:
+            naive_sellers |= options[0].sellers
+        naive_total = independent + 15.0 * len(naive_sellers)
+        print(
+            f"lines={len(lines):4d} sellers={n_sellers:3d} solver={result['solver']:20s} "
+            f"optimal={str(result['optimal']):5s} runtime={result['runtime_ms']:8.2f}ms "
+            f"per_part={naive_total:10.2f} consolidated={result['total_cost']:10.2f} "
+            f"sellers_used={len(result['sellers'])}/{len(naive_sellers)}"
+        )
@@ -1,17 +1,25 @@
 import json
 import copy
-from typing import List, Dict, Optional
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Tuple
 from .nexarSupplyClient import NexarClient
 from backend.src.config import (
     NEXAR_CLIENT_ID,
     NEXAR_CLIENT_SECRET,
     PROCUREMENT_API_IS_LIVE,
     PROCUREMENT_API_CACHE_TTL_MINUTES,
+    PROCUREMENT_MAX_CONCURRENT_REQUESTS,
+    PROCUREMENT_SELLER_FIXED_COST,
+    PROCUREMENT_OPTIMIZER_TIME_BUDGET_SECONDS,
+    PROCUREMENT_OPTIMIZER_EXACT_MAX_PARTS,
 )
 from .query_manager import (
-    MULTI_QUERY_FULL,
+    QUERY_PROFILES,
     SEARCH_BY_CATEGORY_QUERY,
+    wider_queries,
 )
+from .optimizer import build_candidates, solve_assignment
 
 
 # Initialize shared client
@@ -94,7 +102,7 @@ def filter_sellers_by_shipping(
                 match["parts"] = [process_part(part) for part in match["parts"]]
 
     if is_id_mode:
-        new_id = store.save_search_result(filtered_data)
+        new_id = store.save_search_result(filtered_data, previous_id=data)
         return json.dumps(
             {
                 "status": "success",
@@ -233,7 +241,7 @@ def sort_and_filter_by_best_price(
                 match["parts"] = [process_part(part) for part in match["parts"]]
 
     if is_id_mode:
-        new_id = store.save_search_result(result_data)
+        new_id = store.save_search_result(result_data, previous_id=data)
         return json.dumps(
             {
                 "status": "success",
@@ -253,10 +261,11 @@ def search_part_by_mpn(
     quantity: int = 1,
     part_limit: int = 1,
     apply_country_filter: bool = True,
+    detail: str = "pricing",
 ) -> str:
     """
     Search for electronic parts by their Manufacturer Part Numbers (MPNs).
-    Returns detailed part information including pricing, availability, and seller options.
+    Returns part information including pricing, availability, and seller options.
 
     IMPORTANT: Use the EXACT 'item_nr' or 'Part Number' found in the conversation history
     or BOM data. Do NOT attempt to translate or guess a manufacturer MPN if a
@@ -273,22 +282,33 @@ def search_part_by_mpn(
         quantity: Quantity needed per part (default: 1)
         part_limit: Number of parts to return per MPN (default: 1). Use 1 unless you need multiple alternatives from the same MPN. Higher values consume more API quota.
         apply_country_filter: Filters results to only show sellers shipping to Germany (DE). KEEP AS True (default). Only set to False if international shipping information is required, which is basically never the case.
+        detail: Field set to fetch. "pricing" (default): price breaks, stock and sellers.
+                "availability": stock levels and lead times only (no prices).
+                "full": everything incl. specs, descriptions and datasheets - use only when specs are needed.
 
     Returns:
-        JSON string containing part details, specifications, pricing tiers, availability,
+        JSON string containing part details, pricing tiers, availability,
         and seller information from the Nexar supply API
 
     Example:
         search_part_by_mpn(["STM32F407VGT6"], quantity=100)  # Returns 1 part per MPN
         search_part_by_mpn(["STM32F407VGT6"], quantity=100, part_limit=5)  # More expensive!
         search_part_by_mpn(["AKUA012NN00400100000"])  # Example with a different MPN
+        search_part_by_mpn(["LM324N"], detail="full")  # Includes specs
     """
     print(
-        f"--- [Procurement] Search By MPN: {str(mpns)[:50]}... (Qty: {quantity})... (Limit: {part_limit}) ---"
+        f"--- [Procurement] Search By MPN: {str(mpns)[:50]}... (Qty: {quantity})... (Limit: {part_limit}) (Detail: {detail}) ---"
     )
 
     if not mpns or not isinstance(mpns, list):
         return json.dumps({"error": "Input must be a non-empty list of MPN strings."})
+    if detail not in QUERY_PROFILES:
+        return json.dumps(
+            {"error": f"Invalid detail '{detail}'. Use one of: {', '.join(QUERY_PROFILES)}."}
+        )
+
+    query = QUERY_PROFILES[detail]
+    fallback_queries = wider_queries(detail)
 
     combined_results = {"supMultiMatch": []}
     errors = []
@@ -305,7 +325,8 @@ def search_part_by_mpn(
 
         try:
             # Fetch individual result (hits cache if this specific MPN+limit was fetched before)
-            data = _nexar_client.get_query(MULTI_QUERY_FULL, variables)
+            # (a cached wider profile response is narrowed instead of re-fetched)
+            data = _nexar_client.get_query(query, variables, wider_queries=fallback_queries)
 
             # Filter sellers by country immediately to reduce token usage
             if apply_country_filter:
@@ -382,7 +403,10 @@ def find_alternatives(
     # First, get the original part to extract category and specs
     try:
         original_search = search_part_by_mpn(
-            [mpn], quantity=quantity, apply_country_filter=apply_country_filter
+            [mpn],
+            quantity=quantity,
+            apply_country_filter=apply_country_filter,
+            detail="full",
         )
         original_data = json.loads(original_search)
 
@@ -416,39 +440,102 @@ def find_alternatives(
             )
 
         original_part = parts[0]["parts"][0]
-        # category_id = original_part.get("category", {}).get("id", "")
 
-        # Search for alternatives using description and category
-        variables = {"description": description}  # , "categoryId": category_id
+        return json.dumps(
+            _search_alternatives(mpn, original_part, description, apply_country_filter)
+        )
+
+    except Exception as e:
+        return json.dumps({"error": str(e)})
 
-        alternatives_data = _nexar_client.get_query(SEARCH_BY_CATEGORY_QUERY, variables)
 
-        # Filter alternatives by country to reduce token usage
-        if apply_country_filter:
-            alternatives_data = filter_sellers_by_shipping(
-                alternatives_data, target_country_codes=["DE"]
-            )
+def _search_alternatives(
+    mpn: str, original_part: Dict, description: str, apply_country_filter: bool = True
+) -> Dict:
+    """
+    Search alternatives for an already-fetched original part (single API call).
 
-        # Combine original and alternatives for comparison
-        result = {
-            "original_mpn": mpn,
-            "original_part": original_part,
-            "alternatives": alternatives_data.get("supSearch", {}).get("results", []),
-            "note": "Compare specs carefully to ensure exact compatibility",
-        }
+    Args:
+        mpn: Original Manufacturer Part Number
+        original_part: Part data of the original MPN from a previous search
+        description: Part description to help match similar components
+        apply_country_filter: Only keep sellers shipping to Germany (DE)
+
+    Returns:
+        Dict with the same structure as the find_alternatives JSON output
+    """
+    # category_id = original_part.get("category", {}).get("id", "")
 
-        return json.dumps(result)
+    # Search for alternatives using description and category
+    variables = {"description": description}  # , "categoryId": category_id
 
-    except Exception as e:
-        return json.dumps({"error": str(e)})
+    alternatives_data = _nexar_client.get_query(SEARCH_BY_CATEGORY_QUERY, variables)
+
+    # Filter alternatives by country to reduce token usage
+    if apply_country_filter:
+        alternatives_data = filter_sellers_by_shipping(
+            alternatives_data, target_country_codes=["DE"]
+        )
+
+    # Combine original and alternatives for comparison
+    return {
+        "original_mpn": mpn,
+        "original_part": original_part,
+        "alternatives": alternatives_data.get("supSearch", {}).get("results", []),
+        "note": "Compare specs carefully to ensure exact compatibility",
+    }
+
+
+def _search_alternatives_concurrently(pending: List[Tuple[str, Dict]]) -> Dict[str, Dict]:
+    """
+    Resolve alternatives for several unavailable parts in one parallel wave.
+
+    Reuses the part data from the main batch search instead of re-querying each MPN.
+
+    Args:
+        pending: List of (original_mpn, original_part) tuples
+
+    Returns:
+        Dict mapping original MPN to its alternatives result (or an error dict)
+    """
+    if not pending:
+        return {}
+
+    print(f"--- [Procurement] Searching alternatives for {len(pending)} parts concurrently ---")
+
+    def search(original_mpn: str, part_data: Dict) -> Dict:
+        try:
+            return _search_alternatives(
+                original_mpn, part_data, part_data.get("shortDescription", "")
+            )
+        except Exception as e:
+            return {"error": str(e)}
+
+    max_workers = max(1, min(len(pending), PROCUREMENT_MAX_CONCURRENT_REQUESTS))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            # Copied context: spans and the mock-user flag follow the request into the workers
+            original_mpn: executor.submit(contextvars.copy_context().run, search, original_mpn, part_data)
+            for original_mpn, part_data in pending
+        }
+        return {original_mpn: future.result() for original_mpn, future in futures.items()}
 
 
-def optimize_order(parts_list: List[Dict]) -> str:
+def optimize_order(
+    parts_list: List[Dict],
+    consolidate_sellers: bool = False,
+    allow_split: bool = False,
+    seller_fixed_cost: float = PROCUREMENT_SELLER_FIXED_COST,
+) -> str:
     """
     Optimize procurement for an entire Bill of Materials (BOM). Searches all parts,
     finds alternatives for unavailable items, and selects the lowest-cost valid option
     for each part considering quantity requirements and MOQ constraints.
 
+    With consolidate_sellers=True the whole BOM is optimized at once: ordering from
+    fewer distributors saves a fixed shipping/handling cost per seller, and price
+    breaks are considered together with MOQs.
+
     API QUOTA WARNING: EXPENSIVE - Makes one API call per part in parts_list.
     For 10 parts, this uses ~10 API calls. Only use when doing complete BOM analysis.
 
@@ -459,6 +546,12 @@ def optimize_order(parts_list: List[Dict]) -> str:
     Args:
         parts_list: List of parts to procure, each with 'mpn' and 'quantity' keys
                    Example: [{"mpn": "STM32F407VGT6", "quantity": 100}, {"mpn": "LM324N", "quantity": 50}]
+        consolidate_sellers: If True, minimize the total landed cost of the whole BOM
+                   (part costs + seller_fixed_cost per distributor used) instead of picking
+                   the cheapest offer per part. Use when the user wants fewer orders/shipments.
+        allow_split: Only with consolidate_sellers. If True, a part may be split across
+                   several sellers when no single offer has enough stock.
+        seller_fixed_cost: Fixed cost (EUR) charged once per distributor used (default from config).
 
     Returns:
         JSON string with optimized procurement plan including selected MPN, pricing,
@@ -466,6 +559,7 @@ def optimize_order(parts_list: List[Dict]) -> str:
 
     Example:
         optimize_order([{"mpn": "STM32F407VGT6", "quantity": 100}, {"mpn": "LM324N", "quantity": 50}])
+        optimize_order([{"mpn": "STM32F407VGT6", "quantity": 100}], consolidate_sellers=True)
     """
     print(f"--- [Procurement] Optimize Order (Items: {len(parts_list)}) ---")
 
@@ -477,7 +571,7 @@ def optimize_order(parts_list: List[Dict]) -> str:
     quantity_map = {part["mpn"]: part["quantity"] for part in parts_list}
 
     # Batch search all parts
-    search_results_json = search_part_by_mpn(mpns)
+    search_results_json = search_part_by_mpn(mpns, detail="pricing")
     search_data = json.loads(search_results_json)
 
     if "error" in search_data:
@@ -507,7 +601,14 @@ def optimize_order(parts_list: List[Dict]) -> str:
         "warnings": [],
     }
 
-    # Process each part from the search results
+    if consolidate_sellers:
+        _optimize_consolidated(search_data, quantity_map, result, allow_split, seller_fixed_cost)
+        return json.dumps(result, indent=2)
+
+    # Process each part from the search results; unavailable parts are collected
+    # and their alternatives searched in one concurrent wave afterwards.
+    slots = []  # (original_mpn, quantity_needed, selected offer or None)
+    pending = []
     for match_result in search_data.get("supMultiMatch", []):
         parts = match_result.get("parts", [])
         if not parts:
@@ -522,32 +623,35 @@ def optimize_order(parts_list: List[Dict]) -> str:
 
         if selected:
             result["summary"]["found_directly"] += 1
-            result["parts"].append(selected)
         else:
             # Need to find alternative
             result["warnings"].append(
                 f"Part {original_mpn}: Insufficient stock or no valid offers, searching alternatives"
             )
+            pending.append((original_mpn, part_data))
+        slots.append((original_mpn, quantity_needed, selected))
 
-            alternative_json = find_alternatives(
-                mpn=original_mpn,
-                description=part_data.get("shortDescription", ""),
-                quantity=quantity_needed,
-            )
-            alternative_data = json.loads(alternative_json)
+    alternatives = _search_alternatives_concurrently(pending)
 
-            # Try to select from alternatives
-            alt_selected = _select_best_alternative(
-                alternative_data, quantity_needed, original_mpn
-            )
+    for original_mpn, quantity_needed, selected in slots:
+        if selected:
+            result["parts"].append(selected)
+            continue
 
-            if alt_selected:
-                result["summary"]["alternatives_used"] += 1
-                result["parts"].append(alt_selected)
-            else:
-                result["warnings"].append(
-                    f"Part {original_mpn}: No suitable alternatives found with sufficient stock"
-                )
+        # Try to select from alternatives
+        alt_selected = _select_best_alternative(
+            alternatives.get(original_mpn, {"error": "not searched"}),
+            quantity_needed,
+            original_mpn,
+        )
+
+        if alt_selected:
+            result["summary"]["alternatives_used"] += 1
+            result["parts"].append(alt_selected)
+        else:
+            result["warnings"].append(
+                f"Part {original_mpn}: No suitable alternatives found with sufficient stock"
+            )
 
     # Calculate total cost
     result["summary"]["total_estimated_cost"] = sum(
@@ -557,6 +661,129 @@ def optimize_order(parts_list: List[Dict]) -> str:
     return json.dumps(result, indent=2)
 
 
+def _optimize_consolidated(
+    search_data: Dict,
+    quantity_map: Dict,
+    result: Dict,
+    allow_split: bool,
+    seller_fixed_cost: float,
+) -> None:
+    """
+    Fill `result` with a BOM-level plan that trades part prices against seller fixed costs.
+
+    Args:
+        search_data: Resolved supMultiMatch search results
+        quantity_map: Required quantity per MPN
+        result: The optimize_order result skeleton, updated in place
+        allow_split: Allow covering one part from several sellers
+        seller_fixed_cost: Fixed cost per distributor used
+    """
+    slots = []  # (original_mpn, quantity_needed, candidates from the original part)
+    pending = []
+    for match_result in search_data.get("supMultiMatch", []):
+        parts = match_result.get("parts", [])
+        if not parts:
+            continue
+
+        part_data = parts[0]
+        original_mpn = part_data.get("mpn")
+        quantity_needed = quantity_map.get(original_mpn, 1)
+        candidates = build_candidates([part_data], quantity_needed, allow_split)
+
+        if not candidates:
+            result["warnings"].append(
+                f"Part {original_mpn}: Insufficient stock or no valid offers, searching alternatives"
+            )
+            pending.append((original_mpn, part_data))
+        slots.append((original_mpn, quantity_needed, candidates))
+
+    alternatives = _search_alternatives_concurrently(pending)
+
+    lines = []  # (original_mpn, quantity_needed, candidates)
+    for original_mpn, quantity_needed, candidates in slots:
+        if not candidates:
+            alternative_data = alternatives.get(original_mpn, {"error": "not searched"})
+            alternative_parts = []
+            if "error" not in alternative_data:
+                alternative_parts = [
+                    alt.get("part", {})
+                    for alt in alternative_data.get("alternatives", [])
+                    if alt.get("part", {}).get("mpn") != original_mpn
+                ]
+            candidates = build_candidates(
+                alternative_parts, quantity_needed, allow_split
+            )
+            if not candidates:
+                result["warnings"].append(
+                    f"Part {original_mpn}: No suitable alternatives found with sufficient stock"
+                )
+                continue
+
+        lines.append((original_mpn, quantity_needed, candidates))
+
+    solution = solve_assignment(
+        [candidates for _, _, candidates in lines],
+        seller_fixed_cost=seller_fixed_cost,
+        time_budget_s=PROCUREMENT_OPTIMIZER_TIME_BUDGET_SECONDS,
+        exact_max_lines=PROCUREMENT_OPTIMIZER_EXACT_MAX_PARTS,
+    )
+
+    for (original_mpn, quantity_needed, _), candidate in zip(lines, solution["plan"]):
+        selected_mpn = candidate.part.get("mpn")
+        is_alternative = selected_mpn != original_mpn
+        is_split = len(candidate.allocations) > 1
+        if is_alternative:
+            result["summary"]["alternatives_used"] += 1
+        else:
+            result["summary"]["found_directly"] += 1
+
+        for allocation in candidate.allocations:
+            result["parts"].append(
+                {
+                    "original_mpn": original_mpn,
+                    "selected_mpn": selected_mpn,
+                    "quantity_requested": quantity_needed,
+                    "quantity_ordered": allocation.order_quantity,
+                    "manufacturer": candidate.part.get("manufacturer", {}).get(
+                        "name", "Unknown"
+                    ),
+                    "unit_price": allocation.unit_price,
+                    "total_price": allocation.unit_price * allocation.order_quantity,
+                    "currency": allocation.currency,
+                    "seller": {
+                        "name": allocation.seller.get("company", {}).get("name", "Unknown"),
+                        "sku": allocation.offer.get("sku", ""),
+                        "inventory_level": allocation.offer.get("inventoryLevel", 0),
+                        "moq": allocation.offer.get("moq") or 1,
+                        "lead_time_days": allocation.offer.get("factoryLeadDays", 0),
+                    },
+                    "split_sourcing": is_split,
+                    "alternative_reason": (
+                        "Original part unavailable, selected compatible alternative"
+                        if is_alternative
+                        else None
+                    ),
+                }
+            )
+
+    fixed_costs = seller_fixed_cost * len(solution["sellers"])
+    parts_cost = sum(part.get("total_price", 0) for part in result["parts"])
+    if result["parts"]:
+        result["summary"]["currency"] = result["parts"][0]["currency"]
+    result["summary"]["parts_cost"] = parts_cost
+    result["summary"]["seller_fixed_costs"] = fixed_costs
+    result["summary"]["total_estimated_cost"] = parts_cost + fixed_costs
+    result["summary"]["optimization"] = {
+        "mode": "consolidated",
+        "solver": solution["solver"],
+        "optimal": solution["optimal"],
+        "sellers_used": len(solution["sellers"]),
+        "seller_fixed_cost": seller_fixed_cost,
+        "split_sourcing": allow_split,
+        "runtime_ms": solution["runtime_ms"],
+    }
+
+
 def _select_best_offer(part_data: Dict, quantity_needed: int) -> Optional[Dict]:
     """
     Select the best (lowest cost) offer from a part's sellers that meets quantity requirements.
@@ -1,3 +1,6 @@
+import re
+from functools import lru_cache
+
 DEFAULT_QUERY = """
 query ($mpn: String!) {
   supSearchMpn(
@@ -176,6 +179,181 @@ query GetParts(
 }
 """
 
+# Pricing profile: everything needed to compare offers, filter by shipping and
+# render procurement options (no specs, documents, images or company metadata).
+MULTI_QUERY_PRICING = """
+query GetPartPricing(
+  $queries: [SupPartMatchQuery!]!,
+  $country: String!,
+  $currency: String!
+) {
+  supMultiMatch (
+    queries: $queries,
+    country: $country,
+    currency: $currency
+  ) {
+    hits
+    parts {
+      id
+      name
+      mpn
+      manufacturer {
+        name
+      }
+      shortDescription
+      category {
+        id
+        name
+      }
+      totalAvail
+      sellers {
+        company {
+          id
+          name
+          homepageUrl
+          isVerified
+        }
+        country
+        offers {
+          id
+          sku
+          inventoryLevel
+          moq
+          prices {
+            quantity
+            price
+            currency
+            convertedPrice
+            convertedCurrency
+          }
+          clickUrl
+          factoryLeadDays
+          onOrderQuantity
+          orderMultiple
+        }
+        isAuthorized
+        shipsToCountries {
+          countryCode
+        }
+      }
+    }
+  }
+}
+"""
+
+# Availability profile: stock levels and lead times only, no price breaks.
+MULTI_QUERY_AVAILABILITY = """
+query GetPartAvailability(
+  $queries: [SupPartMatchQuery!]!,
+  $country: String!,
+  $currency: String!
+) {
+  supMultiMatch (
+    queries: $queries,
+    country: $country,
+    currency: $currency
+  ) {
+    hits
+    parts {
+      id
+      mpn
+      manufacturer {
+        name
+      }
+      shortDescription
+      totalAvail
+      sellers {
+        company {
+          id
+          name
+        }
+        offers {
+          id
+          sku
+          inventoryLevel
+          moq
+          factoryLeadDays
+          onOrderQuantity
+        }
+        shipsToCountries {
+          countryCode
+        }
+      }
+    }
+  }
+}
+"""
+
+# Operation profiles for supMultiMatch, narrowest first. A cached response of a
+# wider profile can always answer a narrower one (see project_to_query).
+QUERY_PROFILES = {
+    "availability": MULTI_QUERY_AVAILABILITY,
+    "pricing": MULTI_QUERY_PRICING,
+    "full": MULTI_QUERY_FULL,
+}
+PROFILE_ORDER = ["availability", "pricing", "full"]
+
+
+def wider_queries(profile: str) -> list[str]:
+    """Return the queries of all profiles that contain `profile`'s field set."""
+    index = PROFILE_ORDER.index(profile)
+    return [QUERY_PROFILES[p] for p in PROFILE_ORDER[index + 1:]]
+
+
+@lru_cache(maxsize=32)
+def parse_selection(query: str) -> dict:
+    """Parse the selection set of a GraphQL query into a nested {field: sub-selection} dict.
+
+    Leaf fields map to None. Arguments, variables and the operation header are ignored.
+    """
+    body = query
+    while True:
+        stripped = re.sub(r"\([^()]*\)", "", body)
+        if stripped == body:
+            break
+        body = stripped
+    tokens = re.findall(r"[A-Za-z_][A-Za-z0-9_]*|[{}]", body)
+
+    def parse_block(pos: int) -> tuple[dict, int]:
+        fields: dict = {}
+        last = None
+        while pos < len(tokens):
+            token = tokens[pos]
+            if token == "{":
+                fields[last], pos = parse_block(pos + 1)
+                continue
+            if token == "}":
+                return fields, pos + 1
+            fields[token] = None
+            last = token
+            pos += 1
+        return fields, pos
+
+    start = tokens.index("{")
+    selection, _ = parse_block(start + 1)
+    return selection
+
+
+def project(data, selection):
+    """Keep only the fields of `data` that appear in `selection` (recursively)."""
+    if selection is None:
+        return data
+    if isinstance(data, list):
+        return [project(item, selection) for item in data]
+    if isinstance(data, dict):
+        return {
+            key: project(data[key], sub)
+            for key, sub in selection.items()
+            if key in data
+        }
+    return data
+
+
+def project_to_query(data: dict, query: str) -> dict:
+    """Narrow a response fetched with a wider query to the field set of `query`."""
+    return project(data, parse_selection(query))
+
+
 # Query for searching alternatives by category and description
 SEARCH_BY_CATEGORY_QUERY = """
 query SearchByCategory($description: String!) {
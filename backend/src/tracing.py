@@ -0,0 +1,203 @@
+"""End-to-end request tracing with OpenTelemetry-compatible spans.
+
+A span covers one unit of work: the HTTP request, `KakoAgent.__call__`, a tool,
+an LM call, a Supabase query, a Xentral/Nexar HTTP call, an SSH transfer or an
+extraction stage. Spans nest through a context variable, like
+`auth_context.is_mock_user_context`. Worker threads started with a copied
+context (`contextvars.copy_context().run`) therefore attach their spans to the
+request that started them.
+
+Finished spans are appended to `TRACING_EXPORT_PATH` as JSON lines. The fields
+use the OTLP/JSON names (`traceId`, `spanId`, `parentSpanId`,
+`startTimeUnixNano`, ...) and the semantic-convention attribute keys
+(`http.request.method`, `gen_ai.request.model`, ...). The file can be analysed
+offline (one trace = all lines with its `traceId`) or fed into an
+OpenTelemetry collector. It is rotated once above `TRACING_EXPORT_MAX_MB`.
+"""
+from __future__ import annotations
+
+import contextlib
+import functools
+import inspect
+import json
+import os
+import secrets
+import threading
+import time
+from contextvars import ContextVar, Token
+from typing import Any, Callable, Dict, Iterator, Optional
+from urllib.parse import urlsplit
+
+import requests
+
+from backend.src.config import TRACING_ENABLED, TRACING_EXPORT_PATH, TRACING_EXPORT_MAX_MB
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+_SPAN_KINDS = ("internal", "server", "client")
+
+
+class Span:
+    """A timed operation with attributes, linked to its parent by trace and span IDs."""
+
+    def __init__(self, name: str, kind: str = "internal", attributes: Optional[Dict[str, Any]] = None) -> None:
+        parent = _current_span.get()
+        self.name = name
+        self.kind = kind if kind in _SPAN_KINDS else "internal"
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent.span_id if parent else ""
+        self.attributes: Dict[str, Any] = {"thread.name": threading.current_thread().name}
+        self.attributes.update(attributes or {})
+        self.status = "ok"
+        self.status_message = ""
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self._token: Optional[Token] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def record_exception(self, exception: BaseException) -> None:
+        self.status = "error"
+        self.status_message = f"{type(exception).__name__}: {exception}"[:500]
+
+    def end(self) -> None:
+        """Finish the span, restore its parent as the current span and export it."""
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if self._token is not None:
+            try:
+                _current_span.reset(self._token)
+            except ValueError:
+                # Ended from another context (e.g. a callback thread): nothing to restore
+                pass
+        _exporter.export(self)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "durationMs": round(((self.end_ns or self.start_ns) - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "status": {"code": self.status, "message": self.status_message},
+        }
+
+
+class JsonLinesExporter:
+    """Appends finished spans to a local file, one JSON object per line."""
+
+    def __init__(self, path: str, max_bytes: int) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._file = None
+
+    def _open(self):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        return self._file
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_otlp(), default=str, ensure_ascii=False)
+        try:
+            with self._lock:
+                handle = self._open()
+                handle.write(line + "\n")
+                handle.flush()
+                if handle.tell() > self.max_bytes:
+                    handle.close()
+                    self._file = None
+                    os.replace(self.path, self.path + ".1")
+        except OSError as e:
+            print(f"Warning: Span export failed: {e}")
+
+
+class _NoopExporter:
+    def export(self, span: Span) -> None:
+        pass
+
+
+_exporter = (
+    JsonLinesExporter(os.path.expanduser(TRACING_EXPORT_PATH), int(TRACING_EXPORT_MAX_MB * 1024 * 1024))
+    if TRACING_ENABLED
+    else _NoopExporter()
+)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def start_span(name: str, kind: str = "internal", **attributes: Any) -> Span:
+    """Start a span and make it current until `span.end()` (for code that cannot use `span()`)."""
+    new_span = Span(name, kind, attributes)
+    new_span._token = _current_span.set(new_span)
+    return new_span
+
+
+@contextlib.contextmanager
+def span(name: str, kind: str = "internal", **attributes: Any) -> Iterator[Span]:
+    """Trace the block as a child of the current span; exceptions mark it as failed."""
+    current = start_span(name, kind, **attributes)
+    try:
+        yield current
+    except BaseException as e:
+        current.record_exception(e)
+        raise
+    finally:
+        current.end()
+
+
+def traced(name: Optional[str] = None, kind: str = "internal", **attributes: Any) -> Callable:
+    """Decorator tracing every call of a function (sync or async); the name defaults to its qualname."""
+
+    def decorator(fn: Callable) -> Callable:
+        span_name = name or fn.__qualname__
+
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name, kind, **attributes):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name, kind, **attributes):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def traced_request(
+    service: str, method: str, url: str, session: Optional[requests.Session] = None, **kwargs: Any
+) -> requests.Response:
+    """`requests` call wrapped in a client span (`<service> <METHOD> <path>`)."""
+    parts = urlsplit(url)
+    with span(
+        f"{service} {method.upper()} {parts.path or '/'}",
+        "client",
+        **{
+            "peer.service": service,
+            "http.request.method": method.upper(),
+            "server.address": parts.hostname or "",
+            "url.path": parts.path,
+        },
+    ) as current:
+        response = (session or requests).request(method, url, **kwargs)
+        current.set_attribute("http.response.status_code", response.status_code)
+        if response.status_code >= 500:
+            current.status = "error"
+        return response
@@ -302,15 +302,22 @@ def build_cost_analysis_tool_block(payload: object) -> ToolUseBlock | None:
 
 
 def append_to_history(history: dspy.History, user_query: str, process_result: str) -> None:
-    history.messages.append({"user_query": user_query, "process_result": process_result})
-    # Keep a bounded window to avoid unbounded prompt growth.
-    max_turns = 25
-    if len(history.messages) > max_turns:
-        history.messages = history.messages[-max_turns:]
+    # Bounded by an estimated token budget; old turns are folded into a summary (see history.py).
+    from backend.src.history import HistoryManager
+
+    HistoryManager().append(history, user_query, process_result)
 
 
 def extract_tool_calls_from_trajectory(trajectory: object) -> list[tuple[str, dict, object]]:
-    """Extract ordered (tool_name, tool_args, observation) tuples from a ReAct trajectory."""
+    """Extract ordered (tool_name, tool_args, observation) tuples from a ReAct trajectory.
+
+    Observations that reached the LM in compact form are replaced by their full
+    payload (see observations.py), so UI blocks are built from complete data. A
+    `run_parallel` step is expanded into its individual calls (see tool_runner.py).
+    """
+    from backend.src.observations import rehydrate
+    from backend.src.tool_runner import PARALLEL_TOOL_NAME, expand_parallel_call
+
     if not isinstance(trajectory, dict):
         return []
 
@@ -327,6 +334,12 @@ def extract_tool_calls_from_trajectory(trajectory: object) -> list[tuple[str, di
         tool_name = trajectory.get(f"tool_name_{i}")
         tool_args = trajectory.get(f"tool_args_{i}", {}) or {}
         observation = trajectory.get(f"observation_{i}")
-        if isinstance(tool_name, str) and isinstance(tool_args, dict):
-            calls.append((tool_name, tool_args, observation))
+        if not isinstance(tool_name, str) or not isinstance(tool_args, dict):
+            continue
+        if tool_name == PARALLEL_TOOL_NAME:
+            calls.extend(
+                (name, args, rehydrate(result)) for name, args, result in expand_parallel_call(tool_args, observation)
+            )
+        else:
+            calls.append((tool_name, tool_args, rehydrate(observation)))
     return calls
@@ -0,0 +1,254 @@
+"""Deterministic tool pipelines for the most frequent requests.
+
+Uploading a drawing, checking a BOM's feasibility and optimizing its
+procurement take the ReAct agent several LM round-trips. In those round-trips
+it mostly picks the obvious next tool and copies a BOM_ ID. `WorkflowEngine`
+recognizes these intents from the query, runs the tools directly, in the
+order extract -> feasibility -> optimize, and uses one LM call to write the
+final answer.
+
+The result is a `dspy.Prediction` with `process_result` and a ReAct-shaped
+`trajectory`, so the API builds the same UI blocks as for an agent run.
+Anything the rules do not fully cover (other tools, missing inputs) is left to
+the agent.
+"""
+from __future__ import annotations
+
+import math
+import re
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import dspy
+
+from backend.src import metrics, tracing
+from backend.src.config import OBSERVATION_MAX_TOKENS
+from backend.src.history import estimate_tokens
+from backend.src.observations import encode
+from backend.src.tools.bom_extraction.bom_tool import perform_bom_extraction
+from backend.src.tools.demand_analysis.bom import check_feasibility
+from backend.src.tools.procurement.procurement import optimize_order
+
+WORKFLOW_RUNS = metrics.Counter(
+    "kakoai_workflow_runs_total", "Requests answered by a deterministic workflow, by workflow and outcome."
+)
+
+_FILE_PATH = re.compile(r"\(file_path: '([^']+)'\)")
+_BOM_ID = re.compile(r"\bBOM_[A-F0-9]{8}\b")
+_DRAWING_NAME = re.compile(r"[\w\-.]+\.(?:pdf|png|jpe?g|tiff?)\b", re.IGNORECASE)
+_ORDER_AMOUNT = re.compile(
+    r"(?<![\w.,])(\d+)\s*(?:x|pcs|pieces|units?|devices?|stück|stk|einheiten|geräte?n?|of)\b"
+    r"|\b(?:quantity|menge|amount|anzahl|for|für)\s*(?:of\s*)?(\d+)\b(?![.,]\d)",
+    re.IGNORECASE,
+)
+# Numbers that are not part of an ID or MPN; any left after the order amount make the amount unclear
+_NUMBER = re.compile(r"(?<![\w.,])\d+(?:[.,]\d+)?(?![\w.,])")
+_REFERENCE_ID = re.compile(r"\b(?:BOM|SEARCH|OBS)_\w+\b")
+_EXTRACT = re.compile(r"\b(?:extract\w*|extrahier\w*|auslesen|lies\w*)\b", re.IGNORECASE)
+_FEASIBILITY = re.compile(r"\b(?:feasib\w*|machbar\w*|durchführbar\w*|fulfil\w*|erfüllbar\w*)\b", re.IGNORECASE)
+_OPTIMIZE = re.compile(r"\b(?:optimi[sz]\w*|procure\w*|beschaff\w*|einkauf\w*)\b", re.IGNORECASE)
+# Intents served by other tools: leave these requests to the agent
+_OTHER_INTENTS = re.compile(
+    r"\b(?:SEARCH_\w+|seller\w*|shipping|versand\w*|alternativ\w*|mpn|customer\w*|kunde\w*|"
+    r"sales orders?|aufträge|auftrag|consolidat\w*|split\w*|edit\w*|änder\w*)\b",
+    re.IGNORECASE,
+)
+
+
+class WorkflowState:
+    """Values passed between workflow steps."""
+
+    def __init__(self, user_query: str, history: dspy.History) -> None:
+        file_match = _FILE_PATH.search(user_query)
+        text = _FILE_PATH.sub("", user_query)
+        drawing_match = _DRAWING_NAME.search(text)
+        self.file_path: Optional[str] = (
+            file_match.group(1) if file_match else drawing_match.group(0) if drawing_match else None
+        )
+        self.uploaded = file_match is not None
+        self.bom_id: Optional[str] = _find_bom_id(text, history)
+        # None if the query has a number that is not clearly the order amount
+        self.order_amount: Optional[int] = _order_amount(_REFERENCE_ID.sub("", _DRAWING_NAME.sub("", text)))
+
+
+def _order_amount(text: str) -> Optional[int]:
+    """Order amount named in the query (1 if none); None if other numbers leave it unclear."""
+    amounts = {int(next(g for g in match.groups() if g)) for match in _ORDER_AMOUNT.finditer(text)}
+    if len(amounts) > 1 or _NUMBER.search(_ORDER_AMOUNT.sub("", text)):
+        return None
+    return amounts.pop() if amounts else 1
+
+
+def _find_bom_id(text: str, history: dspy.History) -> Optional[str]:
+    """BOM_ ID named in the query, else the most recent one in the thread history."""
+    match = _BOM_ID.search(text)
+    if match:
+        return match.group(0)
+    for message in reversed(history.messages):
+        for value in (message.get("process_result"), message.get("user_query")):
+            found = _BOM_ID.findall(str(value or ""))
+            if found:
+                return found[-1]
+    return None
+
+
+def _bom_parts_list(bom_id: str, order_amount: int) -> Optional[List[Dict]]:
+    from backend.src.store import BOMStore
+
+    entry = BOMStore().get_bom(bom_id)
+    if entry is None:
+        return None
+    return [
+        {"mpn": item.item_nr, "quantity": math.ceil((item.quantity or 1) * order_amount)}
+        for item in entry["bom"].items
+        if item.item_nr
+    ]
+
+
+def _extract_args(state: WorkflowState) -> Optional[Dict]:
+    return {"file_path": state.file_path}
+
+
+def _after_extract(state: WorkflowState, observation) -> None:
+    match = re.search(r"Reference ID: (BOM_[A-F0-9]+)", str(observation))
+    state.bom_id = match.group(1) if match else None
+
+
+def _feasibility_args(state: WorkflowState) -> Optional[Dict]:
+    return {"bom_input": state.bom_id, "order_amount": state.order_amount}
+
+
+def _optimize_args(state: WorkflowState) -> Optional[Dict]:
+    parts_list = _bom_parts_list(state.bom_id, state.order_amount)
+    return {"parts_list": parts_list} if parts_list else None
+
+
+class Step(NamedTuple):
+    """One tool call of a workflow.
+
+    `requires`/`provides` name WorkflowState fields; they are checked before
+    anything runs, so a workflow either has all of its inputs or is not used.
+    """
+
+    intent: str
+    tool: Callable
+    requires: str
+    provides: Optional[str]
+    build_args: Callable[[WorkflowState], Optional[Dict]]
+    after: Optional[Callable[[WorkflowState, object], None]] = None
+
+
+STEPS = [
+    Step("extract", perform_bom_extraction, "file_path", "bom_id", _extract_args, _after_extract),
+    Step("feasibility", check_feasibility, "bom_id", None, _feasibility_args),
+    Step("optimize", optimize_order, "bom_id", None, _optimize_args),
+]
+
+
+def _detect_intents(user_query: str, state: WorkflowState) -> List[str]:
+    text = _FILE_PATH.sub("", user_query)
+    intents = []
+    if _FEASIBILITY.search(text):
+        intents.append("feasibility")
+    if _OPTIMIZE.search(text):
+        intents.append("optimize")
+    # Other questions about an upload ("which material is part 3?") are left to the agent
+    if (_EXTRACT.search(text) and state.file_path) or (state.uploaded and (intents or not text.strip())):
+        intents.insert(0, "extract")
+    return intents
+
+
+def _is_error(observation) -> bool:
+    text = str(observation).lstrip()
+    return (
+        text.startswith(("Error", "Did not find", "I cannot"))
+        or text.startswith('{"error"')
+        or '"feasible": false, "error"' in text
+    )
+
+
+def _prompt_view(observation) -> str:
+    """The observation for the summary prompt; large ones in compact form (the trajectory keeps them whole)."""
+    text = str(observation)
+    return encode(observation) if estimate_tokens(text) > OBSERVATION_MAX_TOKENS else text
+
+
+class WorkflowSummarySignature(dspy.Signature):
+    """You are KakoAI, KAKO's industrial copilot. The tools for the user's request have
+    already been run; write the final response from their results.
+
+    - Respond in the language of the user's request (English or German).
+    - If a result contains a "USER_VIEW" line, copy it exactly; do not list BOM items or Reference IDs.
+    - Otherwise state the specific data points (stock quantities, missing parts, prices, sellers) exactly as given.
+    - Never invent data. If a step failed or returned a suggestion ("Did you mean ..."), explain it and ask how to proceed.
+    - End by suggesting the immediate next step."""
+
+    user_query: str = dspy.InputField()
+    tool_results: str = dspy.InputField(desc="The tool calls that were run and their outputs, in order.")
+    process_result: str = dspy.OutputField(desc="The final response to the user.")
+
+
+class WorkflowEngine:
+    """Matches requests to tool pipelines and runs them without the ReAct loop."""
+
+    def __init__(self, steps: List[Step] = STEPS) -> None:
+        self.steps = steps
+        self.summarize = dspy.Predict(WorkflowSummarySignature)
+
+    def match(self, user_query: str, history: dspy.History) -> Optional[Tuple[List[Step], WorkflowState]]:
+        """Return the steps to run for this query, or None to use the agent."""
+        if _OTHER_INTENTS.search(_FILE_PATH.sub("", user_query)):
+            return None
+        state = WorkflowState(user_query, history)
+        intents = _detect_intents(user_query, state)
+        if not intents:
+            return None
+        # An unclear amount is left to the agent rather than checked for one unit
+        if state.order_amount is None and {"feasibility", "optimize"} & set(intents):
+            return None
+        available = {name for name in ("file_path", "bom_id") if getattr(state, name)}
+        # An extraction in this run replaces any BOM_ ID from the history
+        if "extract" in intents:
+            available.discard("bom_id")
+        steps = []
+        for step in self.steps:
+            if step.intent not in intents:
+                continue
+            if step.requires not in available:
+                return None
+            steps.append(step)
+            if step.provides:
+                available.add(step.provides)
+        return steps, state
+
+    def run(self, steps: List[Step], state: WorkflowState, user_query: str) -> dspy.Prediction:
+        """Execute the steps in order and summarize the results with a single LM call."""
+        name = "+".join(step.intent for step in steps)
+        print(f"--- [Workflow] Running '{name}' ---")
+        trajectory: Dict[str, object] = {}
+        outcome = "ok"
+        for index, step in enumerate(steps):
+            args = step.build_args(state)
+            if args is None:
+                outcome = "missing_input"
+                break
+            with tracing.span(f"tool.{step.tool.__name__}", **{"kakoai.workflow": name}):
+                observation = step.tool(**args)
+            trajectory[f"thought_{index}"] = f"Workflow '{name}': step {index + 1} ({step.intent})."
+            trajectory[f"tool_name_{index}"] = step.tool.__name__
+            trajectory[f"tool_args_{index}"] = args
+            trajectory[f"observation_{index}"] = observation
+            if _is_error(observation):
+                outcome = "tool_error"
+                break
+            if step.after is not None:
+                step.after(state, observation)
+
+        results = "\n\n".join(
+            f"{trajectory[f'tool_name_{i}']}({trajectory[f'tool_args_{i}']}):\n"
+            f"{_prompt_view(trajectory[f'observation_{i}'])}"
+            for i in range(len(steps))
+            if f"tool_name_{i}" in trajectory
+        )
+        summary = self.summarize(user_query=user_query, tool_results=results or "No tool could be run.")
+        WORKFLOW_RUNS.inc(workflow=name, outcome=outcome)
+        return dspy.Prediction(process_result=summary.process_result, trajectory=trajectory, workflow=name)
@@ -0,0 +1,30 @@
+import time
+
+import pytest
+
+from backend.src.cache import BoundedCache, ValueTooLarge
+
+
+def test_expired_parent_keeps_valid_child():
+    cache = BoundedCache("test_lineage", ttl_seconds=0.2)
+    cache.set("SEARCH_ROOT", {"parts": 1})
+    time.sleep(0.1)
+    cache.set("SEARCH_CHILD", {"parts": 2}, parent="SEARCH_ROOT")
+    time.sleep(0.15)
+    assert cache.get("SEARCH_ROOT") is None
+    assert cache.get("SEARCH_CHILD") == {"parts": 2}
+
+
+def test_removing_a_parent_removes_descendants():
+    cache = BoundedCache("test_removal")
+    cache.set("SEARCH_ROOT", 1)
+    cache.set("SEARCH_CHILD", 2, parent="SEARCH_ROOT")
+    cache.pop("SEARCH_ROOT")
+    assert "SEARCH_CHILD" not in cache
+
+
+def test_value_larger_than_limit_is_rejected():
+    cache = BoundedCache("test_too_large", max_bytes=1000)
+    with pytest.raises(ValueTooLarge):
+        cache.set("SEARCH_BIG", "x" * 5000)
+    assert "SEARCH_BIG" not in cache
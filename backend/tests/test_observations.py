@@ -0,0 +1,35 @@
+import json
+
+import pytest
+
+from backend.src.history import estimate_tokens
+from backend.src.observations import encode, encode_observation
+
+
+def _extraction_result(items: int) -> str:
+    content = ", ".join(
+        f"BOMItem(pos={i}, item_nr='ART-{i:05d}', description='Hex screw M{i % 12 + 2} DIN 933', quantity={i % 7 + 1})"
+        for i in range(items)
+    )
+    return (
+        "USER_VIEW: BOM 'Gear housing' extracted successfully.\n"
+        f"AGENT_DATA: Reference ID: BOM_1A2B3C4D, Source: housing.pdf, Title: Gear housing, Content: {content}"
+    )
+
+
+def _feasibility_result(rows: int) -> str:
+    details = [{"part": f"ART-{i:05d}", "required": i, "available": i * 2, "status": "ok"} for i in range(rows)]
+    return json.dumps({"feasible": True, "missing_items": [], "details": details})
+
+
+@pytest.mark.parametrize("result", [_extraction_result(300), _extraction_result(40), _feasibility_result(300)])
+def test_encoded_observation_never_exceeds_raw(result):
+    encoded = encode_observation("some_tool", result)
+    assert estimate_tokens(encoded) <= estimate_tokens(result)
+
+
+def test_extraction_keeps_reference_without_content():
+    encoded = encode(_extraction_result(300), max_tokens=200)
+    assert encoded.startswith("USER_VIEW: BOM 'Gear housing' extracted successfully.")
+    assert "Reference ID: BOM_1A2B3C4D, Source: housing.pdf, Title: Gear housing" in encoded
+    assert estimate_tokens(encoded) <= 200
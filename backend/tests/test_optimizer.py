@@ -0,0 +1,76 @@
+import itertools
+
+import pytest
+
+from backend.src.tools.procurement.optimizer import (
+    _plan_cost,
+    _synthetic_bom,
+    build_candidates,
+    solve_assignment,
+)
+
+
+def _brute_force(lines, seller_fixed_cost):
+    return min(_plan_cost(list(plan), seller_fixed_cost) for plan in itertools.product(*lines))
+
+
+def _seller(seller_id, offer_id, inventory, price):
+    return {
+        "company": {"id": seller_id, "name": seller_id},
+        "offers": [
+            {
+                "id": offer_id,
+                "inventoryLevel": inventory,
+                "moq": 1,
+                "prices": [{"quantity": 1, "convertedPrice": price, "convertedCurrency": "EUR"}],
+            }
+        ],
+    }
+
+
+@pytest.mark.parametrize("seed", range(8))
+@pytest.mark.parametrize("seller_fixed_cost", [0.0, 15.0, 100.0])
+def test_exact_solver_matches_brute_force(seed, seller_fixed_cost):
+    lines = _synthetic_bom(n_lines=6, n_sellers=6, seed=seed)
+    result = solve_assignment(lines, seller_fixed_cost=seller_fixed_cost, time_budget_s=10.0)
+
+    assert result["optimal"]
+    assert result["total_cost"] == pytest.approx(_brute_force(lines, seller_fixed_cost))
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_heuristic_plan_is_valid_and_bounded_by_brute_force(seed):
+    lines = _synthetic_bom(n_lines=6, n_sellers=6, seed=seed)
+    result = solve_assignment(lines, seller_fixed_cost=15.0, exact_max_lines=0)
+
+    assert all(any(c is chosen for c in options) for chosen, options in zip(result["plan"], lines))
+    assert result["total_cost"] >= _brute_force(lines, 15.0) - 1e-9
+
+
+@pytest.mark.parametrize("seller_fixed_cost", [15.0, 100.0])
+def test_candidate_order_does_not_affect_the_bound(seller_fixed_cost):
+    # Most expensive candidate first: a suffix bound read from index 0 would prune the optimum
+    lines = [list(reversed(options)) for options in _synthetic_bom(n_lines=6, n_sellers=6, seed=6)]
+    result = solve_assignment(lines, seller_fixed_cost=seller_fixed_cost, time_budget_s=10.0)
+
+    assert result["optimal"]
+    assert result["total_cost"] == pytest.approx(_brute_force(lines, seller_fixed_cost))
+
+
+def test_split_only_line_is_consolidated_with_other_lines():
+    # No seller stocks 100 of the first part, so it can only be covered by a split
+    split_part = {
+        "mpn": "SPLIT",
+        "sellers": [_seller("A", "A1", 60, 1.0), _seller("B", "B1", 60, 1.2), _seller("C", "C1", 50, 0.9)],
+    }
+    assert build_candidates([split_part], 100) == []
+    split_line = build_candidates([split_part], 100, allow_split=True)
+    assert [len(c.allocations) for c in split_line] == [2]
+
+    other_part = {"mpn": "OTHER", "sellers": [_seller("A", "A2", 100, 2.0), _seller("D", "D1", 100, 1.5)]}
+    lines = [split_line, build_candidates([other_part], 10, allow_split=True)]
+    result = solve_assignment(lines, seller_fixed_cost=15.0, time_budget_s=10.0)
+
+    assert result["optimal"]
+    assert result["total_cost"] == pytest.approx(_brute_force(lines, 15.0))
+    assert result["sellers"] == ["A", "C"]
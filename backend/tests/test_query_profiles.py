@@ -0,0 +1,20 @@
+from backend.src.tools.procurement.query_manager import PROFILE_ORDER, QUERY_PROFILES, parse_selection
+
+
+def _missing(narrow: dict, wide: dict, path: str = "") -> list:
+    """Fields selected by `narrow` that `wide` does not select."""
+    missing = []
+    for field, sub in narrow.items():
+        if field not in wide:
+            missing.append(f"{path}{field}")
+        elif sub is not None:
+            missing.extend(_missing(sub, wide[field] or {}, f"{path}{field}."))
+    return missing
+
+
+def test_every_profile_is_answerable_from_the_wider_ones():
+    assert set(PROFILE_ORDER) == set(QUERY_PROFILES)
+    for index, narrow in enumerate(PROFILE_ORDER):
+        for wide in PROFILE_ORDER[index + 1 :]:
+            missing = _missing(parse_selection(QUERY_PROFILES[narrow]), parse_selection(QUERY_PROFILES[wide]))
+            assert not missing, f"{wide} lacks fields of {narrow}: {missing}"
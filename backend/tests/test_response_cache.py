@@ -0,0 +1,25 @@
+import dspy
+
+from backend.src.auth_context import is_mock_user_context
+from backend.src.response_cache import ResponseCache
+
+
+def _lookup_as(cache: ResponseCache, mock: bool, query: str):
+    token = is_mock_user_context.set(mock)
+    try:
+        return cache.lookup(query, dspy.History(messages=[]), "test-model")
+    finally:
+        is_mock_user_context.reset(token)
+
+
+def test_mock_and_real_users_do_not_share_answers():
+    cache = ResponseCache(semantic=False)
+    query = "What is the lead time of an unusual test widget 7731?"
+
+    prediction, state = _lookup_as(cache, False, query)
+    assert prediction is None
+    cache.store_prediction(state, dspy.Prediction(process_result="real answer", trajectory={}))
+
+    assert _lookup_as(cache, True, query)[0] is None
+    cached, _ = _lookup_as(cache, False, query)
+    assert cached is not None and cached.process_result == "real answer"
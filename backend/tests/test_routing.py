@@ -0,0 +1,20 @@
+import dspy
+import pytest
+
+from backend.src.routing import QueryRouter
+
+HISTORY = dspy.History(messages=[{"user_query": "Extract the BOM", "process_result": "Reference ID: BOM_1A2B3C4D"}])
+
+
+@pytest.mark.parametrize(
+    "query, use_planner, reason",
+    [
+        ("Check feasibility of BOM_1A2B3C4D for 50 pcs", False, "explicit_reference"),
+        ("Compare BOM_1A2B3C4D with the parts from above", True, "back_reference"),
+        ("Use the same quantity as before for SEARCH_9F8E7D6C", True, "back_reference"),
+    ],
+)
+def test_back_reference_wins_over_explicit_id(query, use_planner, reason):
+    decision = QueryRouter.classify_by_rules(query, HISTORY)
+    assert decision is not None
+    assert (decision.use_planner, decision.reason) == (use_planner, reason)
@@ -0,0 +1,21 @@
+import pytest
+
+from backend.src.speculation import SPECULATIVE_TOOLS, SpeculationScope
+
+
+@pytest.mark.parametrize(
+    "query, amount",
+    [
+        ("Extract the BOM (file_path: '/tmp/x.pdf')", None),
+        ("Is this feasible? (file_path: '/tmp/x.pdf')", None),
+        ("Is this feasible for 50 pcs? (file_path: '/tmp/x.pdf')", 50),
+        ("Ist das für 40 Geräte machbar? (file_path: '/tmp/x.pdf')", 40),
+        ("Is this feasible for 50 units in 3 weeks? (file_path: '/tmp/x.pdf')", None),
+    ],
+)
+def test_feasibility_prefetch_needs_explicit_request(query, amount):
+    assert SpeculationScope(query).feasibility_amount == amount
+
+
+def test_only_read_only_tools_are_prefetched():
+    assert "sort_and_filter_by_best_price" not in SPECULATIVE_TOOLS
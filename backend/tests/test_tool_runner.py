@@ -0,0 +1,36 @@
+import threading
+import time
+
+from backend.src.tool_runner import ToolRunner
+
+
+def optimize_order(bom: str) -> str:
+    time.sleep(0.2)
+    return f"optimized {bom}"
+
+
+def get_stock(product: str) -> str:
+    return f"stock {product}"
+
+
+def test_limited_tool_does_not_hold_other_tools_threads():
+    runner = ToolRunner([optimize_order, get_stock])  # optimize_order is limited to 1 by default
+    calls = [{"tool": "optimize_order", "args": {"bom": f"BOM_{i}"}} for i in range(10)]
+    thread = threading.Thread(target=runner.run_parallel, args=(calls,))
+    thread.start()
+    time.sleep(0.05)  # let the batch queue up
+
+    started = time.perf_counter()
+    result = runner.run_parallel([{"tool": "get_stock", "args": {"product": "P1"}}])
+
+    assert "stock P1" in result
+    assert time.perf_counter() - started < 0.5
+    thread.join()
+
+
+def test_invalid_tool_name_fails_only_its_call():
+    runner = ToolRunner([get_stock])
+    result = runner.run_parallel([{"tool": ["get_stock"], "args": {}}, {"tool": "get_stock", "args": {"product": "P1"}}])
+
+    assert "Error: unknown tool" in result
+    assert "stock P1" in result
@@ -0,0 +1,48 @@
+import dspy
+import pytest
+
+from backend.src.workflows import WorkflowEngine, WorkflowState
+
+EMPTY = dspy.History(messages=[])
+
+
+@pytest.mark.parametrize(
+    "query, amount",
+    [
+        ("Is BOM_1A2B3C4D feasible?", 1),
+        ("Is BOM_1A2B3C4D feasible for 50?", 50),
+        ("Can we build 250 of BOM_1A2B3C4D? check feasibility", 250),
+        ("Ist BOM_1A2B3C4D für 40 Geräte machbar?", 40),
+        ("check feasibility of BOM_1A2B3C4D, 20 pcs", 20),
+    ],
+)
+def test_order_amount(query, amount):
+    assert WorkflowState(query, EMPTY).order_amount == amount
+    assert WorkflowEngine().match(query, EMPTY) is not None
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "Is BOM_1A2B3C4D feasible 50?",
+        "Is BOM_1A2B3C4D feasible for 50 units in 3 weeks?",
+        "Check feasibility of BOM_1A2B3C4D for 1.5",
+    ],
+)
+def test_unclear_order_amount_falls_back_to_agent(query):
+    assert WorkflowState(query, EMPTY).order_amount is None
+    assert WorkflowEngine().match(query, EMPTY) is None
+
+
+@pytest.mark.parametrize(
+    "query, intents",
+    [
+        ("(file_path: '/tmp/x.pdf')", ["extract"]),
+        ("Extract the BOM (file_path: '/tmp/x.pdf')", ["extract"]),
+        ("Is this feasible for 50 pcs? (file_path: '/tmp/x.pdf')", ["extract", "feasibility"]),
+        ("Which material is specified for part 3? (file_path: '/tmp/x.pdf')", None),
+    ],
+)
+def test_upload_intents(query, intents):
+    matched = WorkflowEngine().match(query, EMPTY)
+    assert (matched and [step.intent for step in matched[0]]) == intents